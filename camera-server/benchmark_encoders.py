@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+録画エンコーダーのベンチマークスクリプト
+
+cv2.VideoWriter と ffmpegサブプロセスのエンコード速度・CPU使用量・ファイルサイズを比較する
+使い方: python benchmark_encoders.py [動画ファイル] [フレーム数]
+（動画ファイルを省略した場合は合成フレームを使用）
+"""
+
+import resource
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import cv2
+
+sys.path.append(str(Path(__file__).parent))
+from benchmark_motion import load_frames, synthetic_frames
+from video_encoders import FfmpegWriter, available_encoders, ffmpeg_available, V4L2M2M_DEVICE
+
+FPS = 30.0
+
+
+def cpu_seconds():
+    """このプロセスと終了した子プロセスのCPU時間の合計"""
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+
+def encoder_factories():
+    """比較するエンコーダーの一覧 (名前, 拡張子, 作成関数)"""
+    factories = [
+        ("opencv mp4v", lambda path, size: cv2.VideoWriter(
+            str(path), cv2.VideoWriter_fourcc(*"mp4v"), FPS, size)),
+    ]
+    if ffmpeg_available():
+        factories.append(("ffmpeg libx264 ultrafast", lambda path, size: FfmpegWriter(
+            path, FPS, size, codec="libx264", preset="ultrafast")))
+        factories.append(("ffmpeg libx264 veryfast", lambda path, size: FfmpegWriter(
+            path, FPS, size, codec="libx264", preset="veryfast")))
+        if "h264_v4l2m2m" in (available_encoders() or ()) and V4L2M2M_DEVICE.exists():
+            factories.append(("ffmpeg h264_v4l2m2m", lambda path, size: FfmpegWriter(
+                path, FPS, size, codec="h264_v4l2m2m")))
+    else:
+        print("ffmpegが見つからないため、ffmpegエンコーダーは計測しません")
+    return factories
+
+
+def run(factory, frames, path: Path):
+    """1つのエンコーダーで全フレームを書き込み、統計を返す"""
+    height, width = frames[0].shape[:2]
+    cpu_start = cpu_seconds()
+    start = time.perf_counter()
+
+    writer = factory(path, (width, height))
+    if not writer.isOpened():
+        return None
+    for frame in frames:
+        writer.write(frame)
+    # ffmpegは入力を閉じた後もエンコードが続くため、完了までを計測する
+    writer.release()
+
+    elapsed = time.perf_counter() - start
+    cpu = cpu_seconds() - cpu_start
+    return {
+        "fps": len(frames) / elapsed,
+        "cpu_percent": cpu / elapsed * 100,
+        "cpu_ms_per_frame": cpu / len(frames) * 1000,
+        "size_kb": path.stat().st_size / 1024 if path.exists() else 0
+    }
+
+
+def main():
+    """メイン処理"""
+    max_frames = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+
+    if len(sys.argv) > 1:
+        video_path = Path(sys.argv[1])
+        frames = load_frames(video_path, max_frames)
+        print(f"入力: {video_path} ({len(frames)}フレーム)")
+    else:
+        frames = synthetic_frames(max_frames)
+        print(f"入力: 合成フレーム ({len(frames)}フレーム)")
+
+    if not frames:
+        print("フレームが不足しています")
+        return
+
+    print(f"{'エンコーダー':>26} {'FPS':>8} {'CPU(%)':>8} {'CPU(ms/フレーム)':>16} {'サイズ(KB)':>12}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for index, (name, factory) in enumerate(encoder_factories()):
+            stats = run(factory, frames, Path(tmp) / f"bench_{index}.mp4")
+            if stats is None:
+                print(f"{name:>26} 起動できませんでした")
+                continue
+            print(f"{name:>26} {stats['fps']:>8.1f} {stats['cpu_percent']:>8.1f} "
+                  f"{stats['cpu_ms_per_frame']:>16.2f} {stats['size_kb']:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""
+動き検知のベンチマークスクリプト
+
+処理解像度ごとの1フレームあたりの検知コストを計測する
+使い方: python benchmark_motion.py [動画ファイル] [フレーム数]
+（動画ファイルを省略した場合は合成フレームを使用）
+
+背景モデルごとのコストと誤検知を比較する
+使い方: python benchmark_motion.py backends [動画ファイル ...] [--quiet 動きのない動画ファイル ...]
+（動画ファイルを省略した場合は recordings/ の録画を使用）
+誤検知は録画の動きのない区間（先頭のプリイベント分と、末尾のクールダウン分）と
+--quiet で指定した動画の全体で数える
+"""
+
+import os
+import sys
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+sys.path.append(str(Path(__file__).parent))
+from convert_recordings import is_recording_file
+from main import MotionDetector, MOTION_BACKENDS, RECORDINGS_DIR
+
+PROCESS_WIDTHS = [0, 320, 160]
+
+
+def load_frames(video_path: Path, max_frames: int):
+    """動画ファイルからフレームを読み込む"""
+    cap = cv2.VideoCapture(str(video_path))
+    frames = []
+    while len(frames) < max_frames:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append(frame)
+    cap.release()
+    return frames
+
+
+def video_fps(video_path: Path):
+    """動画ファイルのFPS（取得できなければ30）"""
+    cap = cv2.VideoCapture(str(video_path))
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    cap.release()
+    return fps if fps and fps > 0 else 30.0
+
+
+def quiet_ranges(frame_count: int, fps: float, margin: float = 0.5):
+    """録画の中で動きのない区間（フレーム番号の範囲のリスト）
+
+    録画の先頭はプリイベントバッファ（動き検知前のフレーム）、
+    末尾はクールダウン（動きがなくなってから録画停止まで）なので動体は写っていない
+    """
+    detector = MotionDetector()
+    lead = int((float(os.getenv("PRE_EVENT_SECONDS", "3")) - margin) * fps)
+    tail = int((detector.motion_cooldown - margin) * fps)
+    ranges = []
+    if lead > 1:
+        ranges.append((1, min(lead, frame_count)))
+    if tail > 0 and frame_count - tail > lead:
+        ranges.append((frame_count - tail, frame_count))
+    return ranges
+
+
+def synthetic_frames(max_frames: int, width: int = 640, height: int = 480):
+    """ノイズの上を矩形が横切る合成フレームを生成"""
+    rng = np.random.default_rng(0)
+    background = rng.integers(60, 90, (height, width, 3), dtype=np.uint8)
+    frames = []
+    for i in range(max_frames):
+        frame = background.copy()
+        noise = rng.integers(0, 8, (height, width, 3), dtype=np.uint8)
+        frame = cv2.add(frame, noise)
+        x = (i * 60) % (width + 150) - 150
+        cv2.rectangle(frame, (x, 150), (x + 150, 400), (220, 220, 220), -1)
+        frames.append(frame)
+    return frames
+
+
+def run(frames, process_width: int = 0, regions=None, backend: str = "frame_diff", quiet=None):
+    """1つの設定で全フレームを処理し、統計を返す
+
+    quiet: 動きのない区間（フレーム番号の範囲のリスト）。この区間での検知を誤検知として数える
+    """
+    detector = MotionDetector(process_width=process_width, backend=backend)
+    detector.required_init_frames = 1
+    if regions:
+        detector.set_regions(*regions)
+    quiet = quiet or []
+
+    timings = []
+    detected = 0
+    flagged = 0
+    events = 0
+    quiet_frames = 0
+    false_frames = 0
+    false_events = 0
+    previous = False
+    for i, frame in enumerate(frames):
+        start = time.perf_counter()
+        if detector.detect_motion(frame):
+            detected += 1
+        timings.append(time.perf_counter() - start)
+
+        # クールダウンは実時間に依存するため、フレーム単体の判定で集計する
+        in_quiet = any(first <= i < last for first, last in quiet)
+        quiet_frames += in_quiet
+        if detector.frame_motion:
+            flagged += 1
+            false_frames += in_quiet
+            if not previous:
+                events += 1
+                false_events += in_quiet
+        previous = detector.frame_motion
+
+    timings = np.array(timings[1:]) * 1000
+    return {
+        "avg_ms": timings.mean(),
+        "p95_ms": np.percentile(timings, 95),
+        "fps": 1000 / timings.mean(),
+        "detected": detected,
+        "flagged_ratio": flagged / len(frames),
+        "events": events,
+        "quiet_frames": quiet_frames,
+        "false_frames": false_frames,
+        "false_events": false_events
+    }
+
+
+def compare_backends(video_paths, quiet_paths=()):
+    """背景モデルごとのコスト・検知率・誤検知を録画クリップで比較"""
+    clips = []
+    for path in video_paths:
+        frames = load_frames(path, 900)
+        if len(frames) >= 2:
+            clips.append((path.name, frames, quiet_ranges(len(frames), video_fps(path))))
+    for path in quiet_paths:
+        frames = load_frames(path, 900)
+        if len(frames) >= 2:
+            clips.append((path.name, frames, [(1, len(frames))]))
+    if not clips:
+        print("比較できる録画クリップがありません（recordings/ に録画がないか、動画ファイルを指定してください）")
+        return
+
+    total_quiet = sum(last - first for _, _, quiet in clips for first, last in quiet)
+    print(f"録画クリップ: {len(clips)}件, 動きのない区間: {total_quiet}フレーム")
+    print(f"{'背景モデル':>16} {'平均(ms)':>10} {'p95(ms)':>10} {'検知率':>8} {'イベント':>8} "
+          f"{'誤検知':>6} {'誤検知率':>8}")
+    for backend in MOTION_BACKENDS:
+        timings, p95s, ratios = [], [], []
+        events = false_events = false_frames = quiet_frames = 0
+        for _, frames, quiet in clips:
+            stats = run(frames, backend=backend, quiet=quiet)
+            timings.append(stats["avg_ms"])
+            p95s.append(stats["p95_ms"])
+            ratios.append(stats["flagged_ratio"])
+            events += stats["events"]
+            false_events += stats["false_events"]
+            false_frames += stats["false_frames"]
+            quiet_frames += stats["quiet_frames"]
+
+        false_ratio = false_frames / quiet_frames if quiet_frames else 0.0
+        print(f"{backend:>16} {np.mean(timings):>10.2f} {np.mean(p95s):>10.2f} "
+              f"{np.mean(ratios):>8.1%} {events:>8} {false_events:>6} {false_ratio:>8.1%}")
+
+
+def main():
+    """メイン処理"""
+    if len(sys.argv) > 1 and sys.argv[1] == "backends":
+        args = sys.argv[2:]
+        quiet_index = args.index("--quiet") if "--quiet" in args else len(args)
+        paths = [Path(p) for p in args[:quiet_index]]
+        quiet_paths = [Path(p) for p in args[quiet_index + 1:]]
+        if not paths and not quiet_paths:
+            paths = [path for path in sorted(RECORDINGS_DIR.glob("motion_*.mp4")) if is_recording_file(path)][-10:]
+        compare_backends(paths, quiet_paths)
+        return
+
+    max_frames = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+
+    if len(sys.argv) > 1:
+        video_path = Path(sys.argv[1])
+        frames = load_frames(video_path, max_frames)
+        print(f"入力: {video_path} ({len(frames)}フレーム)")
+    else:
+        frames = synthetic_frames(max_frames)
+        print(f"入力: 合成フレーム ({len(frames)}フレーム)")
+
+    if len(frames) < 2:
+        print("フレームが不足しています")
+        return
+
+    height, width = frames[0].shape[:2]
+    # 画面上部1/3を除外した場合の比較用
+    exclusion = ([], [[(0, 0), (1, 0), (1, 0.33), (0, 0.33)]])
+
+    print(f"{'処理幅':>8} {'除外領域':>8} {'平均(ms)':>10} {'p95(ms)':>10} {'FPS':>8} {'検知':>6}")
+    for process_width in PROCESS_WIDTHS:
+        for regions in (None, exclusion):
+            stats = run(frames, process_width, regions)
+            label = process_width or width
+            print(f"{label:>8} {'あり' if regions else 'なし':>8} "
+                  f"{stats['avg_ms']:>10.2f} {stats['p95_ms']:>10.2f} "
+                  f"{stats['fps']:>8.1f} {stats['detected']:>6}")
+
+
+if __name__ == "__main__":
+    main()
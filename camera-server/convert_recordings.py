@@ -1,85 +1,354 @@
 #!/usr/bin/env python3
 """
 既存の録画ファイルをH.264形式に変換するスクリプト
+
+使い方:
+  python convert_recordings.py [--workers N] [--keep-backup]  変換（中断しても続きから再開）
+  python convert_recordings.py cleanup                        以前の変換で残った .backup.mp4 を削除
+  python convert_recordings.py thumb                          全録画のサムネイルを生成
+
+カメラサーバーからは BatchTranscoder を低優先度のバックグラウンド処理として呼び出す
 """
 
-import subprocess
+import argparse
+import json
+import logging
 import os
+import shutil
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import sys
 sys.path.append(str(Path(__file__).parent))
-from main import generate_thumbnail, THUMBNAILS_DIR
 
-def convert_video_to_h264(input_file, output_file):
+logger = logging.getLogger(__name__)
+
+TARGET_CODEC = "h264"
+TARGET_PIX_FMT = "yuv420p"  # ブラウザで再生できる形式
+MANIFEST_NAME = ".transcode_manifest.json"
+# マニフェストは録画ディレクトリの外に置く（録画ディレクトリはAPIで配信される）
+DEFAULT_MANIFEST_PATH = Path(os.getenv("CAMERA_DATA_DIR", "data")) / MANIFEST_NAME
+TEMP_SUFFIX = ".h264.mp4"
+BACKUP_SUFFIX = ".backup.mp4"
+
+
+def probe_video(input_file):
+    """動画のコーデック・画素形式・長さを取得（取得できなければNone）"""
+    try:
+        result = subprocess.run(
+            [
+                'ffprobe', '-v', 'error', '-select_streams', 'v:0',
+                '-show_entries', 'stream=codec_name,pix_fmt:format=duration',
+                '-of', 'json', str(input_file)
+            ],
+            capture_output=True, text=True, timeout=30)
+        if result.returncode != 0:
+            return None
+        data = json.loads(result.stdout)
+        stream = (data.get("streams") or [{}])[0]
+        return {
+            "codec": stream.get("codec_name"),
+            "pix_fmt": stream.get("pix_fmt"),
+            "duration": float(data.get("format", {}).get("duration") or 0)
+        }
+    except Exception as e:
+        logger.warning(f"動画情報の取得に失敗しました: {input_file.name} ({e})")
+        return None
+
+
+def convert_video_to_h264(input_file, output_file, threads=0, low_priority=False):
     """動画ファイルをH.264形式に変換"""
     try:
         cmd = [
-            'ffmpeg', '-i', str(input_file),
+            'ffmpeg', '-hide_banner', '-loglevel', 'error',
+            '-i', str(input_file),
             '-c:v', 'libx264',
             '-preset', 'fast',
             '-crf', '23',
+            '-pix_fmt', TARGET_PIX_FMT,
+            '-movflags', '+faststart',
+            '-threads', str(threads),
             '-y',  # 上書き
             str(output_file)
         ]
-        
+
+        # 低優先度で実行（カメラのキャプチャ・録画を妨げない）
+        # スレッドの多いカメラサーバー内でも安全なよう preexec_fn ではなく nice コマンドを使う
+        if low_priority and shutil.which("nice"):
+            cmd = ['nice', '-n', '10'] + cmd
         result = subprocess.run(cmd, capture_output=True, text=True)
-        
+
         if result.returncode == 0:
-            print(f"変換成功: {input_file.name} -> {output_file.name}")
+            logger.info(f"変換成功: {input_file.name} -> {output_file.name}")
             return True
         else:
-            print(f"変換失敗: {input_file.name}")
-            print(f"エラー: {result.stderr}")
+            logger.error(f"変換失敗: {input_file.name}: {result.stderr.strip()}")
             return False
-            
+
     except Exception as e:
-        print(f"変換エラー: {e}")
+        logger.error(f"変換エラー: {e}")
         return False
 
+
+def is_recording_file(path: Path):
+    """変換対象の録画ファイルか（一時ファイル・バックアップを除く）"""
+    return not path.name.endswith(TEMP_SUFFIX) and not path.name.endswith(BACKUP_SUFFIX)
+
+
+class BatchTranscoder:
+    """録画ファイルの一括変換（並列実行・マニフェストによる再開）"""
+
+    def __init__(self, recordings_dir=Path("recordings"), workers=2, keep_backup=False,
+                 low_priority=False, threads_per_worker=0, exclude=None, on_converted=None,
+                 manifest_path=None):
+        self.recordings_dir = Path(recordings_dir)
+        self.workers = max(1, workers)
+        self.keep_backup = keep_backup
+        self.low_priority = low_priority
+        self.threads_per_worker = threads_per_worker
+        self.exclude = exclude  # 変換しないパスの集合を返す関数（録画中のファイルなど）
+        self.on_converted = on_converted  # 変換後のパスを受け取る関数
+        self.manifest_path = Path(manifest_path or DEFAULT_MANIFEST_PATH)
+        self.manifest = {}
+        self.lock = threading.Lock()
+        self.thread = None
+        self.stop_event = threading.Event()
+        self._reset_stats()
+
+    def _reset_stats(self):
+        """統計情報を初期化"""
+        self.stats = {
+            "running": False,
+            "total": 0,
+            "converted": 0,
+            "skipped": 0,
+            "resumed": 0,
+            "failed": 0,
+            "in_progress": 0,
+            "input_bytes": 0,
+            "output_bytes": 0,
+            "media_seconds": 0.0,
+            "started_at": None,
+            "finished_at": None
+        }
+
+    def _load_manifest(self):
+        """マニフェストを読み込む"""
+        legacy_path = self.recordings_dir / MANIFEST_NAME
+        if legacy_path.exists() and not self.manifest_path.exists():
+            # 以前は録画ディレクトリに置いていたため移動する
+            self.manifest_path.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(legacy_path, self.manifest_path)
+        try:
+            with open(self.manifest_path) as f:
+                self.manifest = json.load(f)
+        except (OSError, ValueError):
+            self.manifest = {}
+
+    def _save_manifest(self):
+        """マニフェストを保存（一時ファイルから置き換えて破損を防ぐ）"""
+        self.manifest_path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = self.manifest_path.with_suffix(".tmp")
+        with open(temp_path, "w") as f:
+            json.dump(self.manifest, f, ensure_ascii=False, indent=1)
+        os.replace(temp_path, self.manifest_path)
+
+    def _record(self, path: Path, status: str, **info):
+        """ファイルの処理結果をマニフェストに記録"""
+        stat = path.stat()
+        with self.lock:
+            self.manifest[path.name] = {
+                "status": status,
+                "size": stat.st_size,
+                "mtime": stat.st_mtime,
+                **info
+            }
+            self._save_manifest()
+
+    def _is_finished(self, path: Path):
+        """前回の実行で処理済み（かつその後変更されていない）か"""
+        entry = self.manifest.get(path.name)
+        if not entry or entry.get("status") not in ("converted", "skipped"):
+            return False
+        stat = path.stat()
+        return entry.get("size") == stat.st_size and entry.get("mtime") == stat.st_mtime
+
+    def _cleanup_temp_files(self):
+        """中断した変換の一時ファイルを削除"""
+        for temp_file in self.recordings_dir.glob(f"*{TEMP_SUFFIX}"):
+            temp_file.unlink(missing_ok=True)
+            logger.info(f"中断した変換の一時ファイルを削除しました: {temp_file.name}")
+
+    def _process(self, path: Path):
+        """1ファイルを確認・変換"""
+        if self.stop_event.is_set():
+            return
+        info = probe_video(path)
+        if info is None:
+            with self.lock:
+                self.stats["failed"] += 1
+            return
+
+        if info["codec"] == TARGET_CODEC and info["pix_fmt"] == TARGET_PIX_FMT:
+            # すでに目的の形式なので変換しない
+            self._record(path, "skipped", codec=info["codec"])
+            with self.lock:
+                self.stats["skipped"] += 1
+            return
+
+        with self.lock:
+            self.stats["in_progress"] += 1
+        input_size = path.stat().st_size
+        temp_file = path.with_name(path.stem + TEMP_SUFFIX)
+        try:
+            ok = convert_video_to_h264(
+                path, temp_file, self.threads_per_worker, self.low_priority)
+            if ok:
+                if self.keep_backup:
+                    os.replace(path, path.with_name(path.stem + BACKUP_SUFFIX))
+                # 元ファイルを変換済みファイルで置き換える
+                os.replace(temp_file, path)
+                self._record(path, "converted", codec=TARGET_CODEC, source_codec=info["codec"])
+                if self.on_converted:
+                    self.on_converted(path)
+                with self.lock:
+                    self.stats["converted"] += 1
+                    self.stats["input_bytes"] += input_size
+                    self.stats["output_bytes"] += path.stat().st_size
+                    self.stats["media_seconds"] += info["duration"]
+            else:
+                temp_file.unlink(missing_ok=True)
+                if not self.stop_event.is_set():
+                    self._record(path, "failed", source_codec=info["codec"])
+                    with self.lock:
+                        self.stats["failed"] += 1
+        finally:
+            with self.lock:
+                self.stats["in_progress"] -= 1
+
+    def run(self):
+        """変換を実行（中断しても次回はマニフェストから再開）"""
+        self._reset_stats()
+        self.stop_event.clear()
+        self.stats["running"] = True
+        self.stats["started_at"] = time.time()
+        try:
+            if not self.recordings_dir.exists():
+                logger.warning("recordingsディレクトリが見つかりません")
+                return self.get_stats()
+
+            self._load_manifest()
+            self._cleanup_temp_files()
+
+            # 削除済みファイルの記録は残さない
+            self.manifest = {
+                name: entry for name, entry in self.manifest.items()
+                if (self.recordings_dir / name).exists()
+            }
+
+            excluded = self.exclude() if self.exclude else set()
+            files = [
+                path for path in sorted(self.recordings_dir.glob("*.mp4"))
+                if is_recording_file(path) and path not in excluded
+            ]
+            pending = [path for path in files if not self._is_finished(path)]
+            self.stats["total"] = len(files)
+            self.stats["resumed"] = len(files) - len(pending)
+            logger.info(
+                f"変換対象ファイル数: {len(pending)} (処理済み: {self.stats['resumed']}, ワーカー数: {self.workers})")
+
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="transcode") as executor:
+                list(executor.map(self._process, pending))
+        finally:
+            self.stats["running"] = False
+            self.stats["finished_at"] = time.time()
+
+        stats = self.get_stats()
+        logger.info(
+            f"変換処理完了: 変換 {stats['converted']}, スキップ {stats['skipped']}, 失敗 {stats['failed']} "
+            f"({stats['files_per_second']:.2f}ファイル/秒, {stats['input_mb_per_second']:.1f}MB/秒, "
+            f"再生時間の{stats['realtime_factor']:.1f}倍速)")
+        return stats
+
+    def start_background(self):
+        """バックグラウンドスレッドで変換を開始（実行中ならFalse）"""
+        with self.lock:
+            if self.thread and self.thread.is_alive():
+                return False
+            self.thread = threading.Thread(target=self.run, name="batch-transcoder")
+            self.thread.daemon = True
+            self.thread.start()
+            return True
+
+    def stop(self):
+        """実行中の変換の完了後に停止（未処理のファイルは次回再開）"""
+        self.stop_event.set()
+
+    def get_stats(self):
+        """進捗とスループットを取得"""
+        with self.lock:
+            stats = dict(self.stats)
+        if stats["started_at"]:
+            elapsed = (stats["finished_at"] or time.time()) - stats["started_at"]
+        else:
+            elapsed = 0.0
+        processed = stats["converted"] + stats["skipped"] + stats["failed"]
+        stats["elapsed"] = round(elapsed, 2)
+        stats["pending"] = max(0, stats["total"] - stats["resumed"] - processed)
+        stats["files_per_second"] = processed / elapsed if elapsed else 0.0
+        stats["input_mb_per_second"] = stats["input_bytes"] / 1024 / 1024 / elapsed if elapsed else 0.0
+        stats["realtime_factor"] = stats["media_seconds"] / elapsed if elapsed else 0.0
+        return stats
+
+
+def cleanup_backups(recordings_dir=Path("recordings")):
+    """以前の変換で残った .backup.mp4 を削除（変換済みの元ファイルがあるものだけ）"""
+    freed = 0
+    for backup_file in Path(recordings_dir).glob(f"*{BACKUP_SUFFIX}"):
+        original = backup_file.with_name(backup_file.name[:-len(BACKUP_SUFFIX)] + ".mp4")
+        if not original.exists():
+            print(f"元ファイルがないため残します: {backup_file.name}")
+            continue
+        freed += backup_file.stat().st_size
+        backup_file.unlink()
+        print(f"削除: {backup_file.name}")
+    print(f"バックアップ削除完了: {freed / 1024 / 1024:.1f}MB 解放")
+
+
 def main():
     """メイン処理"""
-    recordings_dir = Path("recordings")
-    
-    if not recordings_dir.exists():
-        print("recordingsディレクトリが見つかりません")
+    parser = argparse.ArgumentParser(description="録画ファイルをH.264形式に変換")
+    parser.add_argument("mode", nargs="?", default="convert", choices=["convert", "cleanup", "thumb"])
+    parser.add_argument("--dir", default="recordings", help="録画ディレクトリ")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="並列実行するffmpegの数")
+    parser.add_argument("--keep-backup", action="store_true", help="変換前のファイルを .backup.mp4 として残す")
+    args = parser.parse_args()
+
+    if args.mode == "thumb":
+        generate_thumbnails_for_all_recordings()
         return
-    
-    # MP4ファイルを検索
-    mp4_files = list(recordings_dir.glob("*.mp4"))
-    
-    if not mp4_files:
-        print("変換対象のMP4ファイルが見つかりません")
+    if args.mode == "cleanup":
+        cleanup_backups(Path(args.dir))
         return
-    
-    print(f"変換対象ファイル数: {len(mp4_files)}")
-    
-    for mp4_file in mp4_files:
-        print(f"処理中: {mp4_file.name}")
-        
-        # 一時ファイル名
-        temp_file = mp4_file.with_suffix('.h264.mp4')
-        
-        # 変換実行
-        if convert_video_to_h264(mp4_file, temp_file):
-            # 元ファイルをバックアップ
-            backup_file = mp4_file.with_suffix('.backup.mp4')
-            mp4_file.rename(backup_file)
-            
-            # 変換済みファイルを元の名前に変更
-            temp_file.rename(mp4_file)
-            
-            print(f"完了: {mp4_file.name}")
-        else:
-            print(f"スキップ: {mp4_file.name}")
-    
-    print("変換処理完了")
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    transcoder = BatchTranscoder(Path(args.dir), workers=args.workers, keep_backup=args.keep_backup)
+    try:
+        transcoder.run()
+    except KeyboardInterrupt:
+        transcoder.stop()
+        print("中断しました（次回は続きから再開します）")
+
 
 def generate_thumbnails_for_all_recordings():
+    from main import generate_thumbnail, THUMBNAILS_DIR
     recordings_dir = Path("recordings")
     if not recordings_dir.exists():
         print("recordingsディレクトリが見つかりません")
         return
-    mp4_files = list(recordings_dir.glob("*.mp4"))
+    mp4_files = [path for path in recordings_dir.glob("*.mp4") if is_recording_file(path)]
     if not mp4_files:
         print("MP4ファイルが見つかりません")
         return
@@ -95,7 +364,4 @@ def generate_thumbnails_for_all_recordings():
     print("サムネイル生成処理完了")
 
 if __name__ == "__main__":
-    if len(sys.argv) > 1 and sys.argv[1] == "thumb":
-        generate_thumbnails_for_all_recordings()
-    else:
-        main() 
\ No newline at end of file
+    main()
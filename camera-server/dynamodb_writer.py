@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+DynamoDB へのまとめ書き込み
+
+IoTコマンドのレスポンスを1件ずつ put_item せず、待ち行列に登録して専用スレッドから
+batch_writer でまとめて書き込む。件数（最大25件）または経過時間で書き込み、
+未処理の項目は batch_writer が再送する。失敗した書き込みはバックオフして再試行する
+
+table は boto3 の Table と同じく batch_writer() を持つオブジェクトであればよい
+（ローカルの DynamoDB や moto のスタブでも動作する）
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+BATCH_WRITE_LIMIT = 25  # BatchWriteItem の1回あたりの上限
+
+
+class BatchedTableWriter:
+    """DynamoDB テーブルへのまとめ書き込み"""
+
+    def __init__(self, table, max_batch: int = BATCH_WRITE_LIMIT, flush_interval: float = 0.2,
+                 max_queue: int = 1000, max_attempts: int = 5, backoff_base: float = 0.5,
+                 key_names=None):
+        self.table = table
+        self.max_batch = max(1, min(max_batch, BATCH_WRITE_LIMIT))
+        self.flush_interval = flush_interval  # 最初の項目を登録してから書き込むまでの最大秒数
+        self.max_queue = max_queue
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.key_names = key_names  # 同じキーの項目は1回の書き込みで最後のものだけ書く
+        self.items = deque()  # (項目, 登録時刻, 試行回数)
+        self.retry_at = 0.0
+        self.condition = threading.Condition()
+        self.thread = None
+        self.stopping = False
+
+        # 統計情報
+        self.written = 0
+        self.batches = 0
+        self.failed = 0
+        self.dropped = 0
+        self.retries = 0
+        self.total_latency = 0.0
+        self.last_error = None
+
+    def start(self):
+        """書き込みスレッドを開始"""
+        with self.condition:
+            if self.thread and self.thread.is_alive():
+                return False
+            self.stopping = False
+            self.thread = threading.Thread(target=self._run, name="dynamodb-writer", daemon=True)
+            self.thread.start()
+        return True
+
+    def stop(self, timeout: float = 5.0):
+        """残りを書き込んで停止"""
+        with self.condition:
+            self.stopping = True
+            self.condition.notify_all()
+        if self.thread:
+            self.thread.join(timeout=timeout)
+
+    def put(self, item: dict):
+        """項目を登録（書き込みは待たない、上限を超えたら古いものから破棄）"""
+        with self.condition:
+            if len(self.items) >= self.max_queue:
+                self.items.popleft()
+                self.dropped += 1
+            self.items.append((item, time.time(), 0))
+            # 最初の項目（時間の計測開始）と件数がそろった時だけ起こす
+            if len(self.items) == 1 or len(self.items) >= self.max_batch:
+                self.condition.notify_all()
+
+    def _take_batch(self):
+        """書き込む項目を取り出す（件数・経過時間の条件を満たすまで待つ）"""
+        with self.condition:
+            while True:
+                now = time.time()
+                if self.items:
+                    wait = max(self.retry_at - now, self.items[0][1] + self.flush_interval - now)
+                    full = len(self.items) >= self.max_batch and self.retry_at <= now
+                    if self.stopping or full or wait <= 0:
+                        count = min(self.max_batch, len(self.items))
+                        return [self.items.popleft() for _ in range(count)]
+                    self.condition.wait(wait)
+                elif self.stopping:
+                    return None
+                else:
+                    self.condition.wait()
+
+    def _run(self):
+        """登録された項目をまとめて書き込む"""
+        while True:
+            batch = self._take_batch()
+            if batch is None:
+                return
+            self._write(batch)
+
+    def _write(self, batch):
+        """batch_writer で書き込み（失敗したら待ち行列の先頭に戻して再試行）"""
+        try:
+            kwargs = {"overwrite_by_pkeys": self.key_names} if self.key_names else {}
+            with self.table.batch_writer(**kwargs) as writer:
+                for item, _, _ in batch:
+                    writer.put_item(Item=item)
+        except Exception as e:
+            self.last_error = str(e)
+            retry = [(item, queued_at, attempts + 1) for item, queued_at, attempts in batch
+                     if attempts + 1 < self.max_attempts]
+            with self.condition:
+                self.failed += len(batch) - len(retry)
+                if retry:
+                    self.retries += 1
+                    delay = self.backoff_base * (2 ** retry[0][2])
+                    self.retry_at = time.time() + delay
+                    self.items.extendleft(reversed(retry))
+            logger.error(f"❌ DynamoDBまとめ書き込みエラー ({len(batch)}件): {e}")
+            return
+
+        now = time.time()
+        with self.condition:
+            self.written += len(batch)
+            self.batches += 1
+            self.retry_at = 0.0
+            self.total_latency += sum(now - queued_at for _, queued_at, _ in batch)
+        logger.debug(f"DynamoDBにまとめて書き込みました: {len(batch)}件")
+
+    def get_stats(self):
+        """書き込みの統計情報を取得"""
+        with self.condition:
+            return {
+                "running": bool(self.thread and self.thread.is_alive()),
+                "queued": len(self.items),
+                "written": self.written,
+                "batches": self.batches,
+                "avg_batch_size": round(self.written / self.batches, 2) if self.batches else 0,
+                "avg_latency_ms": round(self.total_latency / self.written * 1000, 1) if self.written else 0,
+                "retries": self.retries,
+                "failed": self.failed,
+                "dropped": self.dropped,
+                "last_error": self.last_error
+            }
@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+"""
+録画ファイル・サムネイルの配信（Rangeリクエスト・条件付きGET対応）
+
+mmap したファイルの memoryview を大きなチャンクで送信し、Python側でファイルを読み込むループを回さない。
+ETag・Last-Modified で変更のないファイルには本文なしの304を返す
+"""
+
+import mmap
+import os
+import threading
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+from pathlib import Path
+
+from fastapi.responses import Response
+
+CHUNK_SIZE = 16 * mmap.ALLOCATIONGRANULARITY  # 1チャンクの大きさ（既定では1MiB）
+MAX_RANGES = 32  # これを超える範囲指定は無視して全体を返す
+
+
+def file_validators(stat):
+    """ファイルのETag（inode・サイズ・更新日時から作成）とLast-Modifiedを取得"""
+    etag = f'"{stat.st_ino:x}-{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+    return etag, formatdate(stat.st_mtime, usegmt=True)
+
+
+def _parse_http_date(value: str):
+    """HTTPの日付をUNIX時刻に変換（不正な場合はNone）"""
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+def _etag_list(value: str):
+    """If-None-Match などのETagのリストを取得（弱いETagの W/ は外す）"""
+    return [tag.strip().removeprefix("W/") for tag in value.split(",") if tag.strip()]
+
+
+def is_not_modified(request_headers, etag: str, mtime: float):
+    """If-None-Match・If-Modified-Since から304を返せるか判定
+
+    If-None-Match がある場合は If-Modified-Since を見ない
+    """
+    if_none_match = request_headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = _etag_list(if_none_match)
+        return "*" in tags or etag in tags
+
+    if_modified_since = request_headers.get("if-modified-since")
+    if if_modified_since:
+        since = _parse_http_date(if_modified_since)
+        return since is not None and int(mtime) <= since
+    return False
+
+
+def if_range_matches(request_headers, etag: str, mtime: float):
+    """If-Range の条件を満たすか判定（満たさない場合はRangeを無視して全体を返す）"""
+    if_range = request_headers.get("if-range")
+    if not if_range:
+        return True
+    if_range = if_range.strip()
+    if if_range.startswith("W/"):
+        # 弱いETagは If-Range では一致しない
+        return False
+    if if_range.startswith('"'):
+        return if_range == etag
+    since = _parse_http_date(if_range)
+    return since is not None and int(mtime) == since
+
+
+def not_modified_response(headers: dict):
+    """304レスポンス（本文なし）"""
+    return Response(status_code=304, headers=headers)
+
+
+class FileCache:
+    """よく参照される小さなファイル（サムネイルなど）のメモリ上のLRUキャッシュ
+
+    ETagが変わったファイル（再生成されたサムネイルなど）は読み直す
+    """
+
+    def __init__(self, max_bytes: int, max_file_bytes: int = 512 * 1024):
+        self.max_bytes = max_bytes
+        self.max_file_bytes = max_file_bytes
+        self.entries = OrderedDict()  # パス -> (ETag, データ)
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+
+        # 統計情報
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, path: Path, etag: str):
+        """ファイルの内容を取得（キャッシュになければ読み込んで登録）"""
+        key = str(path)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry[0] == etag:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        with open(path, "rb") as file:
+            data = file.read()
+
+        if len(data) <= self.max_file_bytes:
+            with self.lock:
+                previous = self.entries.pop(key, None)
+                if previous:
+                    self.total_bytes -= len(previous[1])
+                self.entries[key] = (etag, data)
+                self.total_bytes += len(data)
+                while self.total_bytes > self.max_bytes and self.entries:
+                    _, (_, evicted) = self.entries.popitem(last=False)
+                    self.total_bytes -= len(evicted)
+                    self.evictions += 1
+        return data
+
+    def discard(self, path: Path):
+        """キャッシュから削除"""
+        with self.lock:
+            entry = self.entries.pop(str(path), None)
+            if entry:
+                self.total_bytes -= len(entry[1])
+
+    def get_stats(self):
+        """キャッシュの統計情報を取得"""
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions
+            }
+
+
+def parse_range_header(range_header: str, file_size: int):
+    """Rangeヘッダーを解析
+
+    (開始, 終了) のリストを返す（重なる範囲はまとめる）。
+    ヘッダーが不正・bytes単位でない場合はNone（全体を返す）、
+    満たせる範囲がない場合は空のリスト（416を返す）
+    """
+    if not range_header:
+        return None
+    unit, _, spec = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or not spec.strip():
+        return None
+
+    ranges = []
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        start_str, dash, end_str = part.partition("-")
+        if not dash:
+            return None
+        start_str, end_str = start_str.strip(), end_str.strip()
+        try:
+            if start_str == "":
+                # 末尾からの指定（bytes=-N）
+                suffix = int(end_str)
+                if suffix < 0:
+                    return None
+                if suffix == 0:
+                    continue
+                start, end = max(0, file_size - suffix), file_size - 1
+            else:
+                start = int(start_str)
+                end = int(end_str) if end_str else None
+                if start < 0 or (end is not None and end < start):
+                    return None
+                end = file_size - 1 if end is None else min(end, file_size - 1)
+        except ValueError:
+            return None
+
+        if start < file_size:
+            ranges.append((start, end))
+
+    if len(ranges) > MAX_RANGES:
+        return None
+
+    # 重なる・隣接する範囲をまとめる
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+class RangeFileResponse(Response):
+    """ファイルの全体・単一範囲・複数範囲（multipart/byteranges）を返すレスポンス
+
+    送信前に開いたファイルの大きさを確認し、変換での置き換えなどで変わっていれば
+    範囲とヘッダーを作り直す（満たせる範囲がなくなれば416を返す）
+    """
+
+    def __init__(self, path: Path, file_size: int, ranges=None, headers: dict = None,
+                 media_type: str = "application/octet-stream"):
+        self.path = Path(path)
+        self.media_type_value = media_type
+        self.base_headers = dict(headers or {})
+        self.boundary = os.urandom(8).hex()
+        status_code, headers = self._prepare(file_size, ranges or [])
+
+        super().__init__(content=None, status_code=status_code, headers=headers)
+        # Content-Typeは上で設定済み
+        self.media_type = None
+
+    def _prepare(self, file_size: int, ranges):
+        """ファイルの大きさと範囲からステータスコードとヘッダーを作成"""
+        self.file_size = file_size
+        self.ranges = ranges
+        self.parts = []  # (パートのヘッダー, 開始, 終了)
+        media_type = self.media_type_value
+
+        headers = dict(self.base_headers)
+        headers["Accept-Ranges"] = "bytes"
+        if not self.ranges:
+            status_code = 200
+            content_length = file_size
+            headers["Content-Type"] = media_type
+        elif len(self.ranges) == 1:
+            status_code = 206
+            start, end = self.ranges[0]
+            content_length = end - start + 1
+            headers["Content-Type"] = media_type
+            headers["Content-Range"] = f"bytes {start}-{end}/{file_size}"
+        else:
+            status_code = 206
+            content_length = 0
+            for start, end in self.ranges:
+                part_header = (
+                    f"--{self.boundary}\r\n"
+                    f"Content-Type: {media_type}\r\n"
+                    f"Content-Range: bytes {start}-{end}/{file_size}\r\n\r\n"
+                ).encode()
+                self.parts.append((part_header, start, end))
+                content_length += len(part_header) + (end - start + 1) + 2
+            content_length += len(f"--{self.boundary}--\r\n")
+            headers["Content-Type"] = f"multipart/byteranges; boundary={self.boundary}"
+        headers["Content-Length"] = str(content_length)
+        return status_code, headers
+
+    def _refresh(self, stat):
+        """開いたファイルが応答の作成時と変わっていれば範囲とヘッダーを作り直す"""
+        etag, last_modified = file_validators(stat)
+        if stat.st_size == self.file_size and self.base_headers.get("ETag", etag) == etag:
+            return
+        if "ETag" in self.base_headers:
+            self.base_headers["ETag"] = etag
+            self.base_headers["Last-Modified"] = last_modified
+
+        ranges = []
+        for start, end in self.ranges:
+            if start < stat.st_size:
+                ranges.append((start, min(end, stat.st_size - 1)))
+        if self.ranges and not ranges:
+            # 要求された範囲がファイルの外になった
+            self.status_code = 416
+            self.file_size, self.ranges, self.parts = stat.st_size, [], []
+            self.init_headers({**self.base_headers, "Content-Range": f"bytes */{stat.st_size}",
+                               "Content-Length": "0"})
+            return
+        self.status_code, headers = self._prepare(stat.st_size, ranges)
+        self.init_headers(headers)
+
+    def init_headers(self, headers=None):
+        """Content-Lengthを自動で付けない（ファイルの長さから設定済み）"""
+        self.raw_headers = [
+            (key.lower().encode("latin-1"), value.encode("latin-1"))
+            for key, value in (headers or {}).items()
+        ]
+
+    async def __call__(self, scope, receive, send):
+        try:
+            file = open(self.path, "rb")
+        except FileNotFoundError:
+            # 応答の作成後に削除された
+            await send({"type": "http.response.start", "status": 404, "headers": []})
+            await send({"type": "http.response.body", "body": b""})
+            return
+        with file:
+            # ヘッダーを送る前に、開いたファイルの大きさで範囲を確認し直す
+            self._refresh(os.fstat(file.fileno()))
+            await send({
+                "type": "http.response.start",
+                "status": self.status_code,
+                "headers": self.raw_headers,
+            })
+            if scope.get("method") == "HEAD" or self.status_code == 416:
+                await send({"type": "http.response.body", "body": b""})
+                return
+
+            if not self.ranges:
+                segments = [(b"", 0, self.file_size - 1)]
+            elif len(self.ranges) == 1:
+                segments = [(b"", *self.ranges[0])]
+            else:
+                segments = self.parts
+            await self._send_mmap(file, segments, send)
+
+    async def _send_mmap(self, file, segments, send):
+        """mmapしたファイルの memoryview を大きなチャンクで送信"""
+        if self.file_size == 0:
+            await send({"type": "http.response.body", "body": self._closing(), "more_body": False})
+            return
+
+        with mmap.mmap(file.fileno(), self.file_size, access=mmap.ACCESS_READ) as mapped:
+            view = memoryview(mapped)
+            try:
+                for part_header, start, end in segments:
+                    if part_header:
+                        await send({"type": "http.response.body", "body": part_header, "more_body": True})
+                    position = start
+                    while position <= end:
+                        # 2チャンク目以降はページ境界に揃える
+                        chunk_end = min(end + 1, (position // CHUNK_SIZE + 1) * CHUNK_SIZE)
+                        await send({
+                            "type": "http.response.body",
+                            "body": view[position:chunk_end],
+                            "more_body": True,
+                        })
+                        position = chunk_end
+                    if self.parts:
+                        await send({"type": "http.response.body", "body": b"\r\n", "more_body": True})
+                await send({"type": "http.response.body", "body": self._closing(), "more_body": False})
+            finally:
+                view.release()
+
+    def _closing(self):
+        """multipartの終端"""
+        return f"--{self.boundary}--\r\n".encode() if self.parts else b""
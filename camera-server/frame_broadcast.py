@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+エンコード済みフレームの配信
+
+キャプチャスレッドが公開したフレームを1ティックにつき1回だけJPEGにエンコードし、
+接続中のすべての視聴者に同じバイト列を配信する
+"""
+
+import asyncio
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class FrameSubscriber:
+    """配信先（視聴者）ごとの受信スロット
+
+    最新フレームのみを保持するため、送信が遅いクライアントは古いフレームを読み飛ばす
+    """
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.event = asyncio.Event()
+        self.last_index = 0
+        self.sent = 0
+        self.dropped = 0
+
+    def notify(self):
+        """新しいフレームを通知（エンコーダースレッドから呼ばれる）"""
+        self.loop.call_soon_threadsafe(self.event.set)
+
+
+class FrameBroadcaster:
+    """JPEGフレームの一斉配信"""
+
+    def __init__(self, frame_source, encoder, quality: int = 80):
+        self.frame_source = frame_source
+        self.encoder = encoder
+        self.quality = quality
+        self.subscribers = set()
+        self.lock = threading.Lock()
+        self.has_subscribers = threading.Event()
+        self.thread = None
+        self.stop_flag = False
+
+        # 最新のエンコード済みフレーム
+        self.latest_seq = 0
+        self.latest_jpeg = None
+
+        # 統計情報
+        self.encoded_frames = 0
+        self.total_encode_time = 0.0
+
+    def start(self):
+        """エンコーダースレッドを開始"""
+        if self.thread and self.thread.is_alive():
+            return
+
+        self.stop_flag = False
+        self.thread = threading.Thread(
+            target=self._encoder_worker, name="frame-broadcast")
+        self.thread.daemon = True
+        self.thread.start()
+        logger.info("フレーム配信スレッドを開始しました")
+
+    def stop(self):
+        """エンコーダースレッドを停止"""
+        self.stop_flag = True
+        self.has_subscribers.set()  # 待機中のスレッドを起こす
+        if self.thread and self.thread.is_alive():
+            self.thread.join(timeout=5.0)
+        self.thread = None
+
+    def _encoder_worker(self):
+        """エンコーダーワーカー（視聴者がいる間だけ最新フレームをエンコード）"""
+        last_seq = 0
+        while not self.stop_flag:
+            if not self.has_subscribers.wait(timeout=1.0):
+                continue
+
+            seq, frame, _ = self.frame_source.wait_for_frame(last_seq, timeout=1.0)
+            if frame is None or self.stop_flag:
+                continue
+            last_seq = seq
+
+            try:
+                start = time.time()
+                jpeg = self.encoder(seq, frame, self.quality)
+                elapsed = time.time() - start
+            except Exception as e:
+                logger.error(f"配信用エンコードエラー: {e}")
+                continue
+
+            with self.lock:
+                self.latest_seq = seq
+                self.latest_jpeg = jpeg
+                self.encoded_frames += 1
+                self.total_encode_time += elapsed
+                subscribers = list(self.subscribers)
+
+            for subscriber in subscribers:
+                subscriber.notify()
+
+    def subscribe(self):
+        """視聴者を登録"""
+        subscriber = FrameSubscriber(asyncio.get_running_loop())
+        with self.lock:
+            self.subscribers.add(subscriber)
+            self.has_subscribers.set()
+        self.start()
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        """視聴者の登録を解除"""
+        with self.lock:
+            self.subscribers.discard(subscriber)
+            if not self.subscribers:
+                self.has_subscribers.clear()
+
+    async def next_frame(self, subscriber, timeout: float = 5.0):
+        """次のフレームを待って (通し番号, JPEG) を返す（タイムアウト時はNone）"""
+        try:
+            await asyncio.wait_for(subscriber.event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        subscriber.event.clear()
+
+        with self.lock:
+            index, seq, jpeg = self.encoded_frames, self.latest_seq, self.latest_jpeg
+
+        if jpeg is None or index == subscriber.last_index:
+            return None
+
+        # 送信が追いつかず読み飛ばしたフレーム数を記録
+        if subscriber.last_index:
+            subscriber.dropped += index - subscriber.last_index - 1
+        subscriber.last_index = index
+        subscriber.sent += 1
+        return seq, jpeg
+
+    def get_stats(self):
+        """配信の統計情報を取得"""
+        with self.lock:
+            return {
+                "viewers": len(self.subscribers),
+                "quality": self.quality,
+                "encoded_frames": self.encoded_frames,
+                "avg_encode_ms": round(self.total_encode_time / self.encoded_frames * 1000, 2) if self.encoded_frames else 0,
+                "dropped_frames": sum(s.dropped for s in self.subscribers)
+            }
@@ -3,19 +3,99 @@
 AWS IoT Core クライアント for Raspberry Pi Security Camera
 """
 
+import asyncio
+import inspect
 import json
+import os
 import ssl
 import time
 import threading
 import requests
 import boto3
+from collections import OrderedDict, deque
 from datetime import datetime
 from AWSIoTPythonSDK.MQTTLib import AWSIoTMQTTClient
 import logging
 
+from dynamodb_writer import BatchedTableWriter
+from worker_pools import WorkerPoolFull, iot_pool
+
 # ログ設定
 logger = logging.getLogger(__name__)
 
+# IoTコマンド -> (HTTPメソッド, カメラサーバーのエンドポイント)
+COMMANDS = {
+    'start': ('POST', '/camera/start'),
+    'stop': ('POST', '/camera/stop'),
+    'status': ('GET', '/camera-status'),
+    'motion_status': ('GET', '/motion-status'),
+    'get_motion_settings': ('GET', '/motion-settings'),
+    'update_motion_settings': ('POST', '/motion-settings'),
+    'list_recordings': ('GET', '/recordings'),
+}
+
+# 同じrequestIdのコマンドを無視する期間（QoS 1の再送対策）
+DEDUP_SECONDS = 600
+DEDUP_MAX_ENTRIES = 1000
+LOCAL_COMMAND_TIMEOUT = 10
+
+
+def command_response(status_code, body):
+    """コマンドのレスポンスを作成（HTTP転送時と同じ形式）"""
+    return {
+        'statusCode': status_code,
+        'contentType': 'application/json',
+        'body': json.dumps(body, ensure_ascii=False, default=str)
+    }
+
+
+TRUE_VALUES = {'1', 'true', 'on', 'yes'}
+FALSE_VALUES = {'0', 'false', 'off', 'no'}
+
+
+def convert_argument(parameter, value):
+    """エンドポイントの引数の型注釈に合わせて値を変換（クエリパラメータと同じく文字列も受け付ける）"""
+    annotation = parameter.annotation
+    if value is None or annotation is inspect.Parameter.empty:
+        return value
+    if annotation is bool:
+        if isinstance(value, bool):
+            return value
+        text = str(value).strip().lower()
+        if text in TRUE_VALUES:
+            return True
+        if text in FALSE_VALUES:
+            return False
+        raise ValueError(f"Invalid boolean: {value}")
+    if annotation is int:
+        if isinstance(value, bool):
+            raise TypeError("Boolean is not an integer")
+        if isinstance(value, float):
+            if not value.is_integer():
+                raise ValueError(f"Invalid integer: {value}")
+            return int(value)
+        if isinstance(value, (int, str)):
+            return int(value)
+        raise TypeError(f"Invalid integer: {value}")
+    if annotation is float:
+        if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+            raise TypeError(f"Invalid number: {value}")
+        return float(value)
+    if annotation is str:
+        if isinstance(value, (dict, list)):
+            raise TypeError(f"Invalid string: {value}")
+        return str(value)
+    return value
+
+
+def is_valid_argument(parameter, value):
+    """引数の値を型注釈に合わせて変換できるか"""
+    try:
+        convert_argument(parameter, value)
+    except (TypeError, ValueError):
+        return False
+    return True
+
 
 class IoTClient:
     def __init__(self):
@@ -26,13 +106,35 @@ class IoTClient:
 
         # カメラサーバーの設定
         self.camera_server_url = "http://localhost:3000"
+        self.session = requests.Session()  # HTTPで転送する場合の接続を使い回す
+
+        # 同じプロセスで動いている場合はHTTPを経由せずに直接呼び出す
+        self.local_handlers = {}
+        self.local_loop = None
 
-        # DynamoDB設定
+        # コマンド処理の状態・統計情報
+        self.pool = iot_pool
+        self.recent_requests = OrderedDict()  # requestId -> 受信時刻
+        self.command_lock = threading.Lock()
+        self.command_stats = {}
+        self.duplicates = 0
+        self.rejected = 0
+
+        # DynamoDB設定（DYNAMODB_ENDPOINT_URL でローカルのDynamoDBなどに接続）
         self.dynamodb = boto3.resource(
-            'dynamodb', region_name='ap-northeast-1')
+            'dynamodb', region_name='ap-northeast-1',
+            endpoint_url=os.getenv('DYNAMODB_ENDPOINT_URL') or None)
         self.response_table = self.dynamodb.Table(
             'security-camera-iot-responses')
 
+        # レスポンスはまとめて書き込む（MQTT・ワーカースレッドは登録するだけ）
+        self.response_writer = BatchedTableWriter(
+            self.response_table,
+            flush_interval=float(os.getenv('IOT_RESPONSE_FLUSH_MS', '200')) / 1000,
+            max_queue=int(os.getenv('IOT_RESPONSE_QUEUE', '1000')),
+            key_names=['requestId'])
+        self.response_writer.start()
+
         # AWS IoT設定
         self.endpoint = "a1elu8r7ww6uyj-ats.iot.ap-northeast-1.amazonaws.com"
         self.root_ca_path = "certs/root-CA.crt"
@@ -78,87 +180,154 @@ class IoTClient:
             logger.error(f"❌ IoT接続エラー: {e}")
             return False
 
+    def set_local_dispatch(self, loop, handlers):
+        """カメラサーバー内で直接呼び出す処理を登録
+
+        handlers: コマンド -> エンドポイントの関数（コルーチン関数ならloopで実行）
+        """
+        self.local_loop = loop
+        self.local_handlers = dict(handlers)
+
     def on_command_received(self, client, userdata, message):
-        """コマンド受信時の処理"""
+        """コマンド受信時の処理（MQTTのスレッドでは登録だけ行う）"""
+        received_at = time.time()
         try:
             # メッセージをデコード
             payload = json.loads(message.payload.decode('utf-8'))
             logger.info(f"📨 IoTコマンド受信: {payload}")
 
             command = payload.get('command')
-            data = payload.get('data', {})
+            data = payload.get('data') or {}
             request_id = payload.get('requestId')
-            timestamp = payload.get('timestamp')
 
             if not command or not request_id:
                 logger.error("❌ 必要なパラメータが不足しています")
                 return
 
-            # カメラ制御コマンドを処理
-            response = self.handle_camera_command(command, data)
-
-            # DynamoDBにレスポンスを保存
-            self.save_response_to_dynamodb(request_id, response)
+            if self._is_duplicate(request_id, received_at):
+                logger.info(f"↩️ 処理済みのIoTコマンドを無視しました: {request_id}")
+                return
 
-            logger.info(f"✅ IoTコマンド処理完了: {command}")
+            try:
+                self.pool.submit(self._process_command, command, data, request_id, received_at)
+            except WorkerPoolFull:
+                with self.command_lock:
+                    self.rejected += 1
+                logger.warning(f"⚠️ IoTコマンドの待ち行列が満杯です: {command}")
+                self.save_response_to_dynamodb(
+                    request_id, command_response(503, {'error': 'Camera server is busy'}))
 
         except Exception as e:
             logger.error(f"❌ IoTコマンド処理エラー: {e}")
 
+    def _is_duplicate(self, request_id, now):
+        """処理済みのrequestIdか確認して登録"""
+        with self.command_lock:
+            while self.recent_requests:
+                oldest_id, oldest_time = next(iter(self.recent_requests.items()))
+                if now - oldest_time < DEDUP_SECONDS and len(self.recent_requests) < DEDUP_MAX_ENTRIES:
+                    break
+                self.recent_requests.popitem(last=False)
+            if request_id in self.recent_requests:
+                self.duplicates += 1
+                return True
+            self.recent_requests[request_id] = now
+            return False
+
+    def _process_command(self, command, data, request_id, received_at):
+        """コマンドを処理してレスポンスを保存（ワーカースレッドで実行）"""
+        started_at = time.time()
+        response = self.handle_camera_command(command, data)
+        finished_at = time.time()
+
+        # DynamoDBにレスポンスを保存
+        self.save_response_to_dynamodb(request_id, response)
+
+        # 未知のコマンドはまとめて集計（任意の名前で統計が増えないように）
+        self._record_latency(
+            command if command in COMMANDS else 'unknown',
+            response.get('statusCode', 500), started_at - received_at, finished_at - started_at)
+        logger.info(f"✅ IoTコマンド処理完了: {command} ({(finished_at - started_at) * 1000:.0f}ms)")
+
+    def _record_latency(self, command, status_code, wait_time, run_time):
+        """コマンドごとの処理時間を記録"""
+        with self.command_lock:
+            stats = self.command_stats.get(command)
+            if stats is None:
+                stats = {"count": 0, "errors": 0, "total_wait": 0.0, "total_run": 0.0,
+                         "max_run": 0.0, "recent": deque(maxlen=100)}
+                self.command_stats[command] = stats
+            stats["count"] += 1
+            if status_code >= 400:
+                stats["errors"] += 1
+            stats["total_wait"] += wait_time
+            stats["total_run"] += run_time
+            stats["max_run"] = max(stats["max_run"], run_time)
+            stats["recent"].append(run_time)
+
     def handle_camera_command(self, command, data):
         """カメラ制御コマンドを処理"""
         try:
-            # カメラサーバーのエンドポイントに対応
-            endpoint_map = {
-                'start': '/camera/start',
-                'stop': '/camera/stop',
-                'status': '/camera-status'
-            }
+            route = COMMANDS.get(command)
+            if not route:
+                return command_response(400, {'error': f'Unknown command: {command}'})
 
-            endpoint = endpoint_map.get(command)
-            if not endpoint:
-                return {
-                    'statusCode': 400,
-                    'contentType': 'application/json',
-                    'body': json.dumps({'error': f'Unknown command: {command}'})
-                }
+            handler = self.local_handlers.get(command)
+            if handler:
+                # 同じプロセスのカメラサーバーを直接呼び出す
+                return self.dispatch_local(handler, data)
 
-            # カメラサーバーに直接リクエスト
-            if command in ['start', 'stop']:
-                response = self.forward_to_camera_server(
-                    endpoint, 'POST', data)
-            else:
-                response = self.forward_to_camera_server(endpoint, 'GET', None)
-
-            return response
+            # カメラサーバーにHTTPで転送
+            method, endpoint = route
+            return self.forward_to_camera_server(endpoint, method, data)
 
         except Exception as e:
             logger.error(f"❌ カメラコマンド処理エラー: {e}")
-            return {
-                'statusCode': 500,
-                'contentType': 'application/json',
-                'body': json.dumps({'error': str(e)})
+            return command_response(500, {'error': str(e)})
+
+    def dispatch_local(self, handler, data):
+        """エンドポイントの関数を直接呼び出してレスポンスを作成"""
+        if not isinstance(data, dict):
+            return command_response(400, {'error': 'Invalid parameters'})
+        parameters = inspect.signature(handler).parameters
+        # HTTPで転送した場合と同じく、エンドポイントにない引数は無視する
+        unknown = [key for key in data if key not in parameters]
+        if unknown:
+            logger.debug(f"IoTコマンドの不明な引数を無視しました: {', '.join(unknown)}")
+        try:
+            # null は指定しなかったものとして既定値を使う
+            kwargs = {
+                name: convert_argument(parameter, data[name])
+                for name, parameter in parameters.items() if data.get(name) is not None
             }
+        except (TypeError, ValueError):
+            invalid = [name for name, parameter in parameters.items()
+                       if data.get(name) is not None and not is_valid_argument(parameter, data[name])]
+            return command_response(400, {'error': f"Invalid parameters: {', '.join(invalid)}"})
+
+        try:
+            result = handler(**kwargs)
+            if inspect.iscoroutine(result):
+                # エンドポイントはカメラサーバーのイベントループで実行
+                result = asyncio.run_coroutine_threadsafe(result, self.local_loop).result(LOCAL_COMMAND_TIMEOUT)
+        except Exception as e:
+            # HTTPException と同じ status_code・detail を持つ例外はそのまま返す
+            status_code = getattr(e, 'status_code', None)
+            if status_code is not None:
+                return command_response(status_code, {'detail': getattr(e, 'detail', str(e))})
+            raise
+        return command_response(200, result)
 
     def forward_to_camera_server(self, path, method, body):
-        """カメラサーバーにリクエストを転送"""
+        """カメラサーバーにリクエストを転送（接続は使い回す）"""
         try:
             url = f"{self.camera_server_url}{path}"
             headers = {'Content-Type': 'application/json'}
 
-            # HTTPリクエストを送信
-            if method.upper() == 'GET':
-                response = requests.get(url, headers=headers, timeout=10)
-            elif method.upper() == 'POST':
-                response = requests.post(
-                    url, headers=headers, json=body if body else {}, timeout=10)
-            elif method.upper() == 'PUT':
-                response = requests.put(
-                    url, headers=headers, json=body if body else {}, timeout=10)
-            elif method.upper() == 'DELETE':
-                response = requests.delete(url, headers=headers, timeout=10)
-            else:
-                response = requests.get(url, headers=headers, timeout=10)
+            # HTTPリクエストを送信（エンドポイントの引数はクエリパラメータ）
+            response = self.session.request(
+                method.upper(), url, headers=headers, params=body or None,
+                json={} if method.upper() in ('POST', 'PUT') else None, timeout=10)
 
             # レスポンスを構造化
             return {
@@ -179,23 +348,43 @@ class IoTClient:
                 })
             }
 
+    def get_command_stats(self):
+        """コマンドごとの処理時間・件数を取得"""
+        with self.command_lock:
+            commands = {}
+            for command, stats in self.command_stats.items():
+                recent = sorted(stats["recent"])
+                commands[command] = {
+                    "count": stats["count"],
+                    "errors": stats["errors"],
+                    "avg_wait_ms": round(stats["total_wait"] / stats["count"] * 1000, 1),
+                    "avg_run_ms": round(stats["total_run"] / stats["count"] * 1000, 1),
+                    "p95_run_ms": round(recent[min(len(recent) - 1, int(len(recent) * 0.95))] * 1000, 1),
+                    "max_run_ms": round(stats["max_run"] * 1000, 1)
+                }
+            return {
+                "local_dispatch": sorted(self.local_handlers),
+                "duplicates": self.duplicates,
+                "rejected": self.rejected,
+                "commands": commands,
+                "pool": self.pool.get_stats(),
+                "response_writer": self.response_writer.get_stats()
+            }
+
     def save_response_to_dynamodb(self, request_id, response):
-        """DynamoDBにレスポンスを保存"""
+        """DynamoDBにレスポンスを保存（まとめ書き込みに登録するだけで待たない）"""
         try:
             # TTL設定（1時間後に削除）
             ttl = int(time.time()) + 3600
 
-            # DynamoDBに保存
-            self.response_table.put_item(
-                Item={
-                    'requestId': request_id,
-                    'response': response,
-                    'ttl': ttl,
-                    'timestamp': datetime.now().isoformat()
-                }
-            )
+            self.response_writer.put({
+                'requestId': request_id,
+                'response': response,
+                'ttl': ttl,
+                'timestamp': datetime.now().isoformat()
+            })
 
-            logger.info(f"✅ レスポンスをDynamoDBに保存しました: {request_id}")
+            logger.info(f"✅ レスポンスをDynamoDBの書き込み待ちに登録しました: {request_id}")
 
         except Exception as e:
             logger.error(f"❌ DynamoDB保存エラー: {e}")
@@ -258,6 +447,9 @@ class IoTClient:
                 self.client.disconnect()
                 logger.info("🔌 AWS IoT Coreから切断しました")
 
+            # 書き込み待ちのレスポンスを書き込む
+            self.response_writer.stop()
+
         except Exception as e:
             logger.error(f"❌ 切断エラー: {e}")
 
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+エンコード済みJPEGのキャッシュ
+
+(フレーム通し番号, JPEG品質, 縮小率) をキーに、HTTPエンドポイント・ストリーム配信・
+通知用スナップショットで同じエンコード結果を共有する
+"""
+
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class JpegCache:
+    """LRU方式のJPEGキャッシュ（同じキーのエンコードは同時に1回だけ実行）"""
+
+    def __init__(self, encoder, max_entries: int = 16):
+        self.encoder = encoder
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.inflight = {}
+        self.lock = threading.Lock()
+
+        # 統計情報
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_or_encode(self, seq, frame, quality: int, scale: float = 1.0):
+        """キャッシュ済みのJPEGを返す（なければエンコードして登録）
+
+        seqがNoneのフレーム（ダミーフレームなど）はキャッシュしない
+        """
+        if seq is None:
+            return self.encoder(frame, quality, scale)
+
+        key = (seq, quality, scale)
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+
+            event = self.inflight.get(key)
+            if event is None:
+                # このスレッドがエンコードを担当する
+                event = threading.Event()
+                self.inflight[key] = event
+                self.misses += 1
+                owner = True
+            else:
+                self.hits += 1
+                owner = False
+
+        if not owner:
+            # 他のスレッドのエンコード完了を待つ
+            event.wait()
+            with self.lock:
+                jpeg = self.entries.get(key)
+            if jpeg is not None:
+                return jpeg
+            return self.encoder(frame, quality, scale)
+
+        try:
+            jpeg = self.encoder(frame, quality, scale)
+            with self.lock:
+                self.entries[key] = jpeg
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+                    self.evictions += 1
+            return jpeg
+        finally:
+            with self.lock:
+                self.inflight.pop(key, None)
+            event.set()
+
+    def get_stats(self):
+        """キャッシュの統計情報を取得"""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "max_entries": self.max_entries,
+                "bytes": sum(len(jpeg) for jpeg in self.entries.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0
+            }
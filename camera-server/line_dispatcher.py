@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+"""
+LINE Messaging API の送信ワーカー
+
+呼び出し側は送信内容を待ち行列に登録するだけで、すぐに戻る。
+送信は専用スレッドが keep-alive のセッションで行い、タイムアウト・指数バックオフでの再送・
+429（レート制限）の Retry-After に従う。再送待ちの送信はディスクに保存し、再起動後に送り直す
+"""
+
+import heapq
+import json
+import logging
+import queue
+import random
+import threading
+import time
+import uuid
+from pathlib import Path
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUS = {500, 502, 503, 504}
+# 月間の送信数の上限に達した時の 429 のメッセージ（待っても送れない）
+QUOTA_EXCEEDED_MESSAGE = "monthly limit"
+
+
+class LineDispatcher:
+    """LINE Messaging API への送信を行うバックグラウンドワーカー"""
+
+    def __init__(self, channel_access_token: str, base_url: str = "https://api.line.me/v2",
+                 max_queue: int = 100, timeout=(3.05, 10), max_attempts: int = 6,
+                 backoff_base: float = 2.0, backoff_max: float = 300.0,
+                 spool_dir: Path = None, spool_max: int = 100, max_rate_limited: int = 6):
+        self.channel_access_token = channel_access_token
+        self.base_url = base_url
+        self.timeout = timeout  # (接続, 読み込み) の秒数
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_rate_limited = max_rate_limited  # Retry-After のない 429 を続けて受けたら諦める回数
+        self.spool_dir = Path(spool_dir) if spool_dir else None
+        self.spool_max = spool_max
+
+        # keep-alive のセッション（接続を使い回す）
+        self.session = requests.Session()
+        self.session.headers["Authorization"] = f"Bearer {channel_access_token}"
+        self.session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=2))
+
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.retries = []  # (再送時刻, 連番, 送信内容) のヒープ
+        self.sequence = 0
+        self.paused_until = 0.0  # 429 を受けたら Retry-After まで送信しない
+        self.lock = threading.Lock()
+        self.thread = None
+        self.stop_event = threading.Event()
+        self.wake_event = threading.Event()
+
+        # 統計情報
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.rate_limited = 0
+        self.dropped = 0
+        self.restored = 0
+        self.total_latency = 0.0
+        self.last_error = None
+
+    def start(self):
+        """送信スレッドを開始（ディスクに残っている送信を読み込む）"""
+        if self.thread and self.thread.is_alive():
+            return False
+        self._restore_spool()
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._run, name="line-dispatcher", daemon=True)
+        self.thread.start()
+        logger.info("LINE送信ワーカーを開始しました")
+        return True
+
+    def stop(self, timeout: float = 5.0):
+        """送信スレッドを停止（未送信のものはディスクに保存）"""
+        self.stop_event.set()
+        self.wake_event.set()
+        if self.thread:
+            self.thread.join(timeout=timeout)
+        pending = 0
+        while True:
+            try:
+                job = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            self._spool(job)
+            pending += 1
+        with self.lock:
+            retries, self.retries = self.retries, []
+        for _, _, job in retries:
+            self._spool(job)
+        if pending or retries:
+            logger.info(f"未送信のLINE通知を保存しました: {pending + len(retries)}件")
+        self.session.close()
+
+    def enqueue(self, kind: str, body: dict, label: str = "") -> bool:
+        """送信を登録（待ち行列が満杯ならFalse）
+
+        kind: "broadcast"（友達全員への送信）・"push"（bodyの "to" への送信）
+        """
+        job = {
+            "id": uuid.uuid4().hex,
+            "kind": kind,
+            "body": body,
+            "label": label,
+            "attempts": 0,
+            "created_at": time.time()
+        }
+        try:
+            self.queue.put_nowait(job)
+        except queue.Full:
+            with self.lock:
+                self.dropped += 1
+            logger.warning(f"LINE送信の待ち行列が満杯のため破棄しました: {label}")
+            return False
+        self.wake_event.set()
+        return True
+
+    def _run(self):
+        """待ち行列と再送待ちから送信"""
+        while not self.stop_event.is_set():
+            now = time.time()
+            if self.paused_until > now:
+                self.stop_event.wait(self.paused_until - now)
+                continue
+
+            job = None
+            with self.lock:
+                if self.retries and self.retries[0][0] <= now:
+                    job = heapq.heappop(self.retries)[2]
+                next_retry = self.retries[0][0] if self.retries else None
+            if job is None:
+                wait = 1.0 if next_retry is None else max(0.0, min(1.0, next_retry - now))
+                try:
+                    job = self.queue.get(timeout=wait)
+                except queue.Empty:
+                    continue
+            self._process(job)
+
+    def _process(self, job: dict):
+        """1件送信し、失敗時は再送を予約"""
+        job["attempts"] += 1
+        try:
+            status, retry_after = self._send(job)
+        except requests.RequestException as e:
+            status, retry_after = None, None
+            self.last_error = str(e)
+
+        if status == 200:
+            with self.lock:
+                self.sent += 1
+                self.total_latency += time.time() - job["created_at"]
+            self._remove_spool(job)
+            logger.info(f"LINE Messaging API 送信成功: {job['label'] or job['kind']}")
+            return
+
+        if status == 429:
+            # レート制限（試行回数とは別に数え、Retry-After がなければ429の回数でバックオフする）
+            job["rate_limited"] = job.get("rate_limited", 0) + 1
+            delay = retry_after if retry_after is not None else self._backoff(job["rate_limited"])
+            with self.lock:
+                self.rate_limited += 1
+                self.paused_until = max(self.paused_until, time.time() + delay)
+            quota_exceeded = QUOTA_EXCEEDED_MESSAGE in (self.last_error or "")
+            if quota_exceeded or (retry_after is None and job["rate_limited"] >= self.max_rate_limited):
+                # 月間の上限などで待っても送れない（再送し続けると他の送信も止まる）
+                with self.lock:
+                    self.failed += 1
+                self._remove_spool(job)
+                logger.error(
+                    f"LINE Messaging API のレート制限が続くため再送しません "
+                    f"({job['rate_limited']}回): {self.last_error} - {job['label']}")
+                return
+            logger.warning(
+                f"LINE Messaging API のレート制限: {delay:.0f}秒後に再送します "
+                f"({job['rate_limited']}/{self.max_rate_limited})")
+            self._schedule_retry(job, delay, count_attempt=False)
+            return
+
+        retryable = status is None or status in RETRYABLE_STATUS
+        if retryable and job["attempts"] < self.max_attempts:
+            delay = self._backoff(job["attempts"])
+            logger.warning(
+                f"LINE Messaging API 送信失敗 ({status or self.last_error}): "
+                f"{delay:.0f}秒後に再送します ({job['attempts']}/{self.max_attempts})")
+            self._schedule_retry(job, delay)
+            return
+
+        with self.lock:
+            self.failed += 1
+        self._remove_spool(job)
+        logger.error(f"LINE Messaging API 送信失敗（再送しません）: {status or self.last_error} - {job['label']}")
+
+    def _send(self, job: dict):
+        """送信を実行して (ステータスコード, Retry-After秒) を返す"""
+        if job["kind"] == "broadcast":
+            url, data = f"{self.base_url}/bot/message/broadcast", job["body"]
+        else:
+            url, data = f"{self.base_url}/bot/message/push", job["body"]
+
+        # 再送で二重に届かないよう同じ Retry-Key を使う
+        response = self.session.post(
+            url, json=data, headers={"X-Line-Retry-Key": str(uuid.UUID(job["id"]))}, timeout=self.timeout)
+        if response.status_code == 409:
+            # 同じ Retry-Key の送信はすでに受け付けられている
+            return 200, None
+        if response.status_code != 200:
+            return self._failure(response)
+        return 200, None
+
+    def _failure(self, response):
+        """失敗したレスポンスから (ステータスコード, Retry-After秒) を返す"""
+        self.last_error = f"{response.status_code} - {response.text[:200]}"
+        retry_after = None
+        try:
+            retry_after = float(response.headers.get("Retry-After"))
+        except (TypeError, ValueError):
+            pass
+        return response.status_code, retry_after
+
+    def _backoff(self, attempts: int):
+        """指数バックオフの待ち時間（ゆらぎ付き）"""
+        delay = min(self.backoff_max, self.backoff_base * (2 ** (attempts - 1)))
+        return delay * random.uniform(0.8, 1.2)
+
+    def _schedule_retry(self, job: dict, delay: float, count_attempt: bool = True):
+        """再送を予約してディスクに保存"""
+        if not count_attempt:
+            job["attempts"] -= 1
+        with self.lock:
+            self.retried += 1
+            self.sequence += 1
+            heapq.heappush(self.retries, (time.time() + delay, self.sequence, job))
+        self._spool(job)
+
+    def _spool_path(self, job: dict):
+        """送信内容の保存先"""
+        return self.spool_dir / f"{job['id']}.json"
+
+    def _spool(self, job: dict):
+        """再送待ちの送信をディスクに保存（上限を超えたら古いものから削除）"""
+        if not self.spool_dir:
+            return
+        try:
+            self.spool_dir.mkdir(parents=True, exist_ok=True)
+            path = self._spool_path(job)
+            temp_path = path.with_suffix(".tmp")
+            temp_path.write_text(json.dumps(job), encoding="utf-8")
+            temp_path.replace(path)
+
+            spooled = sorted(self.spool_dir.glob("*.json"), key=lambda p: p.stat().st_mtime)
+            pruned = spooled[:max(0, len(spooled) - self.spool_max)]
+            for old in pruned:
+                old.unlink(missing_ok=True)
+        except OSError as e:
+            logger.error(f"LINE通知の保存エラー: {e}")
+            return
+        if pruned:
+            # 削除した送信は再送待ちからも外す（破棄として数えたものを送らない）
+            pruned_ids = {old.stem for old in pruned}
+            with self.lock:
+                self.retries = [entry for entry in self.retries if entry[2]["id"] not in pruned_ids]
+                heapq.heapify(self.retries)
+                self.dropped += len(pruned)
+            logger.warning(f"保存上限を超えたため古いLINE通知を破棄しました: {len(pruned)}件")
+
+    def _remove_spool(self, job: dict):
+        """送信済み・破棄した送信をディスクから削除"""
+        if self.spool_dir:
+            self._spool_path(job).unlink(missing_ok=True)
+
+    def _restore_spool(self):
+        """前回送信できなかった送信を再送待ちに登録"""
+        if not self.spool_dir or not self.spool_dir.exists():
+            return
+        restored = 0
+        for path in sorted(self.spool_dir.glob("*.json"), key=lambda p: p.stat().st_mtime):
+            try:
+                job = json.loads(path.read_text(encoding="utf-8"))
+            except (OSError, ValueError) as e:
+                logger.error(f"LINE通知の読み込みエラー: {path.name}: {e}")
+                path.unlink(missing_ok=True)
+                continue
+            if job.get("kind") == "image":
+                # 以前の画像アップロード形式はテキストだけ送り直す
+                job.pop("image", None)
+                job["body"].pop("image_id", None)
+                job["kind"] = "push" if job["body"].get("to") else "broadcast"
+                if not job["body"].get("messages"):
+                    path.unlink(missing_ok=True)
+                    continue
+            with self.lock:
+                self.sequence += 1
+                heapq.heappush(self.retries, (time.time(), self.sequence, job))
+            restored += 1
+        if restored:
+            with self.lock:
+                self.restored += restored
+            logger.info(f"未送信のLINE通知を読み込みました: {restored}件")
+
+    def get_stats(self):
+        """送信の統計情報を取得"""
+        with self.lock:
+            return {
+                "running": bool(self.thread and self.thread.is_alive()),
+                "queued": self.queue.qsize(),
+                "max_queue": self.queue.maxsize,
+                "retry_pending": len(self.retries),
+                "paused_seconds": round(max(0.0, self.paused_until - time.time()), 1),
+                "sent": self.sent,
+                "failed": self.failed,
+                "retried": self.retried,
+                "rate_limited": self.rate_limited,
+                "dropped": self.dropped,
+                "restored": self.restored,
+                "avg_latency_ms": round(self.total_latency / self.sent * 1000, 1) if self.sent else 0,
+                "last_error": self.last_error
+            }
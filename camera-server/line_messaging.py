@@ -1,59 +1,83 @@
-import requests
 import logging
-import json
-import base64
+import uuid
 from pathlib import Path
 from datetime import datetime
 from typing import Optional
 
+from line_dispatcher import LineDispatcher
+
 logger = logging.getLogger(__name__)
 
 
+def format_duration(duration: float) -> str:
+    """録画時間の表示"""
+    if duration < 60:
+        return f"{duration:.1f}秒"
+    minutes = int(duration // 60)
+    seconds = duration % 60
+    return f"{minutes}分{seconds:.1f}秒"
+
+
+def format_size(file_size: int) -> str:
+    """ファイルサイズの表示"""
+    size_mb = file_size / (1024 * 1024)
+    if size_mb < 1:
+        return f"{size_mb * 1024:.1f}KB"
+    return f"{size_mb:.1f}MB"
+
+
 class LineMessagingAPI:
-    def __init__(self, channel_access_token: str = None, user_id: str = None):
+    def __init__(self, channel_access_token: str = None, user_id: str = None,
+                 spool_dir: Path = None, max_queue: int = 100,
+                 snapshot_dir: Path = None, snapshot_base_url: str = None, snapshot_keep: int = 100):
         self.channel_access_token = channel_access_token
         self.user_id = user_id
         self.enabled = channel_access_token is not None
         self.base_url = "https://api.line.me/v2"
+        # 画像メッセージはLINEのサーバーが取得できるHTTPSのURLで送る（なければテキストのみ送信）
+        self.snapshot_dir = Path(snapshot_dir) if snapshot_dir else None
+        self.snapshot_base_url = snapshot_base_url.rstrip("/") if snapshot_base_url else None
+        self.snapshot_keep = snapshot_keep
+        if self.snapshot_base_url and not self.snapshot_base_url.startswith("https://"):
+            logger.warning(f"画像のURLはHTTPSである必要があるため画像を送信しません: {self.snapshot_base_url}")
+            self.snapshot_base_url = None
+        # 送信は専用スレッドで行う（呼び出し側は登録するだけ）
+        self.dispatcher = LineDispatcher(
+            channel_access_token, self.base_url, max_queue=max_queue,
+            spool_dir=spool_dir) if self.enabled else None
+
+    def start(self):
+        """送信ワーカーを開始"""
+        if self.dispatcher:
+            self.dispatcher.start()
+
+    def stop(self):
+        """送信ワーカーを停止（未送信のものはディスクに保存）"""
+        if self.dispatcher:
+            self.dispatcher.stop()
+
+    def get_stats(self):
+        """送信の統計情報を取得"""
+        return self.dispatcher.get_stats() if self.dispatcher else None
 
     def send_text_message(self, message: str) -> bool:
-        """テキストメッセージを送信（友達全員にブロードキャスト）"""
+        """テキストメッセージを送信（友達全員にブロードキャスト、送信待ちに登録してすぐ戻る）"""
         if not self.enabled:
             logger.info("LINE Messaging APIが無効です（トークンが設定されていません）")
             return False
 
-        try:
-            url = f"{self.base_url}/bot/message/broadcast"
-            headers = {
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {self.channel_access_token}"
-            }
-
-            data = {
-                "messages": [
-                    {
-                        "type": "text",
-                        "text": message
-                    }
-                ]
-            }
-
-            response = requests.post(url, headers=headers, json=data)
-
-            if response.status_code == 200:
-                logger.info("LINE Messaging API ブロードキャスト送信成功")
-                return True
-            else:
-                logger.error(
-                    f"LINE Messaging API ブロードキャスト送信失敗: {response.status_code} - {response.text}")
-                return False
-
-        except Exception as e:
-            logger.error(f"LINE Messaging API ブロードキャスト送信エラー: {e}")
-            return False
+        data = {
+            "messages": [
+                {
+                    "type": "text",
+                    "text": message
+                }
+            ]
+        }
+        return self.dispatcher.enqueue("broadcast", data, label=message.splitlines()[0] if message else "")
 
     def send_image_message(self, image_path: Path, message: str = "") -> bool:
-        """画像メッセージを送信"""
+        """画像メッセージを送信（送信待ちに登録してすぐ戻る）"""
         if not self.enabled:
             logger.info("LINE Messaging APIが無効です（トークンが設定されていません）")
             return False
@@ -62,71 +86,71 @@ class LineMessagingAPI:
             if not image_path.exists():
                 logger.error(f"画像ファイルが見つかりません: {image_path}")
                 return False
+            image_data = image_path.read_bytes()
+        except OSError as e:
+            logger.error(f"画像ファイル読み込みエラー: {e}")
+            return False
 
-            # 画像をアップロード
-            upload_url = f"{self.base_url}/bot/message/upload"
-            headers = {
-                "Authorization": f"Bearer {self.channel_access_token}"
-            }
-
-            with open(image_path, "rb") as f:
-                files = {"imageFile": f}
-                response = requests.post(
-                    upload_url, headers=headers, files=files)
-
-            if response.status_code != 200:
-                logger.error(
-                    f"画像アップロード失敗: {response.status_code} - {response.text}")
-                return False
-
-            # アップロードされた画像のIDを取得
-            upload_result = response.json()
-            image_id = upload_result.get("imageId")
-
-            if not image_id:
-                logger.error("画像IDの取得に失敗しました")
-                return False
-
-            # 画像メッセージを送信
-            push_url = f"{self.base_url}/bot/message/push"
-            headers = {
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {self.channel_access_token}"
-            }
-
-            data = {
-                "to": self.user_id,
-                "messages": [
-                    {
-                        "type": "image",
-                        "originalContentUrl": f"https://api.line.me/v2/bot/message/{image_id}/content",
-                        "previewImageUrl": f"https://api.line.me/v2/bot/message/{image_id}/content"
-                    }
-                ]
-            }
-
-            # テキストメッセージも送信
-            if message:
-                data["messages"].append({
-                    "type": "text",
-                    "text": message
-                })
-
-            response = requests.post(push_url, headers=headers, json=data)
+        return self.send_image_data(image_data, message, label=image_path.name)
 
-            if response.status_code == 200:
-                logger.info("LINE Messaging API 画像送信成功")
-                return True
-            else:
-                logger.error(
-                    f"LINE Messaging API 画像送信失敗: {response.status_code} - {response.text}")
-                return False
+    def send_image_data(self, image_data: bytes, message: str = "", label: str = "snapshot") -> bool:
+        """エンコード済みのJPEGを保存して公開URLで送信
 
-        except Exception as e:
-            logger.error(f"LINE Messaging API 画像送信エラー: {e}")
+        画像とテキストは1回の送信にまとめる（送信数の上限はリクエストごとに数えられる）。
+        画像のURLが設定されていなければテキストのみ送信する。
+        user_id がなければ友達全員にブロードキャストする
+        """
+        if not self.enabled:
+            logger.info("LINE Messaging APIが無効です（トークンが設定されていません）")
             return False
 
-    def send_motion_detected_notification(self, image_path: Optional[Path] = None) -> bool:
+        messages = []
+        image_url = self._store_snapshot(image_data)
+        if image_url:
+            # LINEは表示時に画像を取得するため、画像を取得できなくてもテキストは届く
+            messages.append({
+                "type": "image",
+                "originalContentUrl": image_url,
+                "previewImageUrl": image_url
+            })
+        if message:
+            messages.append({
+                "type": "text",
+                "text": message
+            })
+        if not messages:
+            return False
+        return self._enqueue_messages(messages, label=label)
+
+    def _enqueue_messages(self, messages: list, label: str = "") -> bool:
+        """user_id があればpush、なければブロードキャストで送信待ちに登録"""
+        data = {"messages": messages}
+        if self.user_id:
+            data["to"] = self.user_id
+            return self.dispatcher.enqueue("push", data, label=label)
+        return self.dispatcher.enqueue("broadcast", data, label=label)
+
+    def _store_snapshot(self, image_data: bytes) -> Optional[str]:
+        """画像を公開ディレクトリに保存してURLを返す（古いものから削除）"""
+        if not self.snapshot_dir or not self.snapshot_base_url:
+            return None
+        try:
+            self.snapshot_dir.mkdir(parents=True, exist_ok=True)
+            name = f"{uuid.uuid4().hex}.jpg"
+            temp_path = self.snapshot_dir / f".{name}.tmp"
+            temp_path.write_bytes(image_data)
+            temp_path.replace(self.snapshot_dir / name)
+
+            snapshots = sorted(self.snapshot_dir.glob("*.jpg"), key=lambda p: p.stat().st_mtime)
+            for old in snapshots[:max(0, len(snapshots) - self.snapshot_keep)]:
+                old.unlink(missing_ok=True)
+        except OSError as e:
+            logger.error(f"通知画像の保存エラー: {e}")
+            return None
+        return f"{self.snapshot_base_url}/{name}"
+
+    def send_motion_detected_notification(self, image_path: Optional[Path] = None,
+                                          image_data: bytes = None) -> bool:
         """物体検知通知を送信"""
         if not self.enabled:
             return False
@@ -153,36 +177,25 @@ class LineMessagingAPI:
 ---
 🛡️ 防犯カメラシステム"""
 
-        if image_path and image_path.exists():
+        if image_data:
+            # メモリ上のスナップショット付きで送信
+            return self.send_image_data(image_data, message, label="motion")
+        elif image_path and image_path.exists():
             # 画像付きで送信
             return self.send_image_message(image_path, message)
         else:
             # テキストのみ送信
             return self.send_text_message(message)
 
-    def send_recording_complete_notification(self, filename: str, file_size: int, duration: float = None, server_url: str = None) -> bool:
-        """録画完了通知を送信"""
+    def send_recording_complete_notification(self, filename: str, file_size: int, duration: float = None, server_url: str = None,
+                                             snapshot: bytes = None) -> bool:
+        """録画完了通知を送信（snapshotを指定するとJPEGを添付）"""
         if not self.enabled:
             return False
 
         current_time = datetime.now().strftime('%Y年%m月%d日 %H:%M:%S')
-        size_mb = file_size / (1024 * 1024)
-
-        # 録画時間の表示を改善
-        duration_str = ""
-        if duration:
-            if duration < 60:
-                duration_str = f"{duration:.1f}秒"
-            else:
-                minutes = int(duration // 60)
-                seconds = duration % 60
-                duration_str = f"{minutes}分{seconds:.1f}秒"
-
-        # ファイルサイズの表示を改善
-        if size_mb < 1:
-            size_str = f"{size_mb * 1024:.1f}KB"
-        else:
-            size_str = f"{size_mb:.1f}MB"
+        duration_str = format_duration(duration) if duration else ""
+        size_str = format_size(file_size)
 
         # 録画ファイルのURLを生成
         recording_url = ""
@@ -220,6 +233,69 @@ class LineMessagingAPI:
 ---
 🛡️ 防犯カメラシステム"""
 
+        if snapshot:
+            return self.send_image_data(snapshot, message, label=filename)
+        return self.send_text_message(message)
+
+    def send_recording_notifications(self, recordings: list, omitted: int = 0) -> bool:
+        """録画完了通知を送信（複数ある場合は1通のまとめ通知にする）
+
+        recordings: send_recording_complete_notification の引数のdictのリスト
+            （motion_area があれば、動きの面積が最大の録画のスナップショットを添付する）
+        omitted: まとめから省いた古い録画の件数
+        """
+        with_snapshot = [recording for recording in recordings if recording.get("snapshot")]
+        snapshot = max(
+            with_snapshot, key=lambda recording: recording.get("motion_area") or 0)["snapshot"] if with_snapshot else None
+        recordings = [
+            {key: value for key, value in recording.items() if key not in ("snapshot", "motion_area")}
+            for recording in recordings
+        ]
+        if len(recordings) == 1 and not omitted:
+            return self.send_recording_complete_notification(**recordings[0], snapshot=snapshot)
+        return self.send_recording_summary_notification(recordings, omitted, snapshot=snapshot)
+
+    def send_recording_summary_notification(self, recordings: list, omitted: int = 0,
+                                            max_listed: int = 10, snapshot: bytes = None) -> bool:
+        """複数の録画完了をまとめた通知を送信（snapshotを指定するとJPEGを添付）"""
+        if not self.enabled or not recordings:
+            return False
+
+        current_time = datetime.now().strftime('%Y年%m月%d日 %H:%M:%S')
+        count = len(recordings) + omitted
+        total_duration = sum(recording.get("duration") or 0 for recording in recordings)
+        total_size = sum(recording.get("file_size") or 0 for recording in recordings)
+        server_url = recordings[-1].get("server_url") or "http://localhost:3000"
+        total_note = f"（古い{omitted}件を除く）" if omitted else ""
+
+        message = f"""📹 **録画完了通知（{count}件）**
+
+✅ **最終録画**: {current_time}
+🎬 **録画件数**: {count}件
+⏱️ **合計録画時間**: {format_duration(total_duration)}{total_note}
+📊 **合計サイズ**: {format_size(total_size)}{total_note}
+
+📁 **ファイル一覧**:"""
+
+        # 新しい録画から表示
+        for recording in reversed(recordings[-max_listed:]):
+            line = f"\n• {recording['filename']}"
+            if recording.get("duration"):
+                line += f" ({format_duration(recording['duration'])})"
+            message += line
+        remaining = count - min(len(recordings), max_listed)
+        if remaining > 0:
+            message += f"\n• ほか{remaining}件"
+
+        message += f"""
+
+🔗 **録画一覧**: {server_url}/recordings
+
+---
+🛡️ 防犯カメラシステム"""
+
+        if snapshot:
+            return self.send_image_data(snapshot, message, label="summary")
         return self.send_text_message(message)
 
     def send_test_notification(self) -> bool:
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+WebSocketによるライブ映像チャネル
+
+JPEGフレームをバイナリメッセージ、動き検知・録画状態の差分をJSONメッセージとして
+同じソケットで送信する。接続ごとに送信キューを持ち、送信が遅れている接続だけ
+画質・解像度を落とす（キャプチャや他の視聴者には影響しない）
+"""
+
+import asyncio
+import json
+import logging
+import time
+from collections import deque
+
+from fastapi import WebSocket, WebSocketDisconnect
+
+from worker_pools import WorkerPoolFull
+
+logger = logging.getLogger(__name__)
+
+# 画質レベル（JPEG品質, 縮小率）。0が最高画質
+QUALITY_LEVELS = [
+    (80, 1.0),
+    (60, 1.0),
+    (50, 0.75),
+    (40, 0.5),
+]
+
+DEGRADE_DROPS = 3  # この回数フレームを破棄したら画質を下げる
+DEGRADE_WINDOW = 2.0  # 破棄回数を数える期間（秒）
+UPGRADE_AFTER = 5.0  # この秒数破棄がなければ画質を上げる
+STATUS_INTERVAL = 0.5  # 状態差分の確認間隔（秒）
+
+
+class LiveClient:
+    """接続ごとの送信キューと画質制御"""
+
+    def __init__(self, max_queue: int = 2):
+        self.max_queue = max_queue
+        self.frames = deque()
+        self.status = {}
+        self.event = asyncio.Event()
+        self.level = 0
+        self.level_changed = True
+
+        # 統計情報
+        self.sent_frames = 0
+        self.dropped_frames = 0
+        self.window_start = time.time()
+        self.window_drops = 0
+        self.last_drop_time = time.time()
+
+    def push_frame(self, jpeg: bytes):
+        """フレームをキューに追加（満杯なら最も古いフレームを破棄）"""
+        if len(self.frames) >= self.max_queue:
+            self.frames.popleft()
+            self.dropped_frames += 1
+            self._on_drop()
+        self.frames.append(jpeg)
+        self.event.set()
+
+    def push_status(self, delta: dict):
+        """状態の差分を追加（未送信の差分とまとめる）"""
+        self.status.update(delta)
+        self.event.set()
+
+    def _on_drop(self):
+        """フレーム破棄時の画質制御"""
+        now = time.time()
+        self.last_drop_time = now
+        if now - self.window_start > DEGRADE_WINDOW:
+            self.window_start = now
+            self.window_drops = 0
+        self.window_drops += 1
+
+        if self.window_drops >= DEGRADE_DROPS and self.level < len(QUALITY_LEVELS) - 1:
+            self.level += 1
+            self.level_changed = True
+            self.window_drops = 0
+            logger.info(f"ライブ配信の画質を下げます: レベル {self.level}")
+
+    def maybe_upgrade(self):
+        """しばらく破棄がなければ画質を上げる"""
+        now = time.time()
+        if self.level > 0 and now - self.last_drop_time > UPGRADE_AFTER:
+            self.level -= 1
+            self.level_changed = True
+            self.last_drop_time = now
+            logger.info(f"ライブ配信の画質を上げます: レベル {self.level}")
+
+    @property
+    def quality(self):
+        return QUALITY_LEVELS[self.level]
+
+
+class LiveChannel:
+    """/ws/live のセッション管理"""
+
+    def __init__(self, broadcaster, frame_source, status_source, encoder, pool, max_queue: int = 2):
+        self.broadcaster = broadcaster
+        self.frame_source = frame_source
+        self.status_source = status_source
+        self.encoder = encoder
+        self.pool = pool
+        self.max_queue = max_queue
+        self.clients = set()
+
+    async def serve(self, websocket: WebSocket):
+        """WebSocket接続を処理"""
+        await websocket.accept()
+        client = LiveClient(self.max_queue)
+        self.clients.add(client)
+        subscriber = self.broadcaster.subscribe()
+        logger.info(f"ライブ配信に接続しました (接続数: {len(self.clients)})")
+
+        tasks = [
+            asyncio.create_task(self._produce_frames(client, subscriber)),
+            asyncio.create_task(self._produce_status(client)),
+            asyncio.create_task(self._send(websocket, client)),
+            asyncio.create_task(self._receive(websocket)),
+        ]
+        try:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() and not isinstance(task.exception(), WebSocketDisconnect):
+                    logger.error(f"ライブ配信エラー: {task.exception()}")
+        finally:
+            for task in tasks:
+                task.cancel()
+            self.broadcaster.unsubscribe(subscriber)
+            self.clients.discard(client)
+            logger.info(f"ライブ配信を切断しました (接続数: {len(self.clients)})")
+
+    async def _produce_frames(self, client: LiveClient, subscriber):
+        """共有エンコード済みフレームを受け取り、接続の画質に合わせてキューに積む"""
+        while True:
+            result = await self.broadcaster.next_frame(subscriber)
+            if result is None:
+                continue
+            _, jpeg = result
+
+            client.maybe_upgrade()
+            if client.level > 0:
+                # 画質を落としている接続だけ追加でエンコードする
+                # （同じレベルの接続が複数あってもエンコードは1回）
+                quality, scale = client.quality
+                seq, frame = self.frame_source.get_latest_frame()
+                try:
+                    jpeg = await self.pool.run(
+                        self.encoder, seq, frame, quality, scale)
+                except WorkerPoolFull:
+                    client.dropped_frames += 1
+                    continue
+
+            if client.level_changed:
+                quality, scale = client.quality
+                client.push_status({"quality": quality, "scale": scale})
+                client.level_changed = False
+            client.push_frame(jpeg)
+
+    async def _produce_status(self, client: LiveClient):
+        """動き検知・録画状態の差分をキューに積む"""
+        last = {}
+        while True:
+            status = self.status_source()
+            recording_status = status.get("recording_status")
+            if recording_status:
+                recording_status["duration"] = round(recording_status["duration"], 1)
+
+            delta = {key: value for key, value in status.items() if last.get(key) != value}
+            if delta:
+                client.push_status(delta)
+                last = status
+            await asyncio.sleep(STATUS_INTERVAL)
+
+    async def _send(self, websocket: WebSocket, client: LiveClient):
+        """キューの内容を送信（状態メッセージを優先）"""
+        while True:
+            await client.event.wait()
+            client.event.clear()
+
+            if client.status:
+                status, client.status = client.status, {}
+                await websocket.send_text(json.dumps({"type": "status", "data": status}))
+
+            while client.frames:
+                await websocket.send_bytes(client.frames.popleft())
+                client.sent_frames += 1
+
+    async def _receive(self, websocket: WebSocket):
+        """クライアントからの切断を検知"""
+        while True:
+            await websocket.receive_text()
+
+    def get_stats(self):
+        """接続ごとの統計情報を取得"""
+        return [
+            {
+                "level": client.level,
+                "quality": client.quality[0],
+                "scale": client.quality[1],
+                "queued": len(client.frames),
+                "sent_frames": client.sent_frames,
+                "dropped_frames": client.dropped_frames
+            }
+            for client in self.clients
+        ]
@@ -8,6 +8,7 @@ from fastapi.responses import HTMLResponse, StreamingResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 import json
+import re
 import logging
 import base64
 import os
@@ -16,9 +17,24 @@ from datetime import datetime
 from pathlib import Path
 import threading
 import io
+from collections import deque
 from PIL import Image
 from iot_client import get_iot_client
 from line_messaging import LineMessagingAPI
+from notification_coalescer import NotificationCoalescer, TokenBucket
+from frame_broadcast import FrameBroadcaster
+from jpeg_cache import JpegCache
+from live_channel import LiveChannel
+from pre_event_buffer import PreEventBuffer
+from video_encoders import CodecSelector, FfmpegWriter, ffmpeg_available
+from convert_recordings import BatchTranscoder, MANIFEST_NAME, is_recording_file
+from recording_index import RecordingIndex, SORT_COLUMNS
+from thumbnail_queue import ThumbnailQueue
+from recording_metadata import RecordingMetadataCache
+from retention import RetentionManager
+from file_serving import (FileCache, RangeFileResponse, file_validators, if_range_matches,
+                          is_not_modified, not_modified_response, parse_range_header)
+from worker_pools import WorkerPoolFull, frame_pool, media_pool, thumbnail_pool, get_pool_stats, shutdown_pools
 
 # ログ設定
 logging.basicConfig(level=logging.INFO)
@@ -37,15 +53,69 @@ app.add_middleware(
 
 # 録画ディレクトリの作成
 RECORDINGS_DIR = Path("recordings")
+RECORDING_NAME_PATTERN = re.compile(r"^(motion_\d{8}_\d{6})(?:_(\d{3}))?\.mp4$")
 RECORDINGS_DIR.mkdir(exist_ok=True)
 
 # サムネイルディレクトリの作成
 THUMBNAILS_DIR = Path("thumbnails")
 THUMBNAILS_DIR.mkdir(exist_ok=True)
 
+# 録画インデックスなどの管理用ファイルの保存先（APIで配信する録画ディレクトリの外に置く）
+DATA_DIR = Path(os.getenv("CAMERA_DATA_DIR", "data"))
+DATA_DIR.mkdir(exist_ok=True)
+
+
+def move_legacy_index(path: Path):
+    """以前は録画ディレクトリに置いていた録画インデックスを移動"""
+    for suffix in ("", "-wal", "-shm"):
+        legacy_path = RECORDINGS_DIR / f"index.db{suffix}"
+        target_path = path.with_name(path.name + suffix)
+        if legacy_path.exists() and not target_path.exists():
+            try:
+                os.replace(legacy_path, target_path)
+                logger.info(f"録画インデックスを移動しました: {legacy_path} -> {target_path}")
+            except OSError as e:
+                logger.error(f"録画インデックスの移動エラー: {legacy_path}: {e}")
+
+
+def is_recording_name(filename: str):
+    """APIで扱える録画ファイル名か（録画一覧に載る .mp4 のみ、管理用・一時ファイルは除く）"""
+    return (
+        "/" not in filename and "\\" not in filename and ".." not in filename
+        and not filename.startswith(".") and filename.endswith(".mp4")
+        and is_recording_file(Path(filename)))
+
+
+# 録画インデックス（録画一覧はディレクトリを走査せずここから返す）
+RECORDING_INDEX_PATH = Path(os.getenv("RECORDING_INDEX_PATH", str(DATA_DIR / "recording_index.db")))
+move_legacy_index(RECORDING_INDEX_PATH)
+recording_index = RecordingIndex(str(RECORDING_INDEX_PATH))
+
+# LINE通知に添付する画像の保存先（/snapshots で配信し、LINEのサーバーが取得する）
+SNAPSHOTS_DIR = Path("snapshots")
+SNAPSHOT_NAME_PATTERN = re.compile(r"^[0-9a-f]{32}\.jpg$")
+
 # LINE Messaging API設定
 LINE_CHANNEL_ACCESS_TOKEN = os.getenv("LINE_CHANNEL_ACCESS_TOKEN")
-line_messaging = LineMessagingAPI(LINE_CHANNEL_ACCESS_TOKEN)
+# 送信は専用スレッドで行い、再送待ちの通知は LINE_SPOOL_DIR に保存する
+# 画像は NOTIFY_SNAPSHOT_BASE_URL（このサーバーの /snapshots を公開したHTTPSのURL）で送る
+line_messaging = LineMessagingAPI(
+    LINE_CHANNEL_ACCESS_TOKEN,
+    spool_dir=Path(os.getenv("LINE_SPOOL_DIR", "line_spool")),
+    max_queue=int(os.getenv("LINE_QUEUE_SIZE", "100")),
+    snapshot_dir=SNAPSHOTS_DIR,
+    snapshot_base_url=os.getenv("NOTIFY_SNAPSHOT_BASE_URL"),
+    snapshot_keep=int(os.getenv("NOTIFY_SNAPSHOT_KEEP", "100")))
+
+# 続けて発生した録画完了通知をまとめて送信（種類ごとに送信数を制限）
+notification_coalescer = NotificationCoalescer(
+    {"recording": line_messaging.send_recording_notifications},
+    window=float(os.getenv("NOTIFY_WINDOW_SECONDS", "60")),
+    buckets={
+        "recording": TokenBucket(
+            capacity=float(os.getenv("NOTIFY_RECORDING_BURST", "3")),
+            refill_per_hour=float(os.getenv("NOTIFY_RECORDING_PER_HOUR", "12")))
+    })
 
 
 def generate_thumbnail(video_path: Path, thumbnail_path: Path, time_position: float = None):
@@ -96,12 +166,96 @@ def generate_thumbnail(video_path: Path, thumbnail_path: Path, time_position: fl
         return False
 
 
+def probe_video_info(file_path: Path):
+    """ffprobeを使用して録画ファイルの詳細情報を取得（失敗時はNone）"""
+    import subprocess
+    try:
+        result = subprocess.run([
+            "ffprobe", "-v", "quiet", "-print_format", "json",
+            "-show_format", "-show_streams", str(file_path)
+        ], capture_output=True, text=True, timeout=30)
+    except (OSError, subprocess.TimeoutExpired) as e:
+        logger.error(f"ffprobe実行エラー: {e}")
+        return None
+
+    if result.returncode != 0:
+        logger.error(f"ffprobe実行エラー: {result.stderr}")
+        return None
+    logger.info(f"録画ファイル情報取得成功: {file_path.name}")
+    return json.loads(result.stdout)
+
+
+# 録画ファイルのメタデータキャッシュ（録画の確定時に登録、ffprobeは未登録・変更時のみ）
+recording_metadata = RecordingMetadataCache(
+    recording_index, probe_video_info,
+    max_entries=int(os.getenv("METADATA_CACHE_SIZE", "256")))
+
+# サムネイル生成の待ち行列（録画の確定時・起動時に登録）
+thumbnail_queue = ThumbnailQueue(
+    generate_thumbnail, thumbnail_pool, THUMBNAILS_DIR,
+    on_generated=recording_index.set_thumbnail)
+
+# よく参照されるサムネイルのメモリキャッシュ（一覧の再読み込みでディスクを読まない）
+thumbnail_cache = FileCache(
+    max_bytes=int(float(os.getenv("THUMBNAIL_CACHE_MB", "8")) * 1024 * 1024))
+
+
+def draw_timestamp(frame, current_datetime):
+    """フレームに日時を描画（日付は左上、時刻は右上）"""
+    date_str = current_datetime.strftime("%Y/%m/%d")
+    time_str = current_datetime.strftime("%H:%M:%S")
+
+    cv2.putText(frame, date_str, (10, 30),
+                cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
+    cv2.putText(frame, date_str, (10, 30),
+                cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 0), 1)
+
+    time_x = frame.shape[1] - 150
+    cv2.putText(frame, time_str, (time_x, 30),
+                cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
+    cv2.putText(frame, time_str, (time_x, 30),
+                cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 0), 1)
+
+
+def encode_jpeg(frame, quality: int = None, scale: float = 1.0):
+    """フレームをJPEGにエンコード（scaleを指定すると縮小してからエンコード）"""
+    if scale != 1.0:
+        height, width = frame.shape[:2]
+        frame = cv2.resize(frame, (int(width * scale), int(height * scale)),
+                           interpolation=cv2.INTER_AREA)
+    params = [cv2.IMWRITE_JPEG_QUALITY, quality] if quality is not None else []
+    _, buffer = cv2.imencode('.jpg', frame, params)
+    return buffer.tobytes()
+
+
+# 動き検知の背景モデル
+MOTION_BACKENDS = ["frame_diff", "running_average", "mog2", "knn"]
+
+
 class MotionDetector:
-    """動き検知クラス"""
+    """動き検知クラス
+
+    背景モデル（backend）:
+    - frame_diff: 直前のフレームとの差分（従来方式）
+    - running_average: 指数移動平均の背景との差分（cv2.accumulateWeighted）
+    - mog2 / knn: OpenCVの背景差分器
+    """
 
-    def __init__(self, threshold=35, min_area=2000):
+    def __init__(self, threshold=35, min_area=2000, process_width=0, backend="frame_diff"):
+        if backend not in MOTION_BACKENDS:
+            logger.warning(f"不明な背景モデルのため frame_diff を使用します: {backend}"
+                           f"（{', '.join(MOTION_BACKENDS)} のいずれかを指定してください）")
+            backend = "frame_diff"
+        self.backend = backend
+        self.background_alpha = 0.05  # running_averageの背景更新率
+        self.background = None  # running_averageの背景（float32）
+        self.subtractor = None  # mog2 / knn の背景差分器
         self.threshold = threshold
-        self.min_area = min_area
+        self.min_area = min_area  # フル解像度での面積（px）
+        self.process_width = process_width  # 検知処理の幅（0はフル解像度）
+        self.roi_regions = []  # 検知対象領域（正規化座標のポリゴン）
+        self.exclusion_regions = []  # 除外領域（正規化座標のポリゴン）
+        self.mask_cache = None  # (処理サイズ, マスク, 切り出し範囲)
         self.prev_frame = None
         self.motion_detected = False
         self.motion_start_time = None
@@ -109,40 +263,155 @@ class MotionDetector:
         self.motion_cooldown = 3.0  # 動きがなくなってから3秒後に録画停止
         self.initialization_frames = 0  # 初期化フレーム数
         self.required_init_frames = 10  # 初期化に必要なフレーム数（5から10に増加）
+        self.last_motion_area = 0
+        self.frame_motion = False  # 直近フレーム単体の判定（クールダウン適用前）
+        # 設定の変更（イベントループ）と検知（キャプチャスレッド）が同じフレームで重ならないようにする
+        self.lock = threading.Lock()
+
+    def set_regions(self, roi_regions=None, exclusion_regions=None):
+        """検知対象領域・除外領域を設定（座標は0-1に正規化したポリゴンのリスト）"""
+        with self.lock:
+            self.roi_regions = roi_regions or []
+            self.exclusion_regions = exclusion_regions or []
+            self.mask_cache = None
+            self.prev_frame = None  # 処理範囲が変わるため比較フレームを破棄
+
+    def set_backend(self, backend):
+        """背景モデルを切り替え"""
+        if backend not in MOTION_BACKENDS:
+            raise ValueError(f"Unknown motion backend: {backend}")
+        with self.lock:
+            if backend != self.backend:
+                self.backend = backend
+                self.prev_frame = None  # 次のフレームでモデルを作り直す
+
+    def _reset_model(self, gray):
+        """背景モデルを初期化"""
+        self.prev_frame = gray
+        self.background = gray.astype(np.float32)
+        if self.backend == "mog2":
+            self.subtractor = cv2.createBackgroundSubtractorMOG2(detectShadows=False)
+            self.subtractor.apply(gray)
+        elif self.backend == "knn":
+            self.subtractor = cv2.createBackgroundSubtractorKNN(detectShadows=False)
+            self.subtractor.apply(gray)
+        else:
+            self.subtractor = None
+
+    def _foreground(self, gray):
+        """背景モデルとの差分から前景の二値画像を取得"""
+        if self.backend == "running_average":
+            background = cv2.convertScaleAbs(self.background)
+            frame_delta = cv2.absdiff(background, gray)
+            cv2.accumulateWeighted(gray, self.background, self.background_alpha)
+        elif self.backend in ("mog2", "knn"):
+            frame_delta = self.subtractor.apply(gray)
+            return cv2.threshold(frame_delta, 200, 255, cv2.THRESH_BINARY)[1]
+        else:
+            frame_delta = cv2.absdiff(self.prev_frame, gray)
+
+        return cv2.threshold(frame_delta, self.threshold,
+                             255, cv2.THRESH_BINARY)[1]
+
+    def set_process_width(self, process_width):
+        """検知処理の幅を設定（0はフル解像度）"""
+        with self.lock:
+            if process_width != self.process_width:
+                self.process_width = process_width
+                self.mask_cache = None
+                self.prev_frame = None
+
+    def _get_mask(self, width, height):
+        """処理サイズに合わせたマスクと切り出し範囲を取得（領域未設定時はNone）"""
+        if not self.roi_regions and not self.exclusion_regions:
+            return None, None
+
+        if self.mask_cache and self.mask_cache[0] == (width, height):
+            return self.mask_cache[1], self.mask_cache[2]
+
+        scale = np.array([width, height], dtype=np.float32)
+        if self.roi_regions:
+            mask = np.zeros((height, width), dtype=np.uint8)
+            for region in self.roi_regions:
+                points = (np.array(region, dtype=np.float32) * scale).astype(np.int32)
+                cv2.fillPoly(mask, [points], 255)
+        else:
+            mask = np.full((height, width), 255, dtype=np.uint8)
+        for region in self.exclusion_regions:
+            points = (np.array(region, dtype=np.float32) * scale).astype(np.int32)
+            cv2.fillPoly(mask, [points], 0)
+
+        # マスク外は処理しないよう外接矩形で切り出す
+        x, y, w, h = cv2.boundingRect(mask)
+        if w == 0 or h == 0:
+            x, y, w, h = 0, 0, width, height
+        crop = (slice(y, y + h), slice(x, x + w))
+        mask = mask[crop]
+        self.mask_cache = ((width, height), mask, crop)
+        return mask, crop
+
+    def _preprocess(self, frame):
+        """グレースケール化・縮小・領域切り出し・ぼかしを行い (画像, マスク, 縮小率) を返す"""
+        height, width = frame.shape[:2]
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+
+        scale = 1.0
+        if self.process_width and self.process_width < width:
+            scale = self.process_width / width
+            width, height = self.process_width, max(1, int(height * scale))
+            gray = cv2.resize(gray, (width, height), interpolation=cv2.INTER_AREA)
+
+        mask, crop = self._get_mask(width, height)
+        if crop is not None:
+            gray = gray[crop]
+
+        # ぼかしのカーネルは縮小率に合わせる（奇数・最小3）
+        blur = max(3, int(21 * scale) | 1)
+        gray = cv2.GaussianBlur(gray, (blur, blur), 0)
+        return gray, mask, scale
 
     def detect_motion(self, frame):
-        """動きを検知"""
+        """動きを検知（設定の変更は前後のフレームの間で反映される）"""
+        with self.lock:
+            return self._detect_motion(frame)
+
+    def _detect_motion(self, frame):
+        """動きを検知（lockを取得して呼ぶ）"""
         # 初期化期間中は動き検知を無効化
         if self.initialization_frames < self.required_init_frames:
             self.initialization_frames += 1
             if self.initialization_frames == self.required_init_frames:
                 # 初期化完了時に最初のフレームを設定
-                gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-                gray = cv2.GaussianBlur(gray, (21, 21), 0)
-                self.prev_frame = gray
+                gray, _, _ = self._preprocess(frame)
+                self._reset_model(gray)
                 logger.info("動き検知の初期化が完了しました")
             return False
 
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        gray = cv2.GaussianBlur(gray, (21, 21), 0)
+        gray, mask, scale = self._preprocess(frame)
 
-        if self.prev_frame is None:
-            self.prev_frame = gray
+        if self.prev_frame is None or self.prev_frame.shape != gray.shape:
+            self._reset_model(gray)
             return False
 
-        # フレーム差分を計算
-        frame_delta = cv2.absdiff(self.prev_frame, gray)
-        thresh = cv2.threshold(frame_delta, self.threshold,
-                               255, cv2.THRESH_BINARY)[1]
+        # 背景モデルとの差分を計算
+        thresh = self._foreground(gray)
+        if mask is not None:
+            thresh = cv2.bitwise_and(thresh, mask)
 
-        # ノイズを除去（より強力なモルフォロジー処理）
-        kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5))
+        # ノイズを除去（より強力なモルフォロジー処理、縮小率に合わせて調整）
+        kernel_size = max(3, int(5 * scale) | 1)
+        kernel = cv2.getStructuringElement(
+            cv2.MORPH_ELLIPSE, (kernel_size, kernel_size))
         thresh = cv2.morphologyEx(thresh, cv2.MORPH_CLOSE, kernel)
-        thresh = cv2.dilate(thresh, None, iterations=3)
+        thresh = cv2.dilate(thresh, None, iterations=max(1, round(3 * scale)))
         thresh = cv2.erode(thresh, None, iterations=1)
 
         contours, _ = cv2.findContours(
-            thresh.copy(), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+            thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+        # 面積・サイズの閾値を処理解像度に換算
+        min_area = self.min_area * scale * scale
+        min_size = 50 * scale
 
         # 動きの検知（より厳密な条件）
         motion_detected = False
@@ -150,20 +419,25 @@ class MotionDetector:
 
         for contour in contours:
             area = cv2.contourArea(contour)
-            if area > self.min_area:
+            if area > min_area:
                 # 輪郭の長方形を取得
                 x, y, w, h = cv2.boundingRect(contour)
                 aspect_ratio = w / h if h > 0 else 0
 
                 # 小さすぎる動きや細すぎる動きを除外
-                if area > self.min_area and w > 50 and h > 50 and 0.2 < aspect_ratio < 5.0:
+                if w > min_size and h > min_size and 0.2 < aspect_ratio < 5.0:
                     total_motion_area += area
                     motion_detected = True
 
         # 総動き面積が一定以上の場合のみ動きとみなす
-        if total_motion_area < self.min_area * 2:
+        if total_motion_area < min_area * 2:
             motion_detected = False
 
+        # 面積はフル解像度に換算して記録
+        total_motion_area /= scale * scale
+        self.last_motion_area = total_motion_area
+        self.frame_motion = motion_detected
+
         # 動きの状態を更新
         if motion_detected and not self.motion_detected:
             # 動き開始
@@ -171,18 +445,8 @@ class MotionDetector:
             self.motion_start_time = time.time()
             logger.info(f"動きを検知しました - 録画開始 (面積: {total_motion_area:.0f}px)")
 
-            # 動体検知通知は無効化（録画完了通知のみ）
-            # if line_messaging.enabled:
-            #     # 現在のフレームを画像として保存して送信
-            #     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            #     image_filename = f"motion_detected_{timestamp}.jpg"
-            #     image_path = RECORDINGS_DIR / image_filename
-
-            #     # フレームを画像として保存
-            #     cv2.imwrite(str(image_path), frame)
-
-            #     # LINE通知を送信（画像付き）
-            #     line_messaging.send_motion_detected_notification(image_path)
+            # 動体検知時の画像は録画完了通知に添付する（NOTIFY_SNAPSHOT=1）
+            # 検知経路ではファイル保存・エンコードをしない
 
         elif not motion_detected and self.motion_detected:
             # 動き終了（クールダウン期間を設定）
@@ -202,77 +466,487 @@ class MotionDetector:
         return self.motion_detected
 
 
+class DetectionScheduler:
+    """動き検知の実行間隔を制御するクラス
+
+    待機中は idle_fps に間引き、動き検知中・録画中は全フレームで検知する
+    """
+
+    def __init__(self, idle_fps=5.0):
+        self.idle_fps = idle_fps  # 待機中の検知レート（0は間引きなし）
+        self.last_run_time = 0.0
+        self.detected_frames = 0
+        self.skipped_frames = 0
+        self.active = False
+
+        # 実効検知レートの計測
+        self.rate_window_start = time.time()
+        self.rate_window_runs = 0
+        self.effective_fps = 0.0
+
+    def should_run(self, active):
+        """このフレームで動き検知を実行するか判定"""
+        now = time.time()
+        self.active = active
+        if active or self.idle_fps <= 0 or now - self.last_run_time >= 1.0 / self.idle_fps:
+            self.last_run_time = now
+            self.detected_frames += 1
+            self.rate_window_runs += 1
+            run = True
+        else:
+            self.skipped_frames += 1
+            run = False
+
+        elapsed = now - self.rate_window_start
+        if elapsed >= 1.0:
+            self.effective_fps = self.rate_window_runs / elapsed
+            self.rate_window_start = now
+            self.rate_window_runs = 0
+        return run
+
+    def get_stats(self):
+        """検知スケジューラの統計情報を取得"""
+        total = self.detected_frames + self.skipped_frames
+        return {
+            "idle_fps": self.idle_fps,
+            "mode": "active" if self.active else "idle",
+            "effective_fps": round(self.effective_fps, 1),
+            "detected_frames": self.detected_frames,
+            "skipped_frames": self.skipped_frames,
+            "skip_ratio": round(self.skipped_frames / total, 3) if total else 0
+        }
+
+
+# 録画キューが満杯の時の動作（drop_oldest: 古いフレームを破棄 / block: 空くまで待機）
+RECORDING_DROP_POLICIES = ["drop_oldest", "block"]
+
+
+class RecordingWriter:
+    """録画ファイルへの書き込みスレッド
+
+    キャプチャ側はフレームをキューに積むだけで、日時の描画とエンコードはこのスレッドで行う。
+    各フレームは取得時刻に対応するフレーム位置に書き込み、足りない位置は直前のフレームを複製、
+    同じ位置に重なるフレームは破棄するため、再生時間が実時間と一致する
+    """
+
+    MAX_DUPLICATE_SECONDS = 10.0  # 取得が途切れた場合に複製で埋める上限（秒）
+
+    def __init__(self, recording_path, video_writer, fps, on_finished,
+                 max_queue=60, drop_policy="drop_oldest", event_id=None,
+                 open_segment=None, segment_frames=0, segment_max_bytes=0,
+                 frame_size=None, codec=None, on_segment=None):
+        self.recording_path = recording_path
+        self.event_id = event_id or Path(recording_path).stem
+        self.frame_size = frame_size
+        self.codec = codec
+        self.on_segment = on_segment  # ファイルを開いた・閉じたときに呼ばれる
+        self.video_writer = video_writer
+        self.fps = fps
+        self.on_finished = on_finished
+        self.max_queue = max_queue
+        self.drop_policy = drop_policy
+        self.queue = deque()
+        self.prefill_queue = deque()  # 録画前バッファのフレーム（キュー上限の対象外）
+        self.on_prefill_written = None  # 録画前バッファのフレームを書き終えたら呼ぶ
+        self.condition = threading.Condition()
+        self.finishing = False
+        self.start_time = time.time()
+        self.end_time = None
+
+        # 統計情報
+        self.queued_frames = 0
+        self.written_frames = 0
+        self.dropped_frames = 0
+        self.duplicated_frames = 0  # タイミング合わせのために複製したフレーム
+        self.timing_dropped_frames = 0  # 同じフレーム位置に重なり破棄したフレーム
+        self.first_timestamp = None
+        self.last_timestamp = None
+
+        # 分割録画（open_segmentがNoneなら分割しない）
+        self.open_segment = open_segment
+        self.segment_frames = segment_frames
+        self.segment_max_bytes = segment_max_bytes
+        self.segments = [recording_path]
+        self.closing_threads = []  # 前の分割ファイルを閉じているスレッド
+        self.segment_written = 0
+        self.segment_start_frame = 0
+
+        # 動き検知の統計（録画管理側が更新）
+        self.motion_frames = 0
+        self.max_motion_area = 0
+        self.snapshot_frame = None  # 動きの面積が最大のフレーム（通知用、録画キューと同じコピーを参照）
+
+        self.thread = threading.Thread(
+            target=self._writer_worker, name="recording-writer")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def put(self, frame, timestamp):
+        """フレームをキューに追加"""
+        with self.condition:
+            if self.finishing:
+                return False
+            if len(self.queue) >= self.max_queue:
+                if self.drop_policy == "block":
+                    # 空きができるまで待機
+                    self.condition.wait_for(
+                        lambda: len(self.queue) < self.max_queue or self.finishing)
+                    if self.finishing:
+                        return False
+                else:
+                    # 最も古いフレームを破棄
+                    self.queue.popleft()
+                    self.dropped_frames += 1
+            self.queue.append((frame, timestamp))
+            self.queued_frames += 1
+            self.condition.notify_all()
+            return True
+
+    def prefill(self, frames, on_written=None):
+        """録画前バッファのフレームを先頭に書き込むよう追加（書き終えたら on_written を呼ぶ）"""
+        if not frames:
+            if on_written:
+                on_written()
+            return
+        with self.condition:
+            self.on_prefill_written = on_written
+            self.prefill_queue.extend(frames)
+            self.queued_frames += len(frames)
+            # 録画時間は最初のフレームの取得時刻から数える
+            self.start_time = min(self.start_time, frames[0][1])
+            self.condition.notify_all()
+
+    def finish(self):
+        """録画終了を通知（キューに残ったフレームを書き込んでから閉じる）"""
+        with self.condition:
+            self.finishing = True
+            self.end_time = time.time()
+            self.condition.notify_all()
+
+    def _write_at(self, frame, timestamp):
+        """取得時刻に対応するフレーム位置まで複製・破棄して書き込む"""
+        if self.first_timestamp is None:
+            self.first_timestamp = timestamp
+        self.last_timestamp = timestamp
+
+        target_index = int(round((timestamp - self.first_timestamp) * self.fps))
+        if target_index < self.written_frames:
+            # 前のフレームと同じ位置になるため破棄
+            self.timing_dropped_frames += 1
+            return
+
+        # 取得の間隔が空いた分はこのフレームで埋める
+        copies = target_index - self.written_frames + 1
+        max_copies = max(1, int(self.fps * self.MAX_DUPLICATE_SECONDS))
+        if copies > max_copies:
+            # 上限を超えた空白は詰める（以降のフレーム位置をずらす）
+            self.first_timestamp += (copies - max_copies) / self.fps
+            copies = max_copies
+
+        for _ in range(copies):
+            if self._segment_full():
+                self._roll_segment()
+            self.video_writer.write(frame)
+            self.segment_written += 1
+            self.written_frames += 1
+        self.duplicated_frames += copies - 1
+
+    def _segment_full(self):
+        """現在の分割ファイルが上限に達したか"""
+        if self.open_segment is None or self.segment_written == 0:
+            return False
+        if self.segment_frames and self.segment_written >= self.segment_frames:
+            return True
+        # ファイルサイズの確認は約1秒ごと
+        if self.segment_max_bytes and self.segment_written % max(1, int(self.fps)) == 0:
+            try:
+                return self.recording_path.stat().st_size >= self.segment_max_bytes
+            except OSError:
+                return False
+        return False
+
+    def segment_info(self, in_progress=False):
+        """現在のファイルの情報（開始・終了時刻はフレーム位置から計算）"""
+        base = self.first_timestamp if self.first_timestamp is not None else self.start_time
+        start_time = base + self.segment_start_frame / self.fps
+        width, height = self.frame_size or (None, None)
+        return {
+            "filename": self.recording_path.name,
+            "event_id": self.event_id,
+            "segment": len(self.segments) if self.open_segment else None,
+            "start_time": start_time,
+            "end_time": start_time + self.segment_written / self.fps,
+            "duration": self.segment_written / self.fps,
+            "frame_count": self.segment_written,
+            "fps": self.fps,
+            "width": width,
+            "height": height,
+            "codec": self.codec,
+            "motion_frames": self.motion_frames,
+            "max_motion_area": self.max_motion_area,
+            "in_progress": 1 if in_progress else 0
+        }
+
+    def _notify_segment(self, in_progress, info=None):
+        """ファイルの開閉を通知"""
+        if self.on_segment is None:
+            return
+        try:
+            self.on_segment(self, info or self.segment_info(in_progress))
+        except Exception as e:
+            logger.error(f"録画ファイル情報の更新エラー: {e}")
+
+    def _roll_segment(self):
+        """次の分割ファイルに切り替える（フレームは破棄しない）
+
+        先に次のファイルを開いてから、前のファイルは別スレッドで閉じる
+        （ffmpegの終了待ち・faststartの書き換えの間も書き込みを止めない）
+        """
+        previous_path, previous_writer = self.recording_path, self.video_writer
+        previous_info = self.segment_info(in_progress=False)
+
+        path, video_writer = self.open_segment(len(self.segments) + 1)
+        if not video_writer.isOpened():
+            logger.error(f"分割ファイルを開けませんでした: {path}")
+        self.recording_path = path
+        self.video_writer = video_writer
+        self.segments.append(path)
+        self.segment_start_frame = self.written_frames
+        self.segment_written = 0
+        self._notify_segment(in_progress=True)
+
+        thread = threading.Thread(
+            target=self._close_segment, args=(previous_path, previous_writer, previous_info),
+            name="recording-segment-close", daemon=True)
+        self.closing_threads.append(thread)
+        thread.start()
+
+    def _close_segment(self, path, video_writer, info):
+        """分割ファイルを閉じてインデックスに反映"""
+        try:
+            video_writer.release()
+        except Exception as e:
+            logger.error(f"分割ファイルのクローズエラー: {e}")
+        logger.info(f"分割ファイルを閉じました: {path} ({info['frame_count']}フレーム)")
+        self._notify_segment(in_progress=False, info=info)
+
+    def _writer_worker(self):
+        """書き込みワーカー"""
+        while True:
+            with self.condition:
+                self.condition.wait_for(
+                    lambda: self.prefill_queue or self.queue or self.finishing)
+                prefill_done = None
+                if self.prefill_queue:
+                    frame, timestamp = self.prefill_queue.popleft()
+                    if not self.prefill_queue:
+                        prefill_done, self.on_prefill_written = self.on_prefill_written, None
+                elif self.queue:
+                    frame, timestamp = self.queue.popleft()
+                else:
+                    break
+                self.condition.notify_all()
+
+            try:
+                # 録画フレームに日時を追加
+                draw_timestamp(frame, datetime.fromtimestamp(timestamp))
+                self._write_at(frame, timestamp)
+
+            except Exception as e:
+                logger.error(f"フレーム書き込みエラー: {e}")
+
+            if prefill_done:
+                # 録画前バッファの配列を返却（以降は参照しない）
+                prefill_done()
+
+        self.video_writer.release()
+        # 前の分割ファイルを閉じ終えてから録画完了とする
+        for thread in self.closing_threads:
+            thread.join()
+        logger.info(
+            f"録画ファイルを閉じました: {self.recording_path} (FPS: {self.fps}, 書き込み: {self.written_frames}, "
+            f"複製: {self.duplicated_frames}, 破棄: {self.dropped_frames + self.timing_dropped_frames})")
+        self._notify_segment(in_progress=False)
+        try:
+            self.on_finished(self)
+        except Exception as e:
+            logger.error(f"録画完了処理エラー: {e}")
+
+    def get_stats(self):
+        """書き込みキューの統計情報を取得"""
+        with self.condition:
+            return {
+                "queue_depth": len(self.queue) + len(self.prefill_queue),
+                "queued_frames": self.queued_frames,
+                "written_frames": self.written_frames,
+                "dropped_frames": self.dropped_frames,
+                "duplicated_frames": self.duplicated_frames,
+                "timing_dropped_frames": self.timing_dropped_frames,
+                "segments": len(self.segments)
+            }
+
+
+# エンコーダーのコーデック名とffprobeのコーデック名の対応
+ENCODER_CODECS = {
+    "libx264": "h264",
+    "h264_v4l2m2m": "h264",
+    "H264": "h264",
+    "mp4v": "mpeg4",
+    "XVID": "mpeg4",
+    "MJPG": "mjpeg",
+}
+
+
 class RecordingManager:
     """録画管理クラス"""
 
     def __init__(self):
         self.is_recording = False
         self.video_writer = None
+        self.recording_writer = None
+        self.finishing_writers = set()  # 書き込み完了待ちのライター
         self.recording_start_time = None
         self.recording_path = None
         self.frame_count = 0
         self.target_fps = 30.0
         self.stop_recording_flag = False
         self.server_url = "http://localhost:3000"  # デフォルトURL
-
-    def start_recording(self, frame, camera_fps=30.0):
-        """録画開始"""
-        if self.is_recording:
-            return
-
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"motion_{timestamp}.mp4"
-        self.recording_path = RECORDINGS_DIR / filename
-
-        # 動画エンコーダーを設定
-        height, width = frame.shape[:2]
-
-        # 固定フレームレートで録画（等倍再生のため）
-        recording_fps = 120.0  # 固定120FPS
+        self.event_id = None
+
+        # 分割録画の設定（どちらも0なら1イベント1ファイル）
+        self.segment_seconds = float(os.getenv("RECORDING_SEGMENT_SECONDS", "0"))
+        self.segment_max_bytes = int(float(os.getenv("RECORDING_SEGMENT_MAX_MB", "0")) * 1024 * 1024)
+
+        # エンコーダーの設定（auto: ffmpegがあればffmpeg / ffmpeg / opencv）
+        self.encoder_backend = os.getenv("RECORDING_ENCODER", "auto")
+        self.ffmpeg_codec = os.getenv("RECORDING_FFMPEG_CODEC", "auto")
+        self.ffmpeg_crf = int(os.getenv("RECORDING_CRF", "23"))
+        self.ffmpeg_bitrate = os.getenv("RECORDING_BITRATE") or None
+        self.ffmpeg_preset = os.getenv("RECORDING_PRESET", "ultrafast")
+        self.active_encoder = None
+        # ffmpegのコーデックは起動時にバックグラウンドで確認する（録画開始時に待たない）
+        self.codec_selector = CodecSelector(self.ffmpeg_codec)
+
+        # 書き込みキューの設定（drop_oldest: 古いフレームを破棄 / block: 空くまで待機）
+        self.max_queue = int(os.getenv("RECORDING_QUEUE_SIZE", "60"))
+        self.drop_policy = os.getenv("RECORDING_DROP_POLICY", "drop_oldest")
+        if self.drop_policy not in RECORDING_DROP_POLICIES:
+            logger.warning(f"不明な録画キューのポリシーのため drop_oldest を使用します: {self.drop_policy}"
+                           f"（{', '.join(RECORDING_DROP_POLICIES)} のいずれかを指定してください）")
+            self.drop_policy = "drop_oldest"
+        self.total_queued_frames = 0
+        self.total_written_frames = 0
+        self.total_dropped_frames = 0
+        self.total_duplicated_frames = 0
+        self.total_timing_dropped_frames = 0
+        self.stats_lock = threading.Lock()
+
+        # 録画前バッファ（動き検知前の数秒間を録画の先頭に含める）
+        self.pre_event_buffer = PreEventBuffer(
+            seconds=float(os.getenv("PRE_EVENT_SECONDS", "3")),
+            max_bytes=int(float(os.getenv("PRE_EVENT_MAX_MB", "64")) * 1024 * 1024))
+
+        # 録画完了通知に添付するスナップショット（縮小したJPEGをメモリから送信）
+        self.snapshot_enabled = os.getenv("NOTIFY_SNAPSHOT", "0") == "1"
+        self.snapshot_width = int(os.getenv("NOTIFY_SNAPSHOT_WIDTH", "640"))
+        self.snapshot_quality = int(os.getenv("NOTIFY_SNAPSHOT_QUALITY", "80"))
+
+    def uses_ffmpeg(self):
+        """ffmpegで録画するか"""
+        return self.encoder_backend == "ffmpeg" or (
+            self.encoder_backend == "auto" and ffmpeg_available())
+
+    def start_codec_selection(self):
+        """ffmpegで録画する場合はコーデックの確認を開始"""
+        if self.uses_ffmpeg():
+            self.codec_selector.start()
+
+    def _open_video_writer(self, path, fps, width, height):
+        """利用可能なコーデックで動画ファイルを開く"""
+        if self.uses_ffmpeg():
+            # ffmpegで直接ブラウザ再生可能なH.264 MP4を作成（変換処理が不要）
+            # コーデックは確認済みの結果だけを使う（未確認ならOpenCVで録画）
+            codec = self.codec_selector.get()
+            if codec:
+                video_writer = FfmpegWriter(
+                    path, fps, (width, height), codec=codec, crf=self.ffmpeg_crf,
+                    bitrate=self.ffmpeg_bitrate, preset=self.ffmpeg_preset)
+                if video_writer.isOpened():
+                    self.active_encoder = f"ffmpeg:{codec}"
+                    return video_writer
+            logger.warning("ffmpegエンコーダーを起動できません。OpenCVにフォールバックします。")
 
         # より安定したコーデック設定（等倍再生のため）
         # まずH.264を試行（最も安定）
         fourcc = cv2.VideoWriter_fourcc(*'H264')
-        self.video_writer = cv2.VideoWriter(
-            str(self.recording_path),
+        video_writer = cv2.VideoWriter(
+            str(path),
             fourcc,
-            recording_fps,
+            fps,
             (width, height)
         )
 
         # H.264が利用できない場合はmp4vにフォールバック
-        if not self.video_writer.isOpened():
+        if not video_writer.isOpened():
             logger.warning("H.264コーデックが利用できません。mp4vにフォールバックします。")
             fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-            self.video_writer = cv2.VideoWriter(
-                str(self.recording_path),
+            video_writer = cv2.VideoWriter(
+                str(path),
                 fourcc,
-                recording_fps,
+                fps,
                 (width, height)
             )
 
         # mp4vも利用できない場合はXVIDにフォールバック
-        if not self.video_writer.isOpened():
+        if not video_writer.isOpened():
             logger.warning("mp4vコーデックも利用できません。XVIDにフォールバックします。")
             fourcc = cv2.VideoWriter_fourcc(*'XVID')
-            self.video_writer = cv2.VideoWriter(
-                str(self.recording_path),
+            video_writer = cv2.VideoWriter(
+                str(path),
                 fourcc,
-                recording_fps,
+                fps,
                 (width, height)
             )
 
         # XVIDも利用できない場合はMJPGにフォールバック
-        if not self.video_writer.isOpened():
+        if not video_writer.isOpened():
             logger.warning("XVIDコーデックも利用できません。MJPGにフォールバックします。")
             fourcc = cv2.VideoWriter_fourcc(*'MJPG')
-            self.video_writer = cv2.VideoWriter(
-                str(self.recording_path),
+            video_writer = cv2.VideoWriter(
+                str(path),
                 fourcc,
-                recording_fps,
+                fps,
                 (width, height)
             )
 
+        fourcc_name = "".join(chr((fourcc >> 8 * i) & 0xFF) for i in range(4))
+        self.active_encoder = f"opencv:{fourcc_name}"
+        return video_writer
+
+    def _segment_path(self, event_id, index=None):
+        """録画ファイルのパスを作成（分割録画ではイベントIDに連番を付ける）"""
+        if index is None:
+            return RECORDINGS_DIR / f"{event_id}.mp4"
+        return RECORDINGS_DIR / f"{event_id}_{index:03d}.mp4"
+
+    def start_recording(self, frame, camera_fps=30.0):
+        """録画開始"""
+        if self.is_recording:
+            return
+
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        self.event_id = f"motion_{timestamp}"
+        segmented = self.segment_seconds > 0 or self.segment_max_bytes > 0
+        self.recording_path = self._segment_path(self.event_id, 1 if segmented else None)
+
+        # 動画エンコーダーを設定
+        height, width = frame.shape[:2]
+
+        # 実際のキャプチャFPSで録画（フレーム位置は取得時刻から決める）
+        recording_fps = max(1.0, min(60.0, round(camera_fps, 2)))
+        self.video_writer = self._open_video_writer(
+            self.recording_path, recording_fps, width, height)
+
         # 録画開始時のログ
         if self.video_writer.isOpened():
             logger.info(
@@ -287,106 +961,193 @@ class RecordingManager:
         self.is_recording = True
         self.recording_start_time = time.time()
         self.frame_count = 0
-        self.target_fps = 120.0  # 固定120FPS
+        self.target_fps = recording_fps
         self.stop_recording_flag = False
-        self.frame_buffer = []  # フレームバッファを追加
-        self.last_frame_time = time.time()  # フレームタイミング制御用
-
-        logger.info(f"録画開始: {self.recording_path} (固定FPS: {recording_fps})")
 
-    def add_frame(self, frame):
-        """フレームを録画に追加"""
-        if self.is_recording and self.video_writer and frame is not None:
-            try:
-                # 録画フレームに日時を追加
-                frame_with_timestamp = frame.copy()
-                current_datetime = datetime.now()
-                date_str = current_datetime.strftime("%Y/%m/%d")
-                time_str = current_datetime.strftime("%H:%M:%S")
-
-                # 日付を表示（左上）
-                cv2.putText(frame_with_timestamp, date_str, (10, 30),
-                            cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
-                cv2.putText(frame_with_timestamp, date_str, (10, 30),
-                            cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 0), 1)
-
-                # 時刻を表示（右上）
-                time_x = frame_with_timestamp.shape[1] - 150
-                cv2.putText(frame_with_timestamp, time_str, (time_x, 30),
-                            cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
-                cv2.putText(frame_with_timestamp, time_str, (time_x, 30),
-                            cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 0), 1)
-
-                # 固定間隔でフレームを記録（等倍再生のため）
-                current_time = time.time()
-
-                if self.frame_count == 0:
-                    # 最初のフレーム
-                    self.last_frame_time = current_time
-                    self.video_writer.write(frame_with_timestamp)
-                    self.frame_count += 1
-                else:
-                    # 固定間隔でフレームを記録
-                    frame_interval = 1.0 / self.target_fps
-                    time_since_last = current_time - self.last_frame_time
-
-                    # フレーム間隔が短すぎる場合は待機
-                    if time_since_last < frame_interval:
-                        sleep_time = frame_interval - time_since_last
-                        time.sleep(sleep_time)
-
-                    # フレームを記録
-                    self.video_writer.write(frame_with_timestamp)
-                    self.frame_count += 1
-                    self.last_frame_time = time.time()
-
-                # フレームレートの監視（デバッグ用）
-                if self.frame_count % 30 == 0:
-                    elapsed_time = current_time - self.recording_start_time
-                    if elapsed_time > 0:
-                        actual_fps = self.frame_count / elapsed_time
-                        logger.info(
-                            f"録画FPS: {actual_fps:.1f} (目標: {self.target_fps:.1f})")
-
-            except Exception as e:
-                logger.error(f"フレーム書き込みエラー: {e}")
+        # 書き込みはライタースレッドで行う
+        event_id = self.event_id
+
+        def open_segment(index):
+            path = self._segment_path(event_id, index)
+            return path, self._open_video_writer(path, recording_fps, width, height)
+
+        self.recording_writer = RecordingWriter(
+            self.recording_path, self.video_writer, self.target_fps,
+            self._on_writer_finished, self.max_queue, self.drop_policy,
+            event_id=event_id,
+            open_segment=open_segment if segmented else None,
+            segment_frames=int(self.segment_seconds * recording_fps),
+            segment_max_bytes=self.segment_max_bytes,
+            frame_size=(width, height),
+            codec=ENCODER_CODECS.get(self.active_encoder.split(":")[-1]),
+            on_segment=self._on_segment)
+
+        # 録画前バッファのフレームを先に書き込む
+        pre_frames = self.pre_event_buffer.drain()
+        self.recording_writer.prefill(pre_frames, on_written=self.pre_event_buffer.release)
+        self.frame_count = len(pre_frames)
+
+        # 録画中のファイルとしてインデックスに登録
+        self._on_segment(self.recording_writer, self.recording_writer.segment_info(in_progress=True))
+
+        logger.info(f"録画開始: {self.recording_path} (FPS: {recording_fps}, 録画前フレーム: {len(pre_frames)})")
+
+    def add_frame(self, frame, timestamp=None, motion_area=0):
+        """フレームを録画キューに追加（書き込みはライタースレッドで行う）"""
+        writer = self.recording_writer
+        if self.is_recording and writer and frame is not None:
+            # 呼び出し側がフレームに描画を続けるためコピーしてから渡す
+            frame_copy = frame.copy()
+            if writer.put(frame_copy, timestamp or time.time()):
+                self.frame_count += 1
+            if motion_area:
+                writer.motion_frames += 1
+                if self.snapshot_enabled and motion_area > writer.max_motion_area:
+                    # 録画用のコピーを参照するだけ（コピー・エンコードは追加しない）
+                    writer.snapshot_frame = frame_copy
+                writer.max_motion_area = max(writer.max_motion_area, int(motion_area))
+
+    def _on_segment(self, writer, segment):
+        """録画ファイルの開閉をインデックスに反映"""
+        path = RECORDINGS_DIR / segment["filename"]
+        if path.exists():
+            stat = path.stat()
+            segment = {**segment, "size": stat.st_size, "mtime": stat.st_mtime}
+        recording_index.upsert(segment)
+
+        if not segment["in_progress"] and path.exists():
+            # 録画側の値からメタデータを登録（情報取得でffprobeを起動しない）
+            recording_metadata.store_from_recorder(path, segment)
+            # 閉じたファイルのサムネイルをバックグラウンドで生成
+            thumbnail_queue.enqueue(path)
+            # 容量を確認
+            retention_manager.notify()
+
+    def buffer_frame(self, frame, timestamp=None, fps=None):
+        """録画していない間のフレームを録画前バッファに追加"""
+        if self.is_recording or frame is None:
+            return
+        if fps:
+            self.pre_event_buffer.fps = fps
+        self.pre_event_buffer.push(frame, timestamp or time.time())
 
     def stop_recording(self):
-        """録画停止"""
+        """録画停止（ファイルのクローズと通知はライタースレッドで行う）"""
         if not self.is_recording:
             return
 
         self.stop_recording_flag = True
         self.is_recording = False
 
-        if self.video_writer:
-            self.video_writer.release()
-            self.video_writer = None
+        writer = self.recording_writer
+        self.recording_writer = None
+        self.video_writer = None
+        if writer:
+            with self.stats_lock:
+                self.finishing_writers.add(writer)
+            writer.finish()
 
         duration = time.time() - self.recording_start_time if self.recording_start_time else 0
-        filename = self.recording_path.name if self.recording_path else "unknown"
-
-        # ファイルサイズを取得
-        file_size = 0
-        if self.recording_path and self.recording_path.exists():
-            file_size = self.recording_path.stat().st_size
-
         logger.info(f"録画停止: {self.recording_path} (長さ: {duration:.1f}秒)")
 
-        # LINE通知を送信
-        if line_messaging.enabled:
-            line_messaging.send_recording_complete_notification(
-                filename, file_size, duration, self.server_url)
-
         self.recording_start_time = None
         self.recording_path = None
         self.frame_count = 0
 
+    def _on_writer_finished(self, writer):
+        """録画ファイルのクローズ後の処理（ライタースレッドから呼ばれる）"""
+        stats = writer.get_stats()
+        with self.stats_lock:
+            self.finishing_writers.discard(writer)
+            self.total_queued_frames += stats["queued_frames"]
+            self.total_written_frames += stats["written_frames"]
+            self.total_dropped_frames += stats["dropped_frames"]
+            self.total_duplicated_frames += stats["duplicated_frames"]
+            self.total_timing_dropped_frames += stats["timing_dropped_frames"]
+
+        duration = writer.end_time - writer.start_time
+        filename = writer.segments[0].name
+
+        # ファイルサイズを取得（分割録画は全ファイルの合計）
+        file_size = sum(path.stat().st_size for path in writer.segments if path.exists())
+
+        # LINE通知を登録（続けて発生した録画はまとめて送信）
+        if line_messaging.enabled:
+            notification_coalescer.submit("recording", {
+                "filename": filename,
+                "file_size": file_size,
+                "duration": duration,
+                "server_url": self.server_url,
+                "snapshot": self._encode_snapshot(writer),
+                "motion_area": writer.max_motion_area
+            })
+        writer.snapshot_frame = None
+
+    def _encode_snapshot(self, writer):
+        """動きの面積が最大のフレームを縮小してJPEGにエンコード（ライタースレッドで実行）"""
+        frame = writer.snapshot_frame
+        if frame is None:
+            return None
+        try:
+            width = frame.shape[1]
+            scale = min(1.0, self.snapshot_width / width) if self.snapshot_width else 1.0
+            return encode_jpeg(frame, self.snapshot_quality, scale)
+        except Exception as e:
+            logger.error(f"スナップショットのエンコードエラー: {e}")
+            return None
+
+    def flush(self, timeout=10.0):
+        """書き込み中のライターが全て閉じるまで待機"""
+        with self.stats_lock:
+            writers = list(self.finishing_writers)
+        if self.recording_writer:
+            writers.append(self.recording_writer)
+        deadline = time.time() + timeout
+        for writer in writers:
+            writer.thread.join(timeout=max(0.0, deadline - time.time()))
+
+    def get_active_paths(self):
+        """書き込み中の録画ファイルのパスを取得"""
+        with self.stats_lock:
+            writers = list(self.finishing_writers)
+        if self.recording_writer:
+            writers.append(self.recording_writer)
+        return {writer.recording_path for writer in writers}
+
+    def get_writer_stats(self):
+        """録画書き込みキューの統計情報を取得"""
+        with self.stats_lock:
+            stats = {
+                "encoder": self.active_encoder,
+                "max_queue": self.max_queue,
+                "drop_policy": self.drop_policy,
+                "queue_depth": 0,
+                "queued_frames": self.total_queued_frames,
+                "written_frames": self.total_written_frames,
+                "dropped_frames": self.total_dropped_frames,
+                "duplicated_frames": self.total_duplicated_frames,
+                "timing_dropped_frames": self.total_timing_dropped_frames,
+                "finishing_writers": len(self.finishing_writers)
+            }
+            writers = list(self.finishing_writers)
+        if self.recording_writer:
+            writers.append(self.recording_writer)
+        for writer in writers:
+            writer_stats = writer.get_stats()
+            stats["queue_depth"] += writer_stats["queue_depth"]
+            for key in ("queued_frames", "written_frames", "dropped_frames",
+                        "duplicated_frames", "timing_dropped_frames"):
+                stats[key] += writer_stats[key]
+        return stats
+
     def get_recording_status(self):
         """録画状態を取得"""
+        writer = self.recording_writer
         return {
             "is_recording": self.is_recording,
-            "recording_path": str(self.recording_path) if self.recording_path else None,
+            "recording_path": str(writer.recording_path) if writer else None,
+            "event_id": self.event_id if self.is_recording else None,
+            "segments": len(writer.segments) if writer else 0,
             "duration": time.time() - self.recording_start_time if self.is_recording and self.recording_start_time else 0
         }
 
@@ -429,13 +1190,22 @@ class CameraManager:
 
     def __init__(self):
         self.camera = None
-        self.motion_detector = MotionDetector()
+        self.motion_detector = MotionDetector(
+            process_width=int(os.getenv("MOTION_PROCESS_WIDTH", "0")),
+            backend=os.getenv("MOTION_BACKEND", "frame_diff"))
         self.recording_manager = RecordingManager()
+        self.detection_scheduler = DetectionScheduler(
+            idle_fps=float(os.getenv("MOTION_IDLE_FPS", "5")))
         self.is_initialized = False
         self.frame_thread = None
         self.stop_thread = False
         self.current_frame = None
         self.frame_lock = threading.Lock()
+        self.frame_condition = threading.Condition(self.frame_lock)
+        self.frame_seq = 0  # 公開済みフレームの通し番号
+        self.frame_timestamp = None  # 最新フレームの取得時刻
+        self.camera_fps = 30.0
+        self.measured_fps = None  # キャプチャスレッドで実測したFPS
         self.start_time = None  # カメラ起動時間を記録
 
     def update_server_url(self, request: Request):
@@ -540,8 +1310,95 @@ class CameraManager:
             #     line_messaging.send_system_error_notification(
             #         f"カメラ初期化エラー: {str(e)}")
 
+    def start_capture(self):
+        """キャプチャスレッドを開始"""
+        if self.frame_thread and self.frame_thread.is_alive():
+            return
+
+        self.stop_thread = False
+        self.frame_thread = threading.Thread(
+            target=self._capture_worker, name="camera-capture")
+        self.frame_thread.daemon = True
+        self.frame_thread.start()
+        logger.info("キャプチャスレッドを開始しました")
+
+    def stop_capture(self):
+        """キャプチャスレッドを停止"""
+        self.stop_thread = True
+        if self.frame_thread and self.frame_thread.is_alive():
+            self.frame_thread.join(timeout=5.0)
+        self.frame_thread = None
+        with self.frame_lock:
+            self.current_frame = None
+        # 再開後の録画に古いフレームが入らないよう破棄
+        self.recording_manager.pre_event_buffer.clear()
+        logger.info("キャプチャスレッドを停止しました")
+
+    def _capture_worker(self):
+        """キャプチャワーカー（カメラのネイティブFPSで読み取り・検知・録画を行う）"""
+        self.measured_fps = None
+        last_start = None
+        while not self.stop_thread:
+            start = time.time()
+
+            # 実際の取得間隔からFPSを測定（指数移動平均）
+            if last_start is not None and start > last_start:
+                fps = 1.0 / (start - last_start)
+                self.measured_fps = fps if self.measured_fps is None else \
+                    self.measured_fps * 0.95 + fps * 0.05
+            last_start = start
+
+            frame = self.capture_frame(start)
+
+            with self.frame_lock:
+                self.current_frame = frame
+                self.frame_seq += 1
+                self.frame_timestamp = start
+                self.frame_condition.notify_all()
+
+            # カメラ読み取りはデバイス側でFPSに同期してブロックする
+            # ダミーフレームや読み取り失敗時はCPUを占有しないよう待機する
+            if self.camera is None or not self.camera.isOpened():
+                elapsed = time.time() - start
+                time.sleep(max(0.0, 1.0 / self.camera_fps - elapsed))
+
     def get_frame(self):
-        """フレームを取得"""
+        """最新フレームを取得（キャプチャスレッドが公開したものを返す）
+
+        返されるフレームは複数のリクエストで共有されるため読み取り専用として扱う
+        """
+        return self.get_latest_frame()[1]
+
+    def get_latest_frame(self):
+        """最新フレームを (通し番号, フレーム) で取得
+
+        キャプチャ開始前はダミーフレームを返し、通し番号はNoneとする
+        """
+        with self.frame_lock:
+            seq, frame = self.frame_seq, self.current_frame
+
+        if frame is None:
+            frame = np.zeros((480, 640, 3), dtype=np.uint8)
+            cv2.putText(frame, "No Camera Available", (50, 240),
+                        cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2)
+            return None, frame
+        return seq, frame
+
+    def wait_for_frame(self, last_seq: int, timeout: float = 1.0):
+        """last_seqより新しいフレームが公開されるまで待機
+
+        戻り値は (通し番号, フレーム, 取得時刻)。タイムアウト時のフレームはNone
+        """
+        with self.frame_condition:
+            self.frame_condition.wait_for(
+                lambda: self.frame_seq != last_seq and self.current_frame is not None,
+                timeout=timeout)
+            if self.frame_seq == last_seq or self.current_frame is None:
+                return last_seq, None, None
+            return self.frame_seq, self.current_frame, self.frame_timestamp
+
+    def capture_frame(self, timestamp=None):
+        """カメラからフレームを読み取り、動き検知・録画・描画を行う"""
         if self.camera is None or not self.is_initialized:
             # ダミーフレームを生成
             frame = np.zeros((480, 640, 3), dtype=np.uint8)
@@ -556,14 +1413,19 @@ class CameraManager:
             ret, frame = self.camera.read()
             if not ret or frame is None:
                 logger.error("フレームを読み取れませんでした")
+                time.sleep(0.1)  # 読み取り失敗時の連続リトライを抑制
                 # エラー時もダミーフレームを生成
                 frame = np.zeros((480, 640, 3), dtype=np.uint8)
                 cv2.putText(frame, "Camera Error", (50, 240),
                             cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 0, 0), 2)
                 return frame
 
-            # 動き検知
-            motion_detected = self.motion_detector.detect_motion(frame)
+            # 動き検知（待機中は間引き、動き検知中・録画中は全フレーム）
+            active = self.motion_detector.motion_detected or self.recording_manager.is_recording
+            if self.detection_scheduler.should_run(active):
+                motion_detected = self.motion_detector.detect_motion(frame)
+            else:
+                motion_detected = self.motion_detector.motion_detected
 
             # 録画制御（起動後2秒間は録画を無効化、動き検知初期化期間中も無効化）
             current_time = time.time()
@@ -591,17 +1453,22 @@ class CameraManager:
             else:
                 # 初期化完了後は通常の録画制御
                 if motion_detected and not self.recording_manager.is_recording:
-                    # 固定フレームレートで録画開始
-                    self.recording_manager.start_recording(
-                        frame, 120.0)  # 固定120FPS
-                    logger.info("動きを検知して録画を開始しました (固定120FPS)")
+                    # 実測したキャプチャFPSで録画開始
+                    recording_fps = self.measured_fps or self.camera_fps
+                    self.recording_manager.start_recording(frame, recording_fps)
+                    logger.info(f"動きを検知して録画を開始しました (FPS: {recording_fps:.1f})")
                 elif not motion_detected and self.recording_manager.is_recording:
                     self.recording_manager.stop_recording()
                     logger.info("動きが終了して録画を停止しました")
 
             # 録画中の場合はフレームを録画に追加（無効化期間中は追加しない）
             if self.recording_manager.is_recording and not is_recording_disabled:
-                self.recording_manager.add_frame(frame)
+                motion_area = self.motion_detector.last_motion_area if self.motion_detector.frame_motion else 0
+                self.recording_manager.add_frame(frame, timestamp, motion_area)
+            else:
+                # 録画していない間は録画前バッファに保持（描画前のフレーム）
+                self.recording_manager.buffer_frame(
+                    frame, timestamp, self.measured_fps or self.camera_fps)
 
             # 動き検知の可視化
             if motion_detected:
@@ -616,22 +1483,7 @@ class CameraManager:
                             cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
 
             # 現在の日時を表示
-            current_datetime = datetime.now()
-            date_str = current_datetime.strftime("%Y/%m/%d")
-            time_str = current_datetime.strftime("%H:%M:%S")
-
-            # 日付を表示（左上）
-            cv2.putText(frame, date_str, (10, 30),
-                        cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
-            cv2.putText(frame, date_str, (10, 30),
-                        cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 0), 1)
-
-            # 時刻を表示（右上）
-            time_x = frame.shape[1] - 150
-            cv2.putText(frame, time_str, (time_x, 30),
-                        cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
-            cv2.putText(frame, time_str, (time_x, 30),
-                        cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 0), 1)
+            draw_timestamp(frame, datetime.now())
 
             return frame
 
@@ -668,6 +1520,8 @@ class CameraManager:
         }
 
     def __del__(self):
+        if hasattr(self, 'frame_thread') and self.frame_thread:
+            self.stop_capture()
         if hasattr(self, 'camera') and self.camera:
             self.camera.release()
         if hasattr(self, 'recording_manager'):
@@ -681,9 +1535,41 @@ class OfferRequest(BaseModel):
     type: str
 
 
+class MotionRegionsRequest(BaseModel):
+    roi_regions: list[list[tuple[float, float]]] = []
+    exclusion_regions: list[list[tuple[float, float]]] = []
+
+
 # グローバル変数
 camera_manager = CameraManager()
 
+# エンコード済みJPEGのキャッシュ（全ての映像配信・スナップショットで共有）
+jpeg_cache = JpegCache(
+    encode_jpeg, max_entries=int(os.getenv("JPEG_CACHE_SIZE", "16")))
+
+# ライブ映像のJPEG品質（/video・/video-frame・ストリーム配信で共通）
+STREAM_JPEG_QUALITY = int(os.getenv("STREAM_JPEG_QUALITY", "80"))
+
+
+def encode_latest_frame(quality: int = STREAM_JPEG_QUALITY, scale: float = 1.0):
+    """最新フレームをJPEGで取得（同じフレーム・品質のエンコードは1回だけ）"""
+    seq, frame = camera_manager.get_latest_frame()
+    return jpeg_cache.get_or_encode(seq, frame, quality, scale)
+
+
+# ライブ映像配信（1フレームにつき1回だけエンコードして全視聴者に配信）
+frame_broadcaster = FrameBroadcaster(
+    camera_manager, jpeg_cache.get_or_encode, STREAM_JPEG_QUALITY)
+
+# WebSocketライブチャネル（接続ごとの送信キュー長）
+live_channel = LiveChannel(
+    frame_broadcaster,
+    camera_manager,
+    lambda: camera_manager.get_motion_status(),
+    jpeg_cache.get_or_encode,
+    frame_pool,
+    max_queue=int(os.getenv("WS_SEND_QUEUE", "2")))
+
 # IoT Coreクライアント
 iot_client = None
 
@@ -691,15 +1577,38 @@ iot_client = None
 @app.on_event("startup")
 async def startup_event():
     """アプリケーション起動時の処理"""
-    global iot_client, camera_manager
+    global iot_client, camera_manager, is_camera_active
 
-    # カメラを初期化
+    # 録画に使うffmpegのコーデックをバックグラウンドで確認
+    camera_manager.recording_manager.start_codec_selection()
+
+    # カメラを初期化（見ている人がいなくても動き検知・録画を行うためキャプチャも開始）
     logger.info("🎥 Initializing camera...")
     camera_manager.initialize_camera()
+    camera_manager.start_capture()
+    # /camera-status・/camera/stop がキャプチャ中の状態を扱えるように起動中とする
+    is_camera_active = True
+
+    # 録画インデックスをディレクトリと突き合わせる（差分のみ反映）
+    media_pool.submit(initialize_recording_index)
+
+    # LINE通知の送信ワーカーを開始（前回送信できなかった通知も再送）
+    line_messaging.start()
+    notification_coalescer.start()
 
     # IoT Coreクライアントを初期化（一時的に無効化）
     try:
         iot_client = get_iot_client()
+        # IoTコマンドはHTTPを経由せずこのプロセスのエンドポイントを直接呼び出す
+        iot_client.set_local_dispatch(asyncio.get_running_loop(), {
+            "start": start_camera,
+            "stop": stop_camera,
+            "status": get_camera_status,
+            "motion_status": get_motion_status,
+            "get_motion_settings": get_motion_settings,
+            "update_motion_settings": update_motion_settings,
+            "list_recordings": get_recordings
+        })
         if iot_client.connect():
             logger.info("✅ Connected to AWS IoT Core")
             iot_client.start_heartbeat()
@@ -734,6 +1643,18 @@ async def shutdown_event():
     """アプリケーション終了時の処理"""
     global iot_client
 
+    frame_broadcaster.stop()
+    camera_manager.stop_capture()
+    # 録画中のファイルを閉じる
+    camera_manager.recording_manager.stop_recording()
+    camera_manager.recording_manager.flush()
+    transcoder.stop()
+    retention_manager.stop()
+    shutdown_pools()
+    # まとめ待ちの通知を送信待ちに登録してから送信ワーカーを停止
+    notification_coalescer.stop()
+    line_messaging.stop()
+
     # システム停止通知は無効化（録画完了通知のみ）
     # if line_messaging.enabled:
     #     try:
@@ -851,16 +1772,16 @@ async def index():
 async def get_video():
     """カメラ映像を取得"""
     try:
-        frame = camera_manager.get_frame()
-        # JPEGにエンコード
-        _, buffer = cv2.imencode('.jpg', frame)
-        jpeg_data = buffer.tobytes()
+        # JPEGにエンコード（イベントループ外で実行、エンコード済みなら再利用）
+        jpeg_data = await frame_pool.run(encode_latest_frame)
 
         return StreamingResponse(
             iter([jpeg_data]),
             media_type="image/jpeg",
             headers={"Cache-Control": "no-cache"}
         )
+    except WorkerPoolFull:
+        raise HTTPException(status_code=503, detail="サーバーが混雑しています")
     except Exception as e:
         logger.error(f"映像取得エラー: {e}")
         return {"error": "Failed to get video"}
@@ -875,20 +1796,69 @@ async def get_video_frame():
         return {"error": "カメラが起動していません"}
 
     try:
-        frame = camera_manager.get_frame()
-        if frame is None:
-            return {"error": "フレームを取得できませんでした"}
-
-        # フレームをJPEGにエンコード
-        _, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 85])
-        jpeg_data = base64.b64encode(buffer).decode('utf-8')
+        # フレームをJPEGにエンコード（イベントループ外で実行、エンコード済みなら再利用）
+        jpeg_data = await frame_pool.run(encode_latest_frame)
+        image = base64.b64encode(jpeg_data).decode('utf-8')
 
-        return {"image": f"data:image/jpeg;base64,{jpeg_data}"}
+        return {"image": f"data:image/jpeg;base64,{image}"}
+    except WorkerPoolFull:
+        raise HTTPException(status_code=503, detail="サーバーが混雑しています")
     except Exception as e:
         logger.error(f"フレーム取得エラー: {e}")
         return {"error": "フレーム取得に失敗しました"}
 
 
+@app.get("/video-stream")
+async def get_video_stream():
+    """MJPEGストリームでカメラ映像を配信（multipart/x-mixed-replace）"""
+    global camera_manager, is_camera_active
+
+    if not is_camera_active or camera_manager is None:
+        return {"error": "カメラが起動していません"}
+
+    subscriber = frame_broadcaster.subscribe()
+
+    async def stream():
+        try:
+            while is_camera_active:
+                result = await frame_broadcaster.next_frame(subscriber)
+                if result is None:
+                    continue
+                _, jpeg_data = result
+                yield (b"--frame\r\n"
+                       b"Content-Type: image/jpeg\r\n"
+                       b"Content-Length: " + str(len(jpeg_data)).encode() + b"\r\n\r\n" +
+                       jpeg_data + b"\r\n")
+        finally:
+            frame_broadcaster.unsubscribe(subscriber)
+
+    return StreamingResponse(
+        stream(),
+        media_type="multipart/x-mixed-replace; boundary=frame",
+        headers={"Cache-Control": "no-cache"}
+    )
+
+
+@app.get("/video-stream/stats")
+async def get_video_stream_stats():
+    """ライブ映像配信の統計情報を取得"""
+    return {
+        **frame_broadcaster.get_stats(),
+        "websocket_clients": live_channel.get_stats(),
+        "jpeg_cache": jpeg_cache.get_stats()
+    }
+
+
+@app.websocket("/ws/live")
+async def websocket_live(websocket: WebSocket):
+    """ライブ映像（バイナリJPEG）と状態差分（JSON）をWebSocketで配信"""
+    if not is_camera_active or camera_manager is None:
+        await websocket.close(code=1008)
+        return
+
+    await live_channel.serve(websocket)
+
+
 @app.get("/motion-status")
 async def get_motion_status():
     """動き検知状態を取得"""
@@ -913,7 +1883,13 @@ async def get_motion_settings():
         return {
             "threshold": detector.threshold,
             "min_area": detector.min_area,
-            "motion_cooldown": detector.motion_cooldown
+            "motion_cooldown": detector.motion_cooldown,
+            "process_width": detector.process_width,
+            "backend": detector.backend,
+            "background_alpha": detector.background_alpha,
+            "idle_detection_fps": camera_manager.detection_scheduler.idle_fps,
+            "roi_regions": detector.roi_regions,
+            "exclusion_regions": detector.exclusion_regions
         }
     except Exception as e:
         logger.error(f"動き検知設定取得エラー: {e}")
@@ -921,11 +1897,17 @@ async def get_motion_settings():
 
 
 @app.post("/motion-settings")
-async def update_motion_settings(threshold: int = None, min_area: int = None, motion_cooldown: float = None):
+async def update_motion_settings(threshold: int = None, min_area: int = None, motion_cooldown: float = None,
+                                 process_width: int = None, backend: str = None, background_alpha: float = None,
+                                 idle_detection_fps: float = None):
     """動き検知設定を更新"""
     try:
         detector = camera_manager.motion_detector
 
+        if backend is not None and backend not in MOTION_BACKENDS:
+            raise HTTPException(
+                status_code=400, detail=f"backendは {', '.join(MOTION_BACKENDS)} のいずれかを指定してください")
+
         if threshold is not None:
             detector.threshold = max(10, min(100, threshold))  # 10-100の範囲に制限
         if min_area is not None:
@@ -934,26 +1916,118 @@ async def update_motion_settings(threshold: int = None, min_area: int = None, mo
         if motion_cooldown is not None:
             detector.motion_cooldown = max(
                 1.0, min(10.0, motion_cooldown))  # 1-10秒の範囲に制限
+        if process_width is not None:
+            # 0はフル解像度、それ以外は80-1920の範囲に制限
+            detector.set_process_width(
+                0 if process_width <= 0 else max(80, min(1920, process_width)))
+        if backend is not None:
+            detector.set_backend(backend)
+        if background_alpha is not None:
+            detector.background_alpha = max(
+                0.001, min(0.5, background_alpha))  # 0.001-0.5の範囲に制限
+        if idle_detection_fps is not None:
+            # 0は間引きなし、それ以外は1-30FPSの範囲に制限
+            camera_manager.detection_scheduler.idle_fps = (
+                0.0 if idle_detection_fps <= 0 else max(1.0, min(30.0, idle_detection_fps)))
 
         logger.info(
-            f"動き検知設定を更新: threshold={detector.threshold}, min_area={detector.min_area}, cooldown={detector.motion_cooldown}")
+            f"動き検知設定を更新: threshold={detector.threshold}, min_area={detector.min_area}, cooldown={detector.motion_cooldown}, process_width={detector.process_width}, backend={detector.backend}")
 
         return {
             "threshold": detector.threshold,
             "min_area": detector.min_area,
-            "motion_cooldown": detector.motion_cooldown
+            "motion_cooldown": detector.motion_cooldown,
+            "process_width": detector.process_width,
+            "backend": detector.backend,
+            "background_alpha": detector.background_alpha,
+            "idle_detection_fps": camera_manager.detection_scheduler.idle_fps
         }
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"動き検知設定更新エラー: {e}")
         return {"error": "Failed to update motion settings"}
 
 
+def recording_info_response(file_path: Path, stat, info, source):
+    """録画ファイル情報のレスポンスを作成"""
+    return {
+        "filename": file_path.name,
+        "info": info,
+        "source": source,
+        "size": stat.st_size,
+        "created": datetime.fromtimestamp(stat.st_ctime).isoformat(),
+        "modified": datetime.fromtimestamp(stat.st_mtime).isoformat()
+    }
+
+
+def probe_recording_info(file_path: Path):
+    """ffprobeで録画ファイルの詳細情報を取得してキャッシュに保存"""
+    info, source = recording_metadata.probe(file_path)
+    return recording_info_response(file_path, file_path.stat(), info, source)
+
+
+@app.get("/recording-metadata/export")
+async def export_recording_metadata():
+    """保存済みの全録画のメタデータをJSON Lines形式で出力"""
+    def generate():
+        for entry in recording_metadata.export():
+            yield json.dumps(entry, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(
+        generate(), media_type="application/x-ndjson",
+        headers={"Content-Disposition": "attachment; filename=recording_metadata.jsonl"})
+
+
+@app.get("/recording-metadata/stats")
+async def get_recording_metadata_stats():
+    """メタデータキャッシュの統計情報を取得"""
+    return recording_metadata.get_stats()
+
+
+@app.get("/recording/stats")
+async def get_recording_stats():
+    """録画書き込みキューの統計情報を取得"""
+    return camera_manager.recording_manager.get_writer_stats()
+
+
+@app.get("/motion-detection/stats")
+async def get_motion_detection_stats():
+    """動き検知の実行レート・スキップ数を取得"""
+    return camera_manager.detection_scheduler.get_stats()
+
+
+@app.post("/motion-settings/regions")
+async def update_motion_regions(regions: MotionRegionsRequest):
+    """動き検知の対象領域・除外領域を更新（座標は0-1に正規化）"""
+    try:
+        for region in regions.roi_regions + regions.exclusion_regions:
+            if len(region) < 3 or any(not (0.0 <= v <= 1.0) for point in region for v in point):
+                raise HTTPException(
+                    status_code=400, detail="領域は0-1の座標3点以上で指定してください")
+
+        detector = camera_manager.motion_detector
+        detector.set_regions(regions.roi_regions, regions.exclusion_regions)
+        logger.info(
+            f"動き検知領域を更新: 対象={len(regions.roi_regions)}件, 除外={len(regions.exclusion_regions)}件")
+
+        return {
+            "roi_regions": detector.roi_regions,
+            "exclusion_regions": detector.exclusion_regions
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"動き検知領域更新エラー: {e}")
+        return {"error": "Failed to update motion regions"}
+
+
 @app.get("/recordings/{filename}/info")
 async def get_recording_info(filename: str):
     """録画ファイルの詳細情報を取得"""
     try:
-        # ファイル名の安全性をチェック
-        if ".." in filename or "/" in filename:
+        # ファイル名の安全性をチェック（インデックスなど録画以外のファイルは返さない）
+        if not is_recording_name(filename):
             return {"error": "Invalid filename"}
 
         file_path = RECORDINGS_DIR / filename
@@ -961,36 +2035,18 @@ async def get_recording_info(filename: str):
             logger.error(f"ファイルが見つかりません: {file_path}")
             return {"error": "File not found"}
 
-        logger.info(f"録画ファイル情報取得: {filename}")
+        # キャッシュ済みならffprobeを起動せずに返す
+        stat = file_path.stat()
+        info, source = recording_metadata.lookup(file_path, stat)
+        if info is not None:
+            return recording_info_response(file_path, stat, info, source)
 
-        # ffprobeを使用して動画情報を取得
-        import subprocess
-        result = subprocess.run([
-            "ffprobe", "-v", "quiet", "-print_format", "json",
-            "-show_format", "-show_streams", str(file_path)
-        ], capture_output=True, text=True)
+        logger.info(f"録画ファイル情報取得: {filename}")
 
-        if result.returncode == 0:
-            import json
-            info = json.loads(result.stdout)
-            logger.info(f"録画ファイル情報取得成功: {filename}")
-            return {
-                "filename": filename,
-                "info": info,
-                "size": file_path.stat().st_size,
-                "created": datetime.fromtimestamp(file_path.stat().st_ctime).isoformat(),
-                "modified": datetime.fromtimestamp(file_path.stat().st_mtime).isoformat()
-            }
-        else:
-            logger.error(f"ffprobe実行エラー: {result.stderr}")
-            # 基本的な情報のみ返す
-            return {
-                "filename": filename,
-                "info": None,
-                "size": file_path.stat().st_size,
-                "created": datetime.fromtimestamp(file_path.stat().st_ctime).isoformat(),
-                "modified": datetime.fromtimestamp(file_path.stat().st_mtime).isoformat()
-            }
+        # ffprobeはイベントループ外で実行
+        return await media_pool.run(probe_recording_info, file_path)
+    except WorkerPoolFull:
+        raise HTTPException(status_code=503, detail="サーバーが混雑しています")
     except Exception as e:
         logger.error(f"録画ファイル情報取得エラー: {e}")
         # エラー時も基本的な情報を返す
@@ -1013,8 +2069,8 @@ async def get_recording_info(filename: str):
 async def get_recording_file(filename: str, request: Request, download: bool = False):
     """録画ファイルを取得"""
     try:
-        # ファイル名の安全性をチェック
-        if ".." in filename or "/" in filename:
+        # ファイル名の安全性をチェック（インデックスなど録画以外のファイルは返さない）
+        if not is_recording_name(filename):
             return {"error": "Invalid filename"}
 
         file_path = RECORDINGS_DIR / filename
@@ -1031,85 +2087,33 @@ async def get_recording_file(filename: str, request: Request, download: bool = F
         # ダウンロードモードの場合はattachmentヘッダーを設定
         content_disposition = f"attachment; filename={filename}" if download else f"inline; filename={filename}"
 
-        # Rangeリクエストの処理
-        range_header = request.headers.get("range")
-        if range_header:
-            try:
-                # Rangeヘッダーを解析 (例: "bytes=0-1023")
-                range_str = range_header.replace("bytes=", "")
-                start, end = range_str.split("-")
-                start = int(start)
-                end = int(end) if end else file_size - 1
-
-                # 範囲の検証
-                if start >= file_size or end >= file_size or start > end:
-                    return {"error": "Invalid range"}, 416
-
-                content_length = end - start + 1
-
-                def iterfile():
-                    try:
-                        with open(file_path, "rb") as file:
-                            file.seek(start)
-                            remaining = content_length
-                            while remaining > 0:
-                                chunk_size = min(8192, remaining)
-                                chunk = file.read(chunk_size)
-                                if not chunk:
-                                    break
-                                yield chunk
-                                remaining -= len(chunk)
-                    except Exception as e:
-                        logger.error(f"ファイル読み込みエラー: {e}")
-                        raise
-
-                return StreamingResponse(
-                    iterfile(),
-                    media_type="video/mp4",
-                    headers={
-                        "Content-Type": "video/mp4",
-                        "Content-Disposition": content_disposition,
-                        "Accept-Ranges": "bytes",
-                        "Content-Length": str(content_length),
-                        "Content-Range": f"bytes {start}-{end}/{file_size}",
-                        "Cache-Control": "no-cache",
-                        "Access-Control-Allow-Origin": "*",
-                        "Access-Control-Allow-Methods": "GET, OPTIONS",
-                        "Access-Control-Allow-Headers": "Range, Content-Range, Accept-Ranges",
-                        "Access-Control-Expose-Headers": "Content-Range, Accept-Ranges",
-                        "X-Content-Type-Options": "nosniff"
-                    },
-                    status_code=206
-                )
-            except Exception as e:
-                logger.error(f"Rangeリクエスト処理エラー: {e}")
-                # Rangeリクエストの処理に失敗した場合は通常の配信にフォールバック
-
-        # 通常の配信（Rangeリクエストなし）
-        def iterfile():
-            try:
-                with open(file_path, "rb") as file:
-                    yield from file
-            except Exception as e:
-                logger.error(f"ファイル読み込みエラー: {e}")
-                raise
+        etag, last_modified = file_validators(stat)
+        headers = {
+            "Content-Disposition": content_disposition,
+            "ETag": etag,
+            "Last-Modified": last_modified,
+            "Access-Control-Allow-Origin": "*",
+            "Access-Control-Allow-Methods": "GET, OPTIONS",
+            "Access-Control-Allow-Headers": "Range, Content-Range, Accept-Ranges, If-Range, If-None-Match, If-Modified-Since",
+            "Access-Control-Expose-Headers": "Content-Range, Accept-Ranges, ETag, Last-Modified",
+            "X-Content-Type-Options": "nosniff"
+        }
 
-        return StreamingResponse(
-            iterfile(),
-            media_type="video/mp4",
-            headers={
-                "Content-Type": "video/mp4",
-                "Content-Disposition": content_disposition,
-                "Accept-Ranges": "bytes",
-                "Content-Length": str(file_size),
-                "Cache-Control": "public, max-age=3600",
-                "Access-Control-Allow-Origin": "*",
-                "Access-Control-Allow-Methods": "GET, OPTIONS",
-                "Access-Control-Allow-Headers": "Range, Content-Range, Accept-Ranges",
-                "Access-Control-Expose-Headers": "Content-Range, Accept-Ranges",
-                "X-Content-Type-Options": "nosniff"
-            }
-        )
+        # 変更がなければ本文を返さない
+        if is_not_modified(request.headers, etag, stat.st_mtime):
+            return not_modified_response({**headers, "Cache-Control": "public, max-age=3600"})
+
+        # Rangeリクエストの処理（複数範囲・末尾からの指定にも対応）
+        # If-Range が一致しない（ファイルが変わった）場合は全体を返す
+        ranges = None
+        if if_range_matches(request.headers, etag, stat.st_mtime):
+            ranges = parse_range_header(request.headers.get("range"), file_size)
+        if ranges == []:
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{file_size}"})
+
+        # Rangeリクエストの場合は再生位置の移動が多いためキャッシュしない
+        headers["Cache-Control"] = "no-cache" if ranges else "public, max-age=3600"
+        return RangeFileResponse(file_path, file_size, ranges, headers=headers, media_type="video/mp4")
     except Exception as e:
         logger.error(f"録画ファイル取得エラー: {e}")
         return {"error": "Failed to get recording file"}
@@ -1131,6 +2135,10 @@ async def options_recording_file(filename: str):
 async def delete_recording(filename: str):
     """録画ファイルを削除"""
     try:
+        # ファイル名の安全性をチェック（インデックスなど録画以外のファイルは削除しない）
+        if not is_recording_name(filename):
+            return {"error": "Invalid filename"}
+
         file_path = RECORDINGS_DIR / filename
         if not file_path.exists():
             return {"error": "File not found"}
@@ -1141,12 +2149,15 @@ async def delete_recording(filename: str):
 
         # 録画ファイルを削除
         file_path.unlink()
+        recording_index.remove(filename)
+        thumbnail_queue.discard(filename)
         logger.info(f"録画ファイル削除: {filename}")
 
         # 対応するサムネイルファイルも削除
         if thumbnail_path.exists():
             thumbnail_path.unlink()
             logger.info(f"サムネイルファイル削除: {thumbnail_name}")
+        thumbnail_cache.discard(thumbnail_path)
 
         return {"message": "File and thumbnail deleted successfully"}
     except Exception as e:
@@ -1154,43 +2165,227 @@ async def delete_recording(filename: str):
         return {"error": "Failed to delete recording file"}
 
 
-@app.get("/recordings")
-async def get_recordings():
-    """録画ファイル一覧を取得"""
+def parse_recording_name(filename: str):
+    """録画ファイル名からイベントIDと分割番号を取得（分割でなければ番号はNone）"""
+    match = RECORDING_NAME_PATTERN.match(filename)
+    if not match:
+        return Path(filename).stem, None
+    segment = match.group(2)
+    return match.group(1), int(segment) if segment else None
+
+
+def format_recording(row):
+    """インデックスの行をAPIの形式に変換"""
+    return {
+        "filename": row["filename"],
+        "size": row["size"],
+        "created": datetime.fromtimestamp(row["start_time"]).isoformat() if row["start_time"] else None,
+        "modified": datetime.fromtimestamp(row["mtime"]).isoformat() if row["mtime"] else None,
+        "thumbnail": row["thumbnail"],
+        "event_id": row["event_id"] or parse_recording_name(row["filename"])[0],
+        "segment": row["segment"],
+        "in_progress": bool(row["in_progress"]),
+        "duration": row["duration"],
+        "codec": row["codec"],
+        "width": row["width"],
+        "height": row["height"],
+        "motion_frames": row["motion_frames"],
+        "max_motion_area": row["max_motion_area"]
+    }
+
+
+def thumbnail_status(row):
+    """サムネイルの状態（ready / pending / failed）を取得（デコードはしない）"""
+    if row["thumbnail"]:
+        return "ready"
+    if row["in_progress"]:
+        # 書き込み中のファイルは閉じたときに登録される
+        return "pending"
+    status = thumbnail_queue.status(row["filename"])
+    if status is None:
+        # 起動時の走査で漏れたものは待ち行列に登録する
+        thumbnail_queue.enqueue(RECORDINGS_DIR / row["filename"])
+        status = thumbnail_queue.status(row["filename"]) or "pending"
+    return status
+
+
+def encode_recordings_cursor(row, sort, order):
+    """次のページの位置（最後の行の並び替えの値とファイル名）を文字列にする"""
+    value = RecordingIndex.sort_value(row, sort)
+    data = json.dumps([sort, order, value, row["filename"]]).encode()
+    return base64.urlsafe_b64encode(data).decode("ascii")
+
+
+def decode_recordings_cursor(cursor, sort, order):
+    """ページの位置を (並び替えの値, ファイル名) に戻す"""
     try:
-        recordings = []
-        for file in RECORDINGS_DIR.glob("*.mp4"):
-            stat = file.stat()
-
-            # サムネイルファイル名を生成
-            thumbnail_name = f"{file.stem}_thumb.jpg"
-            thumbnail_path = THUMBNAILS_DIR / thumbnail_name
-
-            # サムネイルが存在しない場合は生成
-            if not thumbnail_path.exists():
-                if generate_thumbnail(file, thumbnail_path):
-                    logger.info(f"サムネイル生成: {thumbnail_name}")
-                else:
-                    logger.warning(f"サムネイル生成失敗: {file.name}")
-
-            recordings.append({
-                "filename": file.name,
-                "size": stat.st_size,
-                "created": datetime.fromtimestamp(stat.st_ctime).isoformat(),
-                "modified": datetime.fromtimestamp(stat.st_mtime).isoformat(),
-                "thumbnail": thumbnail_name if thumbnail_path.exists() else None
-            })
+        cursor_sort, cursor_order, value, filename = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="cursorの形式が正しくありません")
+    if (cursor_sort, cursor_order) != (sort, order):
+        raise HTTPException(status_code=400, detail="cursorと並び替えの指定が一致しません")
+    return value, filename
+
+
+def list_recordings(sort="start_time", order="desc", limit=100, offset=0, since=None, until=None, after=None):
+    """録画一覧をインデックスから1ページ分作成（サムネイルは待ち行列で生成）"""
+    rows, total = recording_index.query(sort, order, limit, offset, since, until, after=after)
+    recordings = []
+    for row in rows:
+        recording = format_recording(row)
+        recording["thumbnail_status"] = thumbnail_status(row)
+        recordings.append(recording)
+    next_cursor = encode_recordings_cursor(rows[-1], sort, order) if len(rows) == limit else None
+    return recordings, total, next_cursor
+
+
+def initialize_recording_index():
+    """録画インデックスをディレクトリと突き合わせ、サムネイルのない録画を待ち行列に登録"""
+    recording_index.reconcile(
+        RECORDINGS_DIR, is_recording_file,
+        camera_manager.recording_manager.get_active_paths())
+    missing = recording_index.missing_thumbnails()
+    for filename in missing:
+        thumbnail_queue.enqueue(RECORDINGS_DIR / filename)
+    if missing:
+        logger.info(f"サムネイル生成を登録しました: {len(missing)}件")
+    # インデックスが揃ってから古い録画の削除を開始
+    retention_manager.start()
+
+
+def on_recording_evicted(filename, thumbnail_path):
+    """保存ポリシーで削除された録画の状態を破棄"""
+    thumbnail_queue.discard(filename)
+    thumbnail_cache.discard(thumbnail_path)
+
+
+# 録画ファイルの保存管理（合計サイズ・保存日数・最低空き容量、どれも0なら削除しない）
+retention_manager = RetentionManager(
+    recording_index, RECORDINGS_DIR, THUMBNAILS_DIR,
+    max_bytes=int(float(os.getenv("RETENTION_MAX_GB", "0")) * 1024 ** 3),
+    max_age_seconds=float(os.getenv("RETENTION_MAX_DAYS", "0")) * 86400,
+    min_free_bytes=int(float(os.getenv("RETENTION_MIN_FREE_MB", "0")) * 1024 * 1024),
+    interval=float(os.getenv("RETENTION_INTERVAL", "60")),
+    active_paths=lambda: camera_manager.recording_manager.get_active_paths(),
+    on_evicted=on_recording_evicted)
+
+
+def parse_time_param(value):
+    """時刻パラメータ（UNIX時刻またはISO 8601）を解析"""
+    if value is None or value == "":
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"時刻の形式が正しくありません: {value}")
+
+
+# 録画ファイルの一括変換（低優先度のバックグラウンド処理）
+transcoder = BatchTranscoder(
+    RECORDINGS_DIR,
+    manifest_path=DATA_DIR / MANIFEST_NAME,
+    workers=int(os.getenv("TRANSCODE_WORKERS", "1")),
+    low_priority=True,
+    threads_per_worker=int(os.getenv("TRANSCODE_THREADS", "1")),
+    exclude=lambda: camera_manager.recording_manager.get_active_paths(),
+    on_converted=lambda path: recording_index.refresh_file(path, codec="h264"))
+
+
+@app.get("/recording-transcode")
+async def get_transcode_status():
+    """録画ファイル一括変換の進捗を取得"""
+    return transcoder.get_stats()
+
+
+@app.post("/recording-transcode")
+async def start_transcode():
+    """録画ファイルの一括変換を開始（H.264のファイルはスキップ、前回の続きから再開）"""
+    if not transcoder.start_background():
+        return {"error": "Transcode already running", "stats": transcoder.get_stats()}
+    logger.info("録画ファイルの一括変換を開始しました")
+    return {"message": "Transcode started"}
+
+
+@app.post("/recording-transcode/stop")
+async def stop_transcode():
+    """録画ファイルの一括変換を停止（変換中のファイルは完了後に停止）"""
+    transcoder.stop()
+    return {"message": "Transcode stopping", "stats": transcoder.get_stats()}
+
+
+@app.get("/recording-events/{event_id}")
+async def get_recording_event(event_id: str):
+    """イベントの分割ファイル一覧を取得（録画中のイベントは閉じたファイルから再生できる）"""
+    if not RECORDING_NAME_PATTERN.match(f"{event_id}.mp4"):
+        return {"error": "Invalid event id"}
+
+    rows, _ = recording_index.query("filename", "asc", 10000, 0, event_id=event_id)
+    segments = [
+        {
+            "filename": row["filename"],
+            "segment": row["segment"],
+            "size": row["size"],
+            "duration": row["duration"],
+            "in_progress": bool(row["in_progress"])
+        }
+        for row in rows
+    ]
+
+    if not segments:
+        return {"error": "Event not found"}
+
+    recording_status = camera_manager.recording_manager.get_recording_status()
+    return {
+        "event_id": event_id,
+        "recording": recording_status["event_id"] == event_id,
+        "segments": segments
+    }
+
+
+@app.get("/recordings")
+async def get_recordings(sort: str = "start_time", order: str = "desc", limit: int = 100,
+                         offset: int = 0, since: str = None, until: str = None, cursor: str = None):
+    """録画ファイル一覧を取得（並び替え・ページング・期間指定）
 
-        # 作成日時でソート（新しい順）
-        recordings.sort(key=lambda x: x["created"], reverse=True)
-        return {"recordings": recordings}
+    続きのページは前のレスポンスの next_cursor を cursor に指定して取得する（offsetより速い）
+    """
+    if sort not in SORT_COLUMNS:
+        raise HTTPException(
+            status_code=400, detail=f"sortは {', '.join(SORT_COLUMNS)} のいずれかを指定してください")
+    if order not in ("asc", "desc"):
+        raise HTTPException(status_code=400, detail="orderは asc または desc を指定してください")
+    limit = max(1, min(limit, 1000))
+    offset = max(0, offset)
+    since_time = parse_time_param(since)
+    until_time = parse_time_param(until)
+    after = decode_recordings_cursor(cursor, sort, order) if cursor else None
+    if after is not None:
+        offset = 0
+
+    try:
+        recordings, total, next_cursor = await media_pool.run(
+            list_recordings, sort, order, limit, offset, since_time, until_time, after)
+        return {
+            "recordings": recordings,
+            "total": total,
+            "offset": offset,
+            "limit": limit,
+            "has_more": next_cursor is not None and (after is not None or offset + len(recordings) < total),
+            "next_cursor": next_cursor
+        }
+    except WorkerPoolFull:
+        raise HTTPException(status_code=503, detail="サーバーが混雑しています")
     except Exception as e:
         logger.error(f"録画一覧取得エラー: {e}")
         return {"error": "Failed to get recordings"}
 
 
 @app.get("/thumbnails/{thumbnail_name}")
-async def get_thumbnail(thumbnail_name: str):
+async def get_thumbnail(thumbnail_name: str, request: Request):
     """サムネイル画像を取得"""
     try:
         # ファイル名の安全性をチェック
@@ -1198,26 +2393,53 @@ async def get_thumbnail(thumbnail_name: str):
             return {"error": "Invalid filename"}
 
         thumbnail_path = THUMBNAILS_DIR / thumbnail_name
-        if not thumbnail_path.exists():
+        try:
+            stat = thumbnail_path.stat()
+        except FileNotFoundError:
+            thumbnail_cache.discard(thumbnail_path)
             return {"error": "Thumbnail not found"}
 
-        # 画像ファイルを読み込んで返す
-        with open(thumbnail_path, "rb") as f:
-            image_data = f.read()
+        etag, last_modified = file_validators(stat)
+        headers = {
+            "ETag": etag,
+            "Last-Modified": last_modified,
+            "Cache-Control": "public, max-age=3600",
+            "Access-Control-Allow-Origin": "*",
+            "Access-Control-Expose-Headers": "ETag, Last-Modified"
+        }
+
+        # 変更がなければ本文を返さない
+        if is_not_modified(request.headers, etag, stat.st_mtime):
+            return not_modified_response(headers)
+
+        # 画像はメモリキャッシュから返す（ないか変更されていれば読み込む）
+        image_data = thumbnail_cache.get(thumbnail_path, etag)
 
         return Response(
             content=image_data,
             media_type="image/jpeg",
-            headers={
-                "Cache-Control": "public, max-age=3600",
-                "Access-Control-Allow-Origin": "*"
-            }
+            headers=headers
         )
     except Exception as e:
         logger.error(f"サムネイル取得エラー: {e}")
         return {"error": "Failed to get thumbnail"}
 
 
+@app.get("/snapshots/{snapshot_name}")
+async def get_snapshot(snapshot_name: str):
+    """LINE通知に添付した画像を取得（LINEのサーバーが取得する）"""
+    if not SNAPSHOT_NAME_PATTERN.match(snapshot_name):
+        raise HTTPException(status_code=404, detail="画像が見つかりません")
+    try:
+        image_data = (SNAPSHOTS_DIR / snapshot_name).read_bytes()
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="画像が見つかりません")
+    return Response(
+        content=image_data,
+        media_type="image/jpeg",
+        headers={"Cache-Control": "public, max-age=86400"})
+
+
 @app.get("/camera-status")
 async def get_camera_status():
     """カメラの起動状態を取得"""
@@ -1257,6 +2479,8 @@ async def start_camera():
             logger.error("カメラの初期化に失敗しました")
             return {"error": "カメラの初期化に失敗しました", "status": "initialization_failed"}
 
+        camera_manager.start_capture()
+
         is_camera_active = True
         logger.info("カメラを起動しました")
         return {"message": "カメラを起動しました", "status": "started"}
@@ -1281,6 +2505,8 @@ async def stop_camera():
         is_camera_active = False
 
         if camera_manager:
+            # キャプチャスレッドを停止（カメラ解放前に読み取りを止める）
+            camera_manager.stop_capture()
             # 録画を停止
             camera_manager.recording_manager.stop_recording()
             # カメラをリリース
@@ -1311,6 +2537,7 @@ async def health_check():
             "camera_working": camera_working,
             "iot_connected": iot_connected,
             "line_messaging_enabled": line_messaging.enabled,
+            "pre_event_buffer": camera_manager.recording_manager.pre_event_buffer.get_stats(),
             "timestamp": datetime.now().isoformat()
         }
     except Exception as e:
@@ -1321,12 +2548,51 @@ async def health_check():
         }
 
 
+@app.get("/retention")
+async def get_retention():
+    """録画の使用量・保存ポリシーによる削除の統計情報を取得"""
+    return retention_manager.get_stats()
+
+
+@app.post("/retention/run")
+async def run_retention():
+    """保存ポリシーの確認を前倒しで実行"""
+    if not retention_manager.thread or not retention_manager.thread.is_alive():
+        raise HTTPException(status_code=503, detail="録画の保存管理が開始されていません")
+    retention_manager.notify()
+    return {"message": "Retention check scheduled"}
+
+
+@app.get("/thumbnail-queue")
+async def get_thumbnail_queue():
+    """サムネイル生成の待ち行列の統計情報（待ち件数・生成までの時間・配信キャッシュ）を取得"""
+    stats = thumbnail_queue.get_stats()
+    stats["cache"] = thumbnail_cache.get_stats()
+    return stats
+
+
+@app.get("/iot-commands")
+async def get_iot_commands():
+    """IoTコマンドの処理時間・重複・待ち行列の統計情報を取得"""
+    if iot_client is None:
+        return {"error": "IoT Coreに接続していません"}
+    return iot_client.get_command_stats()
+
+
+@app.get("/worker-pools")
+async def get_worker_pools():
+    """ワーカープールの統計情報を取得"""
+    return get_pool_stats()
+
+
 @app.get("/line-messaging/status")
 async def get_line_messaging_status():
     """LINE Messaging APIの状態を取得"""
     return {
         "enabled": line_messaging.enabled,
-        "configured": line_messaging.channel_access_token is not None
+        "configured": line_messaging.channel_access_token is not None,
+        "dispatcher": line_messaging.get_stats(),
+        "coalescer": notification_coalescer.get_stats()
     }
 
 
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+LINE通知のまとめ送信とレート制限
+
+しばらく通知がなかった後の最初の通知はすぐに送り、送信から一定時間（ウィンドウ）内に
+続いた録画完了などの通知はウィンドウの終わりに1通のまとめ通知にする。
+通知の種類ごとにトークンバケットで送信数を制限し、送れない間の通知は次のまとめに含める
+"""
+
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """トークンバケット（capacity 通まで連続して送れ、refill_per_hour 通/時で回復）"""
+
+    def __init__(self, capacity: float, refill_per_hour: float):
+        self.capacity = capacity
+        self.refill_per_second = refill_per_hour / 3600.0
+        self.tokens = capacity
+        self.updated_at = time.time()
+
+    def _refill(self, now: float):
+        """経過時間分のトークンを補充"""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.refill_per_second)
+        self.updated_at = now
+
+    def try_take(self, now: float = None):
+        """トークンを1つ使う（なければFalse）"""
+        now = now or time.time()
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def seconds_until_token(self, now: float = None):
+        """次のトークンが使えるまでの秒数"""
+        now = now or time.time()
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        if self.refill_per_second <= 0:
+            return float("inf")
+        return (1 - self.tokens) / self.refill_per_second
+
+
+class NotificationCoalescer:
+    """通知をウィンドウごとにまとめて送信する
+
+    senders: 種類 -> 通知を送る関数（イベントのリストと省いた件数を受け取り、送信待ちに登録できたかを返す）
+    """
+
+    def __init__(self, senders: dict, window: float = 60.0, buckets: dict = None, max_events: int = 500):
+        self.senders = senders
+        self.window = window
+        self.buckets = buckets or {}  # 種類 -> TokenBucket（ない種類は制限しない）
+        self.max_events = max_events  # 1つのまとめに保持する最大件数
+        self.pending = {}  # 種類 -> {"events": [...], "flush_at": 時刻, "dropped": 件数}
+        self.last_sent_at = {}  # 種類 -> 最後に送信した時刻
+        self.condition = threading.Condition()
+        self.thread = None
+        self.stopping = False
+
+        # 統計情報
+        self.received = {}
+        self.sent_messages = {}
+        self.merged = {}  # 他の通知と1通にまとめた件数
+        self.suppressed = {}  # レート制限で送信を見送った回数
+        self.dropped = {}  # 保持の上限を超えて捨てた件数
+
+    def start(self):
+        """送信スレッドを開始"""
+        if self.thread and self.thread.is_alive():
+            return False
+        self.stopping = False
+        self.thread = threading.Thread(target=self._run, name="notification-coalescer", daemon=True)
+        self.thread.start()
+        return True
+
+    def stop(self):
+        """残っている通知を送信して停止"""
+        with self.condition:
+            self.stopping = True
+            self.condition.notify_all()
+        if self.thread:
+            self.thread.join(timeout=5.0)
+
+    def submit(self, kind: str, event: dict):
+        """通知を登録（前回の送信からウィンドウ以上空いていればすぐに送信、それ以外はまとめて送信）"""
+        if kind not in self.senders:
+            raise ValueError(f"Unknown notification kind: {kind}")
+        with self.condition:
+            self.received[kind] = self.received.get(kind, 0) + 1
+            entry = self.pending.get(kind)
+            if entry is None:
+                # 前回の送信からウィンドウ内ならその終わりまで待ってまとめる
+                last_sent_at = self.last_sent_at.get(kind)
+                flush_at = time.time() if last_sent_at is None else last_sent_at + self.window
+                entry = {"events": [], "flush_at": flush_at, "dropped": 0}
+                self.pending[kind] = entry
+            if len(entry["events"]) >= self.max_events:
+                # 古い通知は件数だけ残す
+                entry["events"].pop(0)
+                entry["dropped"] += 1
+                self.dropped[kind] = self.dropped.get(kind, 0) + 1
+            entry["events"].append(event)
+            self.condition.notify_all()
+
+    def _run(self):
+        """送信時刻になった通知を送信"""
+        while True:
+            with self.condition:
+                now = time.time()
+                due = [kind for kind, entry in self.pending.items()
+                       if self.stopping or entry["flush_at"] <= now]
+                if not due:
+                    if self.stopping:
+                        return
+                    next_flush = min((entry["flush_at"] for entry in self.pending.values()), default=None)
+                    self.condition.wait(None if next_flush is None else max(0.0, next_flush - now))
+                    continue
+
+                ready = []
+                for kind in due:
+                    bucket = self.buckets.get(kind)
+                    if self.stopping or bucket is None or bucket.try_take(now):
+                        ready.append((kind, self.pending.pop(kind)))
+                        self.last_sent_at[kind] = now
+                    else:
+                        # 送信できるまで待ち、その間の通知も同じまとめに含める
+                        entry = self.pending[kind]
+                        entry["flush_at"] = now + max(self.window, bucket.seconds_until_token(now))
+                        self.suppressed[kind] = self.suppressed.get(kind, 0) + 1
+                        logger.info(
+                            f"通知のレート制限: {kind} {len(entry['events'])}件を"
+                            f"{entry['flush_at'] - now:.0f}秒後にまとめて送信します")
+
+            for kind, entry in ready:
+                self._send(kind, entry)
+
+    def _send(self, kind: str, entry: dict):
+        """まとめた通知を送信（送信は登録するだけなのでロックの外で呼ぶ）"""
+        events = entry["events"]
+        try:
+            ok = self.senders[kind](events, entry["dropped"])
+        except Exception as e:
+            logger.error(f"通知送信エラー ({kind}): {e}")
+            ok = False
+        with self.condition:
+            if ok:
+                self.sent_messages[kind] = self.sent_messages.get(kind, 0) + 1
+                merged = len(events) + entry["dropped"] - 1
+                self.merged[kind] = self.merged.get(kind, 0) + merged
+        if ok and len(events) > 1:
+            logger.info(f"通知をまとめて送信しました: {kind} {len(events) + entry['dropped']}件")
+
+    def get_stats(self):
+        """まとめ送信の統計情報を取得"""
+        with self.condition:
+            now = time.time()
+            next_token = {
+                kind: round(min(bucket.seconds_until_token(now), 86400), 1)
+                for kind, bucket in self.buckets.items()
+            }
+            return {
+                "window": self.window,
+                "pending": {kind: len(entry["events"]) for kind, entry in self.pending.items()},
+                "received": dict(self.received),
+                "sent_messages": dict(self.sent_messages),
+                "merged": dict(self.merged),
+                "suppressed": dict(self.suppressed),
+                "dropped": dict(self.dropped),
+                "tokens": {kind: round(bucket.tokens, 2) for kind, bucket in self.buckets.items()},
+                "next_token_seconds": next_token
+            }
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+録画開始前のフレームを保持するリングバッファ
+
+動き検知前の数秒間のフレームを事前確保した配列に上書きで保持し、
+録画開始時に録画ファイルの先頭へ書き込めるようにする
+"""
+
+import logging
+import threading
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class PreEventBuffer:
+    """事前確保したNumPy配列によるフレームのリングバッファ
+
+    定常時はフレームを配列にコピーするだけで、フレームごとのメモリ確保は行わない。
+    録画開始時は配列をそのまま録画ライターに渡し、書き終えて返却された配列を次に使い回す
+    """
+
+    def __init__(self, seconds: float = 3.0, max_bytes: int = 64 * 1024 * 1024, fps: float = 30.0):
+        self.seconds = seconds
+        self.max_bytes = max_bytes
+        self.fps = fps
+        self.lock = threading.Lock()
+        self.pool = None  # (スロット数, 高さ, 幅, 3) の配列
+        self.timestamps = None
+        self.index = 0
+        self.count = 0
+        self.lent = None  # 録画ライターに渡している (配列, 取得時刻)
+        self.spare = None  # 返却された (配列, 取得時刻)（次に使う）
+
+        # 統計情報
+        self.allocations = 0
+        self.flushed_events = 0
+        self.flushed_frames = 0
+
+    def _allocate(self, frame):
+        """フレームサイズに合わせて配列を確保"""
+        slots = int(self.seconds * self.fps)
+        slots = min(slots, self.max_bytes // frame.nbytes)
+        if slots <= 0:
+            self.pool = None
+            return
+
+        self.pool = np.empty((slots,) + frame.shape, dtype=frame.dtype)
+        self.timestamps = np.zeros(slots, dtype=np.float64)
+        self.index = 0
+        self.count = 0
+        self.allocations += 1
+        logger.info(
+            f"録画前バッファを確保しました: {slots}フレーム ({slots / self.fps:.1f}秒, {self.pool.nbytes / 1024 / 1024:.1f}MB)")
+
+    def push(self, frame, timestamp: float):
+        """フレームを追加（最も古いフレームを上書き）"""
+        if self.seconds <= 0:
+            return
+
+        with self.lock:
+            if self.pool is None and self.spare is not None:
+                # 返却された配列を使い回す
+                (self.pool, self.timestamps), self.spare = self.spare, None
+                self.index = 0
+                self.count = 0
+            if self.pool is None or self.pool.shape[1:] != frame.shape:
+                self._allocate(frame)
+                if self.pool is None:
+                    return
+
+            np.copyto(self.pool[self.index], frame)
+            self.timestamps[self.index] = timestamp
+            self.index = (self.index + 1) % len(self.pool)
+            self.count = min(self.count + 1, len(self.pool))
+
+    def drain(self):
+        """保持しているフレームを古い順に (フレーム, 取得時刻) のリストで取り出す
+
+        フレームは配列の一部をそのまま渡す（コピーしない）。録画ライターが書き終えるまで
+        上書きされないよう、release() で返却されるまで配列は使わない
+        """
+        with self.lock:
+            if self.pool is None or self.count == 0:
+                return []
+
+            pool, timestamps = self.pool, self.timestamps
+            slots = len(pool)
+            start = (self.index - self.count) % slots
+            frames = [(pool[(start + i) % slots], float(timestamps[(start + i) % slots]))
+                      for i in range(self.count)]
+
+            self.lent = (pool, timestamps)
+            self.pool = None
+            self.timestamps = None
+            self.index = 0
+            self.count = 0
+            self.flushed_events += 1
+            self.flushed_frames += len(frames)
+            return frames
+
+    def release(self):
+        """drain() で渡した配列を返却（録画ライターが書き終えたら呼ぶ）"""
+        with self.lock:
+            lent, self.lent = self.lent, None
+            # 返却前に新しい配列を確保していた場合は返却された配列を解放する（2つ目は保持しない）
+            if lent is not None and self.pool is None:
+                self.spare = lent
+
+    def clear(self):
+        """保持しているフレームを破棄"""
+        with self.lock:
+            self.index = 0
+            self.count = 0
+
+    def get_stats(self):
+        """バッファの統計情報を取得"""
+        with self.lock:
+            pool = self.pool if self.pool is not None else (self.spare and self.spare[0])
+            slots = len(pool) if pool is not None else 0
+            allocated = sum(pool.nbytes for pool in (
+                self.pool, self.lent and self.lent[0], self.spare and self.spare[0]) if pool is not None)
+            return {
+                "seconds": self.seconds,
+                "max_bytes": self.max_bytes,
+                "allocated_bytes": allocated,
+                "allocations": self.allocations,
+                "slots": slots,
+                "buffered_frames": self.count,
+                "buffered_seconds": round(self.count / self.fps, 2) if self.fps else 0,
+                "flushed_events": self.flushed_events,
+                "flushed_frames": self.flushed_frames
+            }
@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+"""
+録画ファイルのインデックス（SQLite）
+
+録画一覧をディレクトリの走査ではなくインデックスから返す。録画の確定・削除時に更新し、
+起動時にディレクトリと突き合わせて差分だけを反映する
+"""
+
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+SORT_COLUMNS = ["start_time", "end_time", "size", "duration", "filename"]
+# 並び替えに使う式（NULLがあるとキーセットでの比較ができないため値を入れる）
+SORT_KEYS = {
+    "start_time": "IFNULL(start_time, -1)",
+    "end_time": "IFNULL(end_time, -1)",
+    "size": "size",
+    "duration": "IFNULL(duration, -1)",
+    "filename": "filename",
+}
+TIMESTAMP_PATTERN = re.compile(r"(\d{8}_\d{6})")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS recordings (
+    filename TEXT PRIMARY KEY,
+    event_id TEXT,
+    segment INTEGER,
+    size INTEGER NOT NULL DEFAULT 0,
+    mtime REAL,
+    start_time REAL,
+    end_time REAL,
+    duration REAL,
+    codec TEXT,
+    width INTEGER,
+    height INTEGER,
+    fps REAL,
+    frame_count INTEGER,
+    thumbnail TEXT,
+    motion_frames INTEGER,
+    max_motion_area INTEGER,
+    in_progress INTEGER NOT NULL DEFAULT 0
+);
+DROP INDEX IF EXISTS idx_recordings_start_time;
+CREATE INDEX IF NOT EXISTS idx_recordings_start ON recordings (start_time);
+CREATE INDEX IF NOT EXISTS idx_recordings_sort_start_time ON recordings (IFNULL(start_time, -1), filename);
+CREATE INDEX IF NOT EXISTS idx_recordings_sort_end_time ON recordings (IFNULL(end_time, -1), filename);
+CREATE INDEX IF NOT EXISTS idx_recordings_sort_size ON recordings (size, filename);
+CREATE INDEX IF NOT EXISTS idx_recordings_sort_duration ON recordings (IFNULL(duration, -1), filename);
+CREATE INDEX IF NOT EXISTS idx_recordings_event_id ON recordings (event_id);
+CREATE TABLE IF NOT EXISTS metadata (
+    filename TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    source TEXT,
+    info TEXT
+);
+"""
+
+COLUMNS = [
+    "filename", "event_id", "segment", "size", "mtime", "start_time", "end_time",
+    "duration", "codec", "width", "height", "fps", "frame_count", "thumbnail",
+    "motion_frames", "max_motion_area", "in_progress"
+]
+
+
+def start_time_from_name(filename: str):
+    """ファイル名の日時（motion_YYYYMMDD_HHMMSS）から録画開始時刻を取得"""
+    match = TIMESTAMP_PATTERN.search(filename)
+    if not match:
+        return None
+    try:
+        return datetime.strptime(match.group(1), "%Y%m%d_%H%M%S").timestamp()
+    except ValueError:
+        return None
+
+
+class RecordingIndex:
+    """録画ファイルのインデックス"""
+
+    def __init__(self, db_path):
+        self.db_path = Path(db_path)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        with self.lock:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            self.connection.executescript(SCHEMA)
+            self.connection.commit()
+
+        # 件数のキャッシュ（録画の追加・削除で version が変わるまで使う）
+        self.version = 0
+        self.count_cache = {}
+
+        # 統計情報
+        self.last_reconcile = None
+
+    def upsert(self, entry: dict):
+        """録画ファイルの情報を登録・更新（指定した項目だけ上書き）"""
+        entry = {key: value for key, value in entry.items() if key in COLUMNS}
+        columns = list(entry)
+        updates = ", ".join(f"{column} = excluded.{column}" for column in columns if column != "filename")
+        sql = (
+            f"INSERT INTO recordings ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)}) "
+            f"ON CONFLICT(filename) DO UPDATE SET {updates}"
+        )
+        with self.lock:
+            self.connection.execute(sql, [entry[column] for column in columns])
+            self.connection.commit()
+            self.version += 1
+
+    def remove(self, filename: str):
+        """録画ファイルの情報を削除"""
+        with self.lock:
+            self.connection.execute("DELETE FROM recordings WHERE filename = ?", (filename,))
+            self.connection.execute("DELETE FROM metadata WHERE filename = ?", (filename,))
+            self.connection.commit()
+            self.version += 1
+
+    def get_metadata(self, filename: str):
+        """保存済みのメタデータを取得（size・mtimeで有効性を確認するのは呼び出し側）"""
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT * FROM metadata WHERE filename = ?", (filename,)).fetchone()
+        return dict(row) if row else None
+
+    def set_metadata(self, filename: str, size: int, mtime: float, source: str, info: str):
+        """メタデータを保存"""
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO metadata (filename, size, mtime, source, info) VALUES (?, ?, ?, ?, ?)",
+                (filename, size, mtime, source, info))
+            self.connection.commit()
+
+    def iter_metadata(self, batch_size: int = 500):
+        """保存済みのメタデータを全件順に取得（ロックは1回の取得ごとに解放）"""
+        last = ""
+        while True:
+            with self.lock:
+                rows = self.connection.execute(
+                    "SELECT * FROM metadata WHERE filename > ? ORDER BY filename LIMIT ?",
+                    (last, batch_size)).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield dict(row)
+            last = rows[-1]["filename"]
+
+    def get(self, filename: str):
+        """録画ファイルの情報を取得"""
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT * FROM recordings WHERE filename = ?", (filename,)).fetchone()
+        return dict(row) if row else None
+
+    def refresh_file(self, path: Path, **values):
+        """ファイルのサイズ・更新日時を読み直して更新（変換後など）"""
+        try:
+            stat = path.stat()
+        except OSError:
+            self.remove(path.name)
+            return
+        self.upsert({"filename": path.name, "size": stat.st_size, "mtime": stat.st_mtime, **values})
+
+    def set_thumbnail(self, filename: str, thumbnail: str):
+        """サムネイルを登録（インデックスにない録画は無視）"""
+        with self.lock:
+            self.connection.execute(
+                "UPDATE recordings SET thumbnail = ? WHERE filename = ?", (thumbnail, filename))
+            self.connection.commit()
+
+    def missing_thumbnails(self):
+        """サムネイルが未登録の録画ファイル名を新しい順に取得（録画中を除く）"""
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT filename FROM recordings WHERE thumbnail IS NULL AND in_progress = 0 "
+                "ORDER BY start_time DESC").fetchall()
+        return [row[0] for row in rows]
+
+    def oldest(self, limit: int = 50, before: float = None):
+        """録画終了済みのものを古い順に取得（保存期間の管理用）"""
+        sql = "SELECT filename, size, start_time, thumbnail FROM recordings WHERE in_progress = 0"
+        params = []
+        if before is not None:
+            sql += " AND start_time < ?"
+            params.append(before)
+        with self.lock:
+            rows = self.connection.execute(
+                f"{sql} ORDER BY start_time ASC, filename ASC LIMIT ?", params + [limit]).fetchall()
+        return [dict(row) for row in rows]
+
+    def query(self, sort: str = "start_time", order: str = "desc", limit: int = 100, offset: int = 0,
+              since: float = None, until: float = None, event_id: str = None, after=None):
+        """条件に合う録画を1ページ分取得（並び替えはインデックスを使用）
+
+        after: 前のページの最後の (並び替えの値, ファイル名)。指定するとOFFSETを使わずに続きから取得する
+        (録画のリスト, 条件に合う総数) を返す
+        """
+        if sort not in SORT_COLUMNS:
+            raise ValueError(f"Unknown sort column: {sort}")
+        direction = "ASC" if order == "asc" else "DESC"
+        key = SORT_KEYS[sort]
+
+        conditions, params = [], []
+        if since is not None:
+            conditions.append("start_time >= ?")
+            params.append(since)
+        if until is not None:
+            conditions.append("start_time < ?")
+            params.append(until)
+        if event_id is not None:
+            conditions.append("event_id = ?")
+            params.append(event_id)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        page_conditions, page_params = list(conditions), list(params)
+        if after is not None:
+            page_conditions.append(f"({key}, filename) {'>' if direction == 'ASC' else '<'} (?, ?)")
+            page_params += list(after)
+            offset = 0
+        page_where = f"WHERE {' AND '.join(page_conditions)}" if page_conditions else ""
+
+        with self.lock:
+            rows = self.connection.execute(
+                f"SELECT * FROM recordings {page_where} ORDER BY {key} {direction}, filename {direction} "
+                f"LIMIT ? OFFSET ?", page_params + [limit, offset]).fetchall()
+            total = self._count(where, params)
+        return [dict(row) for row in rows], total
+
+    def _count(self, where: str, params: list):
+        """条件に合う件数（録画が変わるまでキャッシュを使う、lockを取得して呼ぶ）"""
+        cache_key = (where, tuple(params))
+        cached = self.count_cache.get(cache_key)
+        if cached and cached[0] == self.version:
+            return cached[1]
+        total = self.connection.execute(f"SELECT COUNT(*) FROM recordings {where}", params).fetchone()[0]
+        if len(self.count_cache) >= 64:
+            self.count_cache.clear()
+        self.count_cache[cache_key] = (self.version, total)
+        return total
+
+    @staticmethod
+    def sort_value(row: dict, sort: str):
+        """行の並び替えの値（query の after に渡す）"""
+        value = row.get(sort)
+        if value is None and sort != "filename":
+            return -1
+        return value
+
+    def reconcile(self, recordings_dir: Path, include=None, active_paths=()):
+        """ディレクトリと突き合わせて、追加・削除・変更されたファイルだけを反映
+
+        include: 対象とするファイルか判定する関数（一時ファイルを除くなど）
+        """
+        started = time.time()
+        active_names = {Path(path).name for path in active_paths}
+        with self.lock:
+            known = {
+                row["filename"]: (row["size"], row["mtime"], row["in_progress"])
+                for row in self.connection.execute("SELECT filename, size, mtime, in_progress FROM recordings")
+            }
+
+        found = {}
+        with os.scandir(recordings_dir) as entries:
+            for entry in entries:
+                if not entry.name.endswith(".mp4") or not entry.is_file():
+                    continue
+                if include and not include(Path(entry.path)):
+                    continue
+                found[entry.name] = entry.stat()
+
+        added = updated = 0
+        with self.lock:
+            for name, stat in found.items():
+                in_progress = 1 if name in active_names else 0
+                previous = known.get(name)
+                if previous == (stat.st_size, stat.st_mtime, in_progress):
+                    continue
+                if previous is None:
+                    start_time = start_time_from_name(name) or stat.st_mtime
+                    self.connection.execute(
+                        "INSERT INTO recordings (filename, size, mtime, start_time, end_time, in_progress) "
+                        "VALUES (?, ?, ?, ?, ?, ?)",
+                        (name, stat.st_size, stat.st_mtime, start_time, stat.st_mtime, in_progress))
+                    added += 1
+                else:
+                    # 変更されたファイル（変換・書き込み途中で停止したものなど）
+                    self.connection.execute(
+                        "UPDATE recordings SET size = ?, mtime = ?, in_progress = ? WHERE filename = ?",
+                        (stat.st_size, stat.st_mtime, in_progress, name))
+                    updated += 1
+
+            removed = [name for name in known if name not in found]
+            self.connection.executemany(
+                "DELETE FROM recordings WHERE filename = ?", [(name,) for name in removed])
+            self.connection.executemany(
+                "DELETE FROM metadata WHERE filename = ?", [(name,) for name in removed])
+            self.connection.commit()
+            self.version += 1
+
+        self.last_reconcile = {
+            "files": len(found),
+            "added": added,
+            "updated": updated,
+            "removed": len(removed),
+            "seconds": round(time.time() - started, 3)
+        }
+        logger.info(
+            f"録画インデックスを更新しました: {len(found)}件 "
+            f"(追加 {added}, 変更 {updated}, 削除 {len(removed)}, {self.last_reconcile['seconds']}秒)")
+        return self.last_reconcile
+
+    def get_stats(self):
+        """インデックスの統計情報を取得"""
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM recordings").fetchone()
+        return {
+            "recordings": row[0],
+            "total_bytes": row[1],
+            "last_reconcile": self.last_reconcile
+        }
+
+    def close(self):
+        """データベースを閉じる"""
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+録画ファイルのメタデータキャッシュ
+
+/recordings/{filename}/info のたびに ffprobe を起動しないよう、結果を録画インデックスに保存する。
+録画の確定時には録画側が知っている値（フレーム数・FPS・解像度）から作成し、
+ファイルのサイズ・更新日時が変わった場合（変換後など）だけ ffprobe で取得し直す
+"""
+
+import json
+import logging
+import threading
+from collections import OrderedDict
+from fractions import Fraction
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+
+def recorder_info(segment: dict, size: int):
+    """録画側の値から ffprobe と同じ形式の情報を作成"""
+    fps = segment.get("fps") or 0
+    frame_rate = Fraction(fps).limit_denominator(1001) if fps else Fraction(0)
+    return {
+        "streams": [{
+            "index": 0,
+            "codec_type": "video",
+            "codec_name": segment.get("codec"),
+            "width": segment.get("width"),
+            "height": segment.get("height"),
+            "r_frame_rate": f"{frame_rate.numerator}/{frame_rate.denominator}",
+            "avg_frame_rate": f"{frame_rate.numerator}/{frame_rate.denominator}",
+            "nb_frames": str(segment.get("frame_count") or 0),
+            "duration": f"{segment.get('duration') or 0:.6f}"
+        }],
+        "format": {
+            "filename": segment.get("filename"),
+            "nb_streams": 1,
+            "format_name": "mov,mp4,m4a,3gp,3g2,mj2",
+            "duration": f"{segment.get('duration') or 0:.6f}",
+            "size": str(size)
+        }
+    }
+
+
+class RecordingMetadataCache:
+    """メタデータのキャッシュ（メモリ上のLRU + 録画インデックスへの保存）"""
+
+    def __init__(self, index, prober, max_entries: int = 256):
+        self.index = index
+        self.prober = prober  # ファイルパスから ffprobe の結果（dict または None）を返す関数
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # ファイル名 -> (size, mtime, source, info)
+        self.lock = threading.Lock()
+
+        # 統計情報
+        self.memory_hits = 0
+        self.stored_hits = 0
+        self.probes = 0
+        self.invalidations = 0
+
+    def _remember(self, filename, size, mtime, source, info):
+        """メモリ上のキャッシュに登録"""
+        with self.lock:
+            self.entries[filename] = (size, mtime, source, info)
+            self.entries.move_to_end(filename)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def store(self, path: Path, source: str, info: dict):
+        """メタデータを保存（現在のサイズ・更新日時で登録）"""
+        stat = path.stat()
+        self.index.set_metadata(path.name, stat.st_size, stat.st_mtime, source, json.dumps(info))
+        self._remember(path.name, stat.st_size, stat.st_mtime, source, info)
+
+    def store_from_recorder(self, path: Path, segment: dict):
+        """録画の確定時に録画側の値から登録（ffprobeは起動しない）"""
+        self.store(path, "recorder", recorder_info(segment, path.stat().st_size))
+
+    def lookup(self, path: Path, stat=None):
+        """キャッシュ済みのメタデータを (情報, 取得元) で返す（ないか古ければ (None, None)）"""
+        stat = stat or path.stat()
+        key = (stat.st_size, stat.st_mtime)
+
+        with self.lock:
+            entry = self.entries.get(path.name)
+            if entry and entry[:2] == key:
+                self.entries.move_to_end(path.name)
+                self.memory_hits += 1
+                return entry[3], entry[2]
+
+        stored = self.index.get_metadata(path.name)
+        if stored and (stored["size"], stored["mtime"]) == key:
+            info = json.loads(stored["info"])
+            with self.lock:
+                self.stored_hits += 1
+            self._remember(path.name, stat.st_size, stat.st_mtime, stored["source"], info)
+            return info, stored["source"]
+
+        if stored or entry:
+            # ファイルが変わったため取得し直す
+            with self.lock:
+                self.invalidations += 1
+        return None, None
+
+    def get(self, path: Path, stat=None):
+        """メタデータを取得 (情報, 取得元) を返す（キャッシュになければ ffprobe で取得）"""
+        info, source = self.lookup(path, stat)
+        if info is not None:
+            return info, source
+        return self.probe(path)
+
+    def probe(self, path: Path):
+        """ffprobe で取得して保存 (情報, 取得元) を返す（失敗時は (None, None)）"""
+        with self.lock:
+            self.probes += 1
+        info = self.prober(path)
+        if info is None:
+            return None, None
+        self.store(path, "ffprobe", info)
+        return info, "ffprobe"
+
+    def export(self):
+        """保存済みのメタデータを全件取得（1件ずつ生成）"""
+        for row in self.index.iter_metadata():
+            yield {
+                "filename": row["filename"],
+                "size": row["size"],
+                "mtime": row["mtime"],
+                "source": row["source"],
+                "info": json.loads(row["info"])
+            }
+
+    def get_stats(self):
+        """キャッシュの統計情報を取得"""
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "max_entries": self.max_entries,
+                "memory_hits": self.memory_hits,
+                "stored_hits": self.stored_hits,
+                "probes": self.probes,
+                "invalidations": self.invalidations
+            }
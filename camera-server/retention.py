@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+録画ファイルの保存期間・容量の管理
+
+合計サイズの上限・保存日数・ディスクの最低空き容量のいずれかを超えたら、
+古い録画からサムネイルと一緒に削除する。対象は録画インデックスから古い順に少しずつ取得し、
+ディレクトリ全体の走査はしない。録画中のファイルは削除しない
+"""
+
+import logging
+import shutil
+import threading
+import time
+from pathlib import Path
+
+from convert_recordings import BACKUP_SUFFIX
+
+logger = logging.getLogger(__name__)
+
+
+class RetentionManager:
+    """録画ファイルの保存ポリシーを適用するバックグラウンド処理"""
+
+    def __init__(self, index, recordings_dir: Path, thumbnails_dir: Path,
+                 max_bytes: int = 0, max_age_seconds: float = 0, min_free_bytes: int = 0,
+                 interval: float = 60.0, batch_size: int = 20, active_paths=None, on_evicted=None):
+        self.index = index
+        self.recordings_dir = Path(recordings_dir)
+        self.thumbnails_dir = Path(thumbnails_dir)
+        self.max_bytes = max_bytes  # 0は無制限
+        self.max_age_seconds = max_age_seconds  # 0は無制限
+        self.min_free_bytes = min_free_bytes  # 0は確認しない
+        self.interval = interval
+        self.batch_size = batch_size  # 1回の確認で削除する最大件数
+        self.active_paths = active_paths  # 録画中のパスの集合を返す関数
+        self.on_evicted = on_evicted  # (録画ファイル名, サムネイルのパス) を受け取る関数
+        self.backups = []  # 変換で残った .backup.mp4（起動時に1回だけ確認）
+        self.lock = threading.Lock()
+        self.thread = None
+        self.stop_event = threading.Event()
+        self.wake_event = threading.Event()
+
+        # 統計情報
+        self.evicted = {"max_age": 0, "max_bytes": 0, "min_free": 0, "backup": 0}
+        self.freed_bytes = 0
+        self.skipped_active = 0
+        self.errors = 0
+        self.runs = 0
+        self.last_run = None
+        self.last_eviction = None
+
+    def start(self):
+        """バックグラウンドで開始（録画インデックスの初期化後に呼ぶ）"""
+        if self.thread and self.thread.is_alive():
+            return False
+        self._find_backups()
+        self.stop_event.clear()
+        logger.info(
+            f"録画の保存管理を開始しました (上限: {self.max_bytes // (1024 * 1024)}MB, "
+            f"保存期間: {self.max_age_seconds / 86400:g}日, 最低空き容量: {self.min_free_bytes // (1024 * 1024)}MB, "
+            f"0は無制限)")
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        return True
+
+    def stop(self):
+        """停止"""
+        self.stop_event.set()
+        self.wake_event.set()
+
+    def notify(self):
+        """録画の確定時などに確認を前倒しする"""
+        self.wake_event.set()
+
+    def _find_backups(self):
+        """変換で残った .backup.mp4 を確認（古い順）"""
+        try:
+            backups = sorted(self.recordings_dir.glob(f"*{BACKUP_SUFFIX}"), key=lambda path: path.stat().st_mtime)
+        except OSError as e:
+            logger.error(f"バックアップファイルの確認エラー: {e}")
+            backups = []
+        with self.lock:
+            self.backups = backups
+
+    def _run(self):
+        """一定間隔で保存ポリシーを確認"""
+        while not self.stop_event.is_set():
+            try:
+                more = self.enforce()
+            except Exception as e:
+                logger.error(f"録画の保存管理エラー: {e}")
+                with self.lock:
+                    self.errors += 1
+                more = False
+            if more:
+                # まだ超過しているので続けて削除（間隔を空けて録画への影響を抑える）
+                self.stop_event.wait(1.0)
+                continue
+            self.wake_event.wait(self.interval)
+            self.wake_event.clear()
+
+    def _free_bytes(self):
+        """録画ディレクトリのディスクの空き容量"""
+        return shutil.disk_usage(self.recordings_dir).free
+
+    def _over_limit(self, total_bytes: int, free_bytes: int):
+        """容量のポリシーを超えていれば理由を返す"""
+        if self.min_free_bytes and free_bytes < self.min_free_bytes:
+            return "min_free"
+        if self.max_bytes and total_bytes > self.max_bytes:
+            return "max_bytes"
+        return None
+
+    def enforce(self):
+        """保存ポリシーを1回分適用（まだ超過していればTrueを返す）"""
+        started = time.time()
+        active = {Path(path).name for path in (self.active_paths() if self.active_paths else ())}
+        total_bytes = self.index.get_stats()["total_bytes"]
+        free_bytes = self._free_bytes()
+        removed = 0
+
+        # 変換で残ったバックアップは録画より先に削除する
+        while self.backups and self._over_limit(total_bytes, free_bytes) and removed < self.batch_size:
+            with self.lock:
+                backup = self.backups.pop(0)
+            _, size = self._unlink(backup)
+            if size is not None:
+                free_bytes += size
+                self._count("backup", size)
+                removed += 1
+
+        # 保存期間を過ぎた録画
+        if self.max_age_seconds:
+            for row in self.index.oldest(self.batch_size - removed, before=started - self.max_age_seconds):
+                if self._evict(row, active, "max_age"):
+                    total_bytes -= row["size"]
+                    free_bytes += row["size"]
+                    removed += 1
+
+        # 容量を超えている間は古い録画から削除
+        candidates = []
+        skipped = set(active)  # 録画中・削除に失敗した録画
+        while removed < self.batch_size:
+            reason = self._over_limit(total_bytes, free_bytes)
+            if not reason:
+                break
+            if not candidates:
+                candidates = [row for row in self.index.oldest(self.batch_size + len(skipped))
+                              if row["filename"] not in skipped]
+                if not candidates:
+                    logger.error(f"容量を超えていますが削除できる録画がありません ({reason})")
+                    break
+            row = candidates.pop(0)
+            if self._evict(row, active, reason):
+                total_bytes -= row["size"]
+                free_bytes += row["size"]
+                removed += 1
+            else:
+                skipped.add(row["filename"])
+
+        with self.lock:
+            self.runs += 1
+            self.last_run = {
+                "at": started,
+                "removed": removed,
+                "seconds": round(time.time() - started, 3)
+            }
+        if removed:
+            logger.info(f"古い録画を削除しました: {removed}件")
+        over_age = bool(self.max_age_seconds and self.index.oldest(1, before=started - self.max_age_seconds))
+        return removed >= self.batch_size and (over_age or bool(self._over_limit(total_bytes, free_bytes)))
+
+    def _evict(self, row: dict, active: set, reason: str):
+        """録画とサムネイルを削除"""
+        filename = row["filename"]
+        if filename in active:
+            with self.lock:
+                self.skipped_active += 1
+            return False
+
+        deleted, size = self._unlink(self.recordings_dir / filename)
+        if not deleted:
+            # 削除できなかった録画はインデックスに残し、次の確認で再試行する
+            return False
+        self.index.remove(filename)
+        thumbnail_path = self.thumbnails_dir / (row.get("thumbnail") or f"{Path(filename).stem}_thumb.jpg")
+        self._unlink(thumbnail_path)
+        if self.on_evicted:
+            try:
+                self.on_evicted(filename, thumbnail_path)
+            except Exception as e:
+                logger.error(f"録画削除後の処理エラー: {e}")
+
+        self._count(reason, size or 0)
+        with self.lock:
+            self.last_eviction = {"filename": filename, "reason": reason, "at": time.time()}
+        logger.info(f"録画を削除しました ({reason}): {filename}")
+        return True
+
+    def _unlink(self, path: Path):
+        """ファイルを削除して (削除できたか, 削除したサイズ) を返す
+
+        すでにない場合は (True, None)、削除に失敗した場合は (False, None)
+        """
+        try:
+            size = path.stat().st_size
+            path.unlink()
+            return True, size
+        except FileNotFoundError:
+            return True, None
+        except OSError as e:
+            logger.error(f"ファイル削除エラー: {path.name}: {e}")
+            with self.lock:
+                self.errors += 1
+            return False, None
+
+    def _count(self, reason: str, size: int):
+        """削除件数を記録"""
+        with self.lock:
+            self.evicted[reason] += 1
+            self.freed_bytes += size
+
+    def get_stats(self):
+        """使用量・削除の統計情報を取得"""
+        index_stats = self.index.get_stats()
+        disk = shutil.disk_usage(self.recordings_dir)
+        with self.lock:
+            return {
+                "running": bool(self.thread and self.thread.is_alive()),
+                "policy": {
+                    "max_bytes": self.max_bytes,
+                    "max_age_seconds": self.max_age_seconds,
+                    "min_free_bytes": self.min_free_bytes,
+                    "interval": self.interval
+                },
+                "usage": {
+                    "recordings": index_stats["recordings"],
+                    "recordings_bytes": index_stats["total_bytes"],
+                    "backups": len(self.backups),
+                    "disk_total_bytes": disk.total,
+                    "disk_free_bytes": disk.free
+                },
+                "evicted": dict(self.evicted),
+                "freed_bytes": self.freed_bytes,
+                "skipped_active": self.skipped_active,
+                "errors": self.errors,
+                "runs": self.runs,
+                "last_run": self.last_run,
+                "last_eviction": self.last_eviction
+            }
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+DynamoDB まとめ書き込み（BatchedTableWriter）のテスト
+
+batch_writer を持つ偽のテーブルで、件数・経過時間での書き込み、バックオフしての再試行、
+overwrite_by_pkeys での重複除去、停止時の書き込みを確認する
+"""
+
+import threading
+import time
+
+from dynamodb_writer import BatchedTableWriter
+
+
+class FakeBatchWriter:
+    """boto3 の BatchWriter と同じく with を抜けた時にまとめて書き込む"""
+
+    def __init__(self, table, overwrite_by_pkeys=None):
+        self.table = table
+        self.overwrite_by_pkeys = overwrite_by_pkeys
+        self.items = []
+
+    def __enter__(self):
+        return self
+
+    def put_item(self, Item):
+        if self.overwrite_by_pkeys:
+            # 同じキーの項目は後から登録したものだけ残す
+            key = tuple(Item[name] for name in self.overwrite_by_pkeys)
+            self.items = [item for item in self.items
+                          if tuple(item[name] for name in self.overwrite_by_pkeys) != key]
+        self.items.append(Item)
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type:
+            return False
+        self.table.flush(self)
+        return False
+
+
+class FakeTable:
+    """書き込んだまとめと試行時刻を記録するテーブル（fail_count 回だけ失敗する）"""
+
+    def __init__(self, fail_count=0):
+        self.fail_count = fail_count
+        self.batches = []
+        self.attempted_at = []
+        self.writer_kwargs = []
+        self.lock = threading.Lock()
+
+    def batch_writer(self, **kwargs):
+        self.writer_kwargs.append(kwargs)
+        return FakeBatchWriter(self, **kwargs)
+
+    def flush(self, writer):
+        with self.lock:
+            self.attempted_at.append(time.time())
+            if self.fail_count:
+                self.fail_count -= 1
+                raise RuntimeError("ProvisionedThroughputExceededException")
+            self.batches.append(list(writer.items))
+
+    def written(self):
+        with self.lock:
+            return [item for batch in self.batches for item in batch]
+
+
+def wait_until(condition, timeout=2.0):
+    """条件を満たすまで待つ"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return condition()
+
+
+def test_flush_by_size():
+    """件数がそろえば経過時間を待たずに書き込む"""
+    table = FakeTable()
+    writer = BatchedTableWriter(table, max_batch=3, flush_interval=10.0)
+    writer.start()
+    try:
+        for i in range(3):
+            writer.put({"requestId": str(i)})
+        assert wait_until(lambda: len(table.batches) == 1)
+        assert [item["requestId"] for item in table.batches[0]] == ["0", "1", "2"]
+    finally:
+        writer.stop()
+
+
+def test_max_batch_is_capped_at_batch_write_limit():
+    """1回の書き込みは BatchWriteItem の上限（25件）を超えない"""
+    table = FakeTable()
+    writer = BatchedTableWriter(table, max_batch=100, flush_interval=10.0)
+    for i in range(30):
+        writer.put({"requestId": str(i)})
+    writer.start()
+    writer.stop()
+    assert [len(batch) for batch in table.batches] == [25, 5]
+
+
+def test_flush_by_time():
+    """件数がそろわなくても flush_interval が過ぎれば書き込む"""
+    table = FakeTable()
+    writer = BatchedTableWriter(table, max_batch=25, flush_interval=0.1)
+    writer.start()
+    try:
+        queued_at = time.time()
+        writer.put({"requestId": "1"})
+        assert wait_until(lambda: table.batches)
+        assert table.attempted_at[0] - queued_at >= 0.09
+        assert writer.get_stats()["written"] == 1
+    finally:
+        writer.stop()
+
+
+def test_retry_with_backoff():
+    """失敗した書き込みは待ち行列に戻し、待ち時間を倍にしながら再試行する"""
+    table = FakeTable(fail_count=2)
+    writer = BatchedTableWriter(table, max_batch=1, flush_interval=0.0, backoff_base=0.05)
+    writer.start()
+    try:
+        writer.put({"requestId": "1"})
+        assert wait_until(lambda: table.batches)
+        first, second, third = table.attempted_at
+        assert second - first >= 0.09  # backoff_base * 2
+        assert third - second >= 0.19  # backoff_base * 4
+        stats = writer.get_stats()
+        assert stats["written"] == 1
+        assert stats["retries"] == 2
+        assert stats["failed"] == 0
+        assert "ProvisionedThroughputExceededException" in stats["last_error"]
+    finally:
+        writer.stop()
+
+
+def test_gives_up_after_max_attempts():
+    """max_attempts 回失敗した項目は破棄して failed に数える"""
+    table = FakeTable(fail_count=100)
+    writer = BatchedTableWriter(table, max_batch=1, flush_interval=0.0, max_attempts=2, backoff_base=0.01)
+    writer.start()
+    try:
+        writer.put({"requestId": "1"})
+        assert wait_until(lambda: writer.get_stats()["failed"] == 1)
+        assert len(table.attempted_at) == 2
+        assert writer.get_stats()["queued"] == 0
+        assert table.batches == []
+    finally:
+        writer.stop()
+
+
+def test_overwrite_by_pkeys_dedup():
+    """key_names を指定すると同じキーの項目は最後のものだけ書き込む"""
+    table = FakeTable()
+    writer = BatchedTableWriter(table, max_batch=3, flush_interval=10.0, key_names=["requestId"])
+    writer.start()
+    try:
+        writer.put({"requestId": "1", "status": "old"})
+        writer.put({"requestId": "2", "status": "ok"})
+        writer.put({"requestId": "1", "status": "new"})
+        assert wait_until(lambda: table.batches)
+        assert table.writer_kwargs[0] == {"overwrite_by_pkeys": ["requestId"]}
+        assert sorted((item["requestId"], item["status"]) for item in table.batches[0]) == [
+            ("1", "new"), ("2", "ok")]
+    finally:
+        writer.stop()
+
+
+def test_without_key_names_keeps_every_item():
+    """key_names がなければ overwrite_by_pkeys を渡さない"""
+    table = FakeTable()
+    writer = BatchedTableWriter(table, max_batch=2, flush_interval=10.0)
+    writer.start()
+    try:
+        writer.put({"requestId": "1"})
+        writer.put({"requestId": "1"})
+        assert wait_until(lambda: table.batches)
+        assert table.writer_kwargs[0] == {}
+        assert len(table.batches[0]) == 2
+    finally:
+        writer.stop()
+
+
+def test_final_flush_on_stop():
+    """停止時は flush_interval を待たずに残りを書き込む"""
+    table = FakeTable()
+    writer = BatchedTableWriter(table, max_batch=25, flush_interval=60.0)
+    writer.start()
+    writer.put({"requestId": "1"})
+    writer.put({"requestId": "2"})
+    started_at = time.time()
+    writer.stop()
+    assert time.time() - started_at < 1.0
+    assert [item["requestId"] for item in table.written()] == ["1", "2"]
+    assert not writer.get_stats()["running"]
+
+
+def test_drops_oldest_when_queue_is_full():
+    """待ち行列が上限を超えたら古い項目から破棄する"""
+    table = FakeTable()
+    writer = BatchedTableWriter(table, max_batch=25, flush_interval=60.0, max_queue=2)
+    for i in range(3):
+        writer.put({"requestId": str(i)})
+    writer.start()
+    writer.stop()
+    assert [item["requestId"] for item in table.written()] == ["1", "2"]
+    assert writer.get_stats()["dropped"] == 1
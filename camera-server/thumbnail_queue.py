@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+サムネイル生成の待ち行列
+
+録画の確定時や起動時の走査でサムネイルのない録画を登録し、ワーカープールで生成する。
+録画一覧の取得ではデコードせず、生成待ちの状態だけを返す
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+from pathlib import Path
+
+from worker_pools import WorkerPoolFull
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+FAILED = "failed"
+
+
+class ThumbnailQueue:
+    """サムネイル生成の待ち行列（同じ録画は重複して登録しない）"""
+
+    def __init__(self, generator, pool, thumbnails_dir: Path, on_generated=None):
+        self.generator = generator
+        self.pool = pool
+        self.thumbnails_dir = Path(thumbnails_dir)
+        self.on_generated = on_generated  # (録画ファイル名, サムネイル名) を受け取る関数
+        self.states = {}  # 録画ファイル名 -> PENDING / FAILED
+        self.enqueued_at = {}
+        self.lock = threading.Lock()
+
+        # 統計情報
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.latencies = deque(maxlen=200)  # 登録から生成完了までの時間（秒）
+
+    @staticmethod
+    def thumbnail_name(filename: str):
+        """録画ファイル名に対応するサムネイル名"""
+        return f"{Path(filename).stem}_thumb.jpg"
+
+    def enqueue(self, video_path: Path, retry: bool = False):
+        """サムネイル生成を登録（登録済み・失敗済みなら何もしない）"""
+        video_path = Path(video_path)
+        name = video_path.name
+        with self.lock:
+            state = self.states.get(name)
+            if state == PENDING or (state == FAILED and not retry):
+                return False
+            self.states[name] = PENDING
+            self.enqueued_at[name] = time.time()
+
+        try:
+            self.pool.submit(self._generate, video_path)
+            return True
+        except WorkerPoolFull:
+            with self.lock:
+                self.states.pop(name, None)
+                self.enqueued_at.pop(name, None)
+                self.rejected += 1
+            return False
+
+    def _generate(self, video_path: Path):
+        """サムネイルを生成（ワーカースレッドで実行）"""
+        name = video_path.name
+        thumbnail_name = self.thumbnail_name(name)
+        thumbnail_path = self.thumbnails_dir / thumbnail_name
+
+        if not video_path.exists():
+            # 生成前に削除された録画
+            with self.lock:
+                self.states.pop(name, None)
+                self.enqueued_at.pop(name, None)
+            return
+
+        ok = thumbnail_path.exists() or self.generator(video_path, thumbnail_path)
+
+        # 状態を消す前に登録する（一覧から重複して登録されないように）
+        if ok and self.on_generated:
+            try:
+                self.on_generated(name, thumbnail_name)
+            except Exception as e:
+                logger.error(f"サムネイル登録エラー: {e}")
+
+        with self.lock:
+            enqueued_at = self.enqueued_at.pop(name, None)
+            if enqueued_at is not None:
+                self.latencies.append(time.time() - enqueued_at)
+            if ok:
+                self.states.pop(name, None)
+                self.completed += 1
+            else:
+                self.states[name] = FAILED
+                self.failed += 1
+
+    def discard(self, filename: str):
+        """削除された録画の状態を破棄"""
+        with self.lock:
+            self.states.pop(filename, None)
+            self.enqueued_at.pop(filename, None)
+
+    def status(self, filename: str):
+        """生成状態を取得（登録されていなければNone）"""
+        with self.lock:
+            return self.states.get(filename)
+
+    def get_stats(self):
+        """待ち行列の統計情報を取得"""
+        with self.lock:
+            latencies = sorted(self.latencies)
+            backlog = sum(1 for state in self.states.values() if state == PENDING)
+            oldest = min(self.enqueued_at.values()) if self.enqueued_at else None
+            stats = {
+                "backlog": backlog,
+                "failed_files": len(self.states) - backlog,
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "oldest_pending_seconds": round(time.time() - oldest, 1) if oldest else 0,
+                "avg_latency_ms": round(sum(latencies) / len(latencies) * 1000, 1) if latencies else 0,
+                "p95_latency_ms": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000, 1)
+                if latencies else 0,
+            }
+        stats["pool"] = self.pool.get_stats()
+        return stats
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""
+録画用の動画エンコーダー
+
+cv2.VideoWriter と同じインターフェース（isOpened / write / release）で、
+ffmpegのサブプロセスに生フレームを渡してブラウザで再生できるH.264 MP4を直接作成する
+"""
+
+import logging
+import shutil
+import subprocess
+import threading
+import time
+from collections import deque
+from pathlib import Path
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+V4L2M2M_DEVICE = Path("/dev/video11")  # Raspberry Pi のハードウェアエンコーダー
+
+
+def ffmpeg_available() -> bool:
+    """ffmpegが利用可能か"""
+    return shutil.which("ffmpeg") is not None
+
+
+_encoders = None  # ffmpegのエンコーダー一覧（取得できた時だけ保存）
+_codec_results = {}  # (コーデック, 幅, 高さ) -> 試しにエンコードできたか（判定できた時だけ保存）
+_cache_lock = threading.Lock()
+
+
+def available_encoders():
+    """ffmpegで利用可能なエンコーダー名の一覧を取得（タイムアウトなどで取得できなければNone）"""
+    global _encoders
+    with _cache_lock:
+        if _encoders is not None:
+            return _encoders
+    if not ffmpeg_available():
+        return frozenset()
+    try:
+        result = subprocess.run(
+            ["ffmpeg", "-hide_banner", "-encoders"],
+            capture_output=True, text=True, timeout=10)
+    except (OSError, subprocess.TimeoutExpired) as e:
+        logger.warning(f"ffmpegのエンコーダー一覧を取得できませんでした: {e}")
+        return None
+
+    encoders = set()
+    for line in result.stdout.splitlines():
+        parts = line.split()
+        # " V....D libx264  ..." の形式
+        if len(parts) >= 2 and parts[0].startswith("V"):
+            encoders.add(parts[1])
+    with _cache_lock:
+        _encoders = frozenset(encoders)
+        return _encoders
+
+
+def codec_works(codec: str, width: int = 640, height: int = 480):
+    """1フレームを試しにエンコードしてコーデックが使えるか確認（タイムアウトなどで判定できなければNone）
+
+    ハードウェアエンコーダーはエンコーダー一覧にあってもデバイスの設定に失敗することがあり、
+    起動直後の isOpened() では分からないため録画前に確認する
+    """
+    key = (codec, width, height)
+    with _cache_lock:
+        if key in _codec_results:
+            return _codec_results[key]
+    command = [
+        "ffmpeg", "-hide_banner", "-loglevel", "error",
+        "-f", "rawvideo", "-pix_fmt", "bgr24", "-s", f"{width}x{height}", "-i", "-",
+        "-frames:v", "1", "-c:v", codec, "-pix_fmt", "yuv420p", "-f", "null", "-"
+    ]
+    try:
+        result = subprocess.run(
+            command, input=bytes(width * height * 3), capture_output=True, timeout=15)
+    except (OSError, subprocess.TimeoutExpired) as e:
+        logger.warning(f"コーデック {codec} の確認に失敗しました: {e}")
+        return None
+    works = result.returncode == 0
+    if not works:
+        message = result.stderr.decode(errors="replace").strip()
+        logger.warning(f"コーデック {codec} でエンコードできません: {message[-300:]}")
+    with _cache_lock:
+        _codec_results[key] = works
+    return works
+
+
+def select_codec(codec: str = "auto"):
+    """使用するコーデックを決定（autoならハードウェアエンコーダーを優先）
+
+    (試しにエンコードできたコーデック, 判定が確定したか) を返す。利用できるコーデックがなければNone。
+    タイムアウトなどで確認できなかった場合は確定しない（後で確認し直す）
+    """
+    encoders = available_encoders()
+    if encoders is None:
+        return None, False
+    settled = True
+    if codec == "auto":
+        if "h264_v4l2m2m" in encoders and V4L2M2M_DEVICE.exists():
+            works = codec_works("h264_v4l2m2m")
+            if works:
+                return "h264_v4l2m2m", True
+            settled = works is not None
+        codec = "libx264"
+
+    if codec not in encoders:
+        logger.warning(f"ffmpegでコーデック {codec} が利用できません")
+        return None, settled
+    works = codec_works(codec)
+    if works is None:
+        return None, False
+    return (codec if works else None), settled
+
+
+class CodecSelector:
+    """録画に使うコーデックをバックグラウンドで決定
+
+    ffmpegの確認は数秒から十数秒かかるため、録画開始（キャプチャスレッド）では決定済みの結果だけを読む。
+    確認できなかった場合は retry_interval 秒後に確認し直す
+    """
+
+    def __init__(self, codec: str = "auto", retry_interval: float = 300.0):
+        self.requested = codec
+        self.retry_interval = retry_interval
+        self.codec = None
+        self.settled = False
+        self.retry_at = 0.0
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def start(self):
+        """コーデックの確認を開始（確認中・確定済みなら何もしない）"""
+        with self.lock:
+            if self.settled or (self.thread and self.thread.is_alive()):
+                return False
+            self.retry_at = time.time() + self.retry_interval
+            self.thread = threading.Thread(target=self._resolve, name="codec-selector", daemon=True)
+            self.thread.start()
+        return True
+
+    def _resolve(self):
+        """コーデックを確認して結果を保存"""
+        try:
+            codec, settled = select_codec(self.requested)
+        except Exception as e:
+            logger.error(f"コーデックの確認エラー: {e}")
+            codec, settled = None, False
+        with self.lock:
+            self.codec = codec
+            self.settled = settled
+        if codec:
+            logger.info(f"録画コーデック: {codec}")
+
+    def get(self):
+        """決定済みのコーデックを返す（未確定なら確認を始めてNone、待たない）"""
+        with self.lock:
+            codec, settled, retry_at = self.codec, self.settled, self.retry_at
+        if not settled and time.time() >= retry_at:
+            self.start()
+        return codec
+
+
+class FfmpegWriter:
+    """ffmpegサブプロセスによる動画ライター"""
+
+    def __init__(self, path, fps: float, frame_size, codec: str = "libx264",
+                 crf: int = 23, bitrate: str = None, preset: str = "ultrafast"):
+        self.path = Path(path)
+        self.codec = codec
+        self.process = None
+        self.failed = False
+        width, height = frame_size
+
+        command = [
+            "ffmpeg", "-hide_banner", "-loglevel", "error", "-y",
+            "-f", "rawvideo", "-pix_fmt", "bgr24",
+            "-s", f"{width}x{height}", "-r", f"{fps}",
+            "-i", "-",
+            "-c:v", codec,
+        ]
+        if codec == "libx264":
+            command += ["-preset", preset]
+            command += ["-b:v", bitrate] if bitrate else ["-crf", str(crf)]
+        else:
+            # ハードウェアエンコーダーはCRFに対応しないためビットレートで指定
+            command += ["-b:v", bitrate or "2M"]
+        command += ["-pix_fmt", "yuv420p", "-movflags", "+faststart", str(self.path)]
+
+        self.stderr_lines = deque(maxlen=20)  # エラー表示用に直近の出力だけ残す
+        self.stderr_thread = None
+        try:
+            self.process = subprocess.Popen(
+                command, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL,
+                stderr=subprocess.PIPE)
+        except OSError as e:
+            logger.error(f"ffmpegを起動できませんでした: {e}")
+            self.failed = True
+            return
+
+        # 出力を読み続けないとパイプが詰まってffmpegが止まるため別スレッドで読む
+        self.stderr_thread = threading.Thread(
+            target=self._read_stderr, args=(self.process.stderr,), name="ffmpeg-stderr", daemon=True)
+        self.stderr_thread.start()
+
+    def _read_stderr(self, stream):
+        """ffmpegのエラー出力を読み続ける"""
+        for line in iter(stream.readline, b""):
+            self.stderr_lines.append(line.decode(errors="replace").rstrip())
+        stream.close()
+
+    def isOpened(self) -> bool:
+        """エンコーダーが動作中か"""
+        return self.process is not None and not self.failed and self.process.poll() is None
+
+    def write(self, frame):
+        """フレームを書き込む"""
+        if self.failed or self.process is None:
+            return
+        try:
+            self.process.stdin.write(np.ascontiguousarray(frame).data)
+        except (BrokenPipeError, ValueError):
+            self.failed = True
+            logger.error(f"ffmpegへの書き込みに失敗しました: {self.path}")
+
+    def release(self):
+        """入力を閉じてエンコードの完了を待つ"""
+        if self.process is None:
+            return
+        process, self.process = self.process, None
+        try:
+            process.stdin.close()
+        except (BrokenPipeError, ValueError):
+            pass
+        try:
+            process.wait(timeout=60)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+        if self.stderr_thread:
+            self.stderr_thread.join(timeout=5)
+
+        if process.returncode != 0:
+            message = "\n".join(self.stderr_lines)
+            logger.error(f"ffmpegエンコードエラー ({self.codec}, 終了コード {process.returncode}): {message}")
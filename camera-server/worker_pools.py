@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+ブロッキング処理用のワーカープール
+
+OpenCVのエンコード・サムネイル生成・ffprobe などのブロッキング処理を
+asyncioのイベントループから切り離して実行する
+"""
+
+import asyncio
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class WorkerPoolFull(Exception):
+    """ワーカープールの待ち行列が上限に達した"""
+
+
+class BoundedWorkerPool:
+    """待ち行列の長さを制限したスレッドプール"""
+
+    def __init__(self, name: str, max_workers: int, max_queue: int):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix=name)
+        self.lock = threading.Lock()
+
+        # メトリクス
+        self.pending = 0  # 実行中 + 待機中
+        self.active = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.peak_queued = 0
+        self.total_wait_time = 0.0
+        self.total_run_time = 0.0
+
+    def submit(self, func, *args, **kwargs):
+        """ジョブを投入（上限超過時は WorkerPoolFull）"""
+        with self.lock:
+            if self.pending >= self.max_workers + self.max_queue:
+                self.rejected += 1
+                raise WorkerPoolFull(f"{self.name} プールが混雑しています")
+            self.pending += 1
+            queued = self.pending - self.active
+            self.peak_queued = max(self.peak_queued, queued)
+
+        submitted_at = time.time()
+
+        def run():
+            started_at = time.time()
+            with self.lock:
+                self.active += 1
+                self.total_wait_time += started_at - submitted_at
+            try:
+                result = func(*args, **kwargs)
+                with self.lock:
+                    self.completed += 1
+                return result
+            except Exception:
+                with self.lock:
+                    self.failed += 1
+                raise
+            finally:
+                with self.lock:
+                    self.active -= 1
+                    self.pending -= 1
+                    self.total_run_time += time.time() - started_at
+
+        try:
+            return self.executor.submit(run)
+        except Exception:
+            with self.lock:
+                self.pending -= 1
+            raise
+
+    async def run(self, func, *args, **kwargs):
+        """ジョブを投入して完了を待つ（イベントループはブロックしない）"""
+        return await asyncio.wrap_future(self.submit(func, *args, **kwargs))
+
+    def get_stats(self):
+        """プールの統計情報を取得"""
+        with self.lock:
+            finished = self.completed + self.failed
+            return {
+                "name": self.name,
+                "max_workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "active": self.active,
+                "queued": self.pending - self.active,
+                "peak_queued": self.peak_queued,
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "avg_wait_ms": round(self.total_wait_time / finished * 1000, 2) if finished else 0,
+                "avg_run_ms": round(self.total_run_time / finished * 1000, 2) if finished else 0
+            }
+
+    def shutdown(self):
+        """プールを停止"""
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        logger.info(f"ワーカープールを停止しました: {self.name}")
+
+
+# ライブ映像用（JPEGエンコードなど短時間の処理）
+frame_pool = BoundedWorkerPool(
+    "frame",
+    max_workers=int(os.getenv("FRAME_POOL_SIZE", "2")),
+    max_queue=int(os.getenv("FRAME_POOL_QUEUE", "8")))
+
+# 録画ファイル用（サムネイル生成・ffprobe など時間のかかる処理）
+media_pool = BoundedWorkerPool(
+    "media",
+    max_workers=int(os.getenv("MEDIA_POOL_SIZE", "2")),
+    max_queue=int(os.getenv("MEDIA_POOL_QUEUE", "32")))
+
+# サムネイル生成用（一括生成で待ち行列が長くなっても他の処理を待たせない）
+thumbnail_pool = BoundedWorkerPool(
+    "thumbnail",
+    max_workers=int(os.getenv("THUMBNAIL_POOL_SIZE", "1")),
+    max_queue=int(os.getenv("THUMBNAIL_POOL_QUEUE", "10000")))
+
+# IoTコマンド用（MQTTのコールバックスレッドを待たせない）
+iot_pool = BoundedWorkerPool(
+    "iot",
+    max_workers=int(os.getenv("IOT_POOL_SIZE", "2")),
+    max_queue=int(os.getenv("IOT_POOL_QUEUE", "32")))
+
+
+def get_pool_stats():
+    """全プールの統計情報を取得"""
+    return {pool.name: pool.get_stats() for pool in (frame_pool, media_pool, thumbnail_pool, iot_pool)}
+
+
+def shutdown_pools():
+    """全プールを停止"""
+    for pool in (frame_pool, media_pool, thumbnail_pool, iot_pool):
+        pool.shutdown()
@@ -48,6 +48,19 @@ interface MotionSettings {
     motion_cooldown: number
 }
 
+// 録画一覧の1回に読み込む件数（「さらに読み込む」で追加）
+const RECORDINGS_PAGE_SIZE = 50
+
+// 新しい先頭ページと読み込み済みの一覧をつなげる
+// （先頭ページの最後の録画より後ろは読み込み済みのものを残し、先頭ページの範囲で消えたものは除く）
+const mergeFirstPage = (firstPage: Recording[], loaded: Recording[]): Recording[] => {
+    const names = new Set(firstPage.map(recording => recording.filename))
+    const last = firstPage[firstPage.length - 1]
+    const boundary = last ? loaded.findIndex(recording => recording.filename === last.filename) : -1
+    const rest = boundary >= 0 ? loaded.slice(boundary + 1) : loaded
+    return [...firstPage, ...rest.filter(recording => !names.has(recording.filename))]
+}
+
 const App: React.FC = () => {
     const videoRef = useRef<HTMLVideoElement>(null)
     const [isConnected, setIsConnected] = useState(false)
@@ -55,7 +68,13 @@ const App: React.FC = () => {
     const [error, setError] = useState<string | null>(null)
     const [imageUrl, setImageUrl] = useState<string | null>(null)
     const [motionStatus, setMotionStatus] = useState<MotionStatus | null>(null)
+    const [liveSocketFailed, setLiveSocketFailed] = useState(false)
     const [recordings, setRecordings] = useState<Recording[]>([])
+    const [recordingsTotal, setRecordingsTotal] = useState(0)
+    const [hasMoreRecordings, setHasMoreRecordings] = useState(false)
+    // 次のページのカーソル（定期更新は先頭ページだけを取得し、続きはカーソルで追加する）
+    const recordingsCursorRef = useRef<string | null>(null)
+    const loadedMoreRecordingsRef = useRef(false)
     const [currentView, setCurrentView] = useState<'live' | 'recordings'>('live')
     const [selectedRecording, setSelectedRecording] = useState<Recording | null>(null)
     const [recordingInfo, setRecordingInfo] = useState<RecordingInfo | null>(null)
@@ -98,10 +117,6 @@ const App: React.FC = () => {
             if (response.ok) {
                 const status = await response.json()
                 setIsConnected(status.is_active)
-                if (status.is_active) {
-                    // カメラが起動中なら映像を取得
-                    fetchVideoFrame()
-                }
             }
         } catch (err) {
             console.error('カメラ状態確認エラー:', err)
@@ -130,7 +145,6 @@ const App: React.FC = () => {
             }
 
             setIsConnected(true)
-            fetchVideoFrame()
 
             // 録画一覧ページの場合は即座に録画一覧を読み込む
             if (currentView === 'recordings') {
@@ -188,34 +202,18 @@ http://172.20.10.2:8001
         }
     }
 
-    // 映像フレームを取得
-    const fetchVideoFrame = async () => {
-        try {
-            const cameraUrl = getCameraServerUrl()
-
-            // CloudFrontアクセス時は映像フレーム取得をスキップ
-            if (cameraUrl === '/api') {
-                setError('映像表示は同じWi-Fiネットワーク内からのみ利用可能です。\nカメラ制御機能は正常に動作します。')
-                return
-            }
-
-            const response = await fetch(`${cameraUrl}/video-frame`)
-
-            if (!response.ok) {
-                throw new Error('映像取得に失敗しました')
-            }
-
-            const data = await response.json()
-
-            if (data.error) {
-                throw new Error(data.error)
-            }
+    // 映像ストリーム（MJPEG）を開始
+    const startVideoStream = () => {
+        const cameraUrl = getCameraServerUrl()
 
-            setImageUrl(data.image)
-        } catch (err) {
-            console.error('映像取得エラー:', err)
-            setError(err instanceof Error ? err.message : '映像取得に失敗しました')
+        // CloudFrontアクセス時は映像ストリームをスキップ
+        if (cameraUrl === '/api') {
+            setError('映像表示は同じWi-Fiネットワーク内からのみ利用可能です。\nカメラ制御機能は正常に動作します。')
+            return
         }
+
+        // 再接続時にキャッシュされないようにタイムスタンプを付与
+        setImageUrl(`${cameraUrl}/video-stream?t=${Date.now()}`)
     }
 
     const fetchMotionStatus = async () => {
@@ -296,13 +294,56 @@ http://172.20.10.2:8001
         }
     }
 
+    // 先頭ページを取得し、読み込み済みの続きのページとつなげる
     const fetchRecordings = async () => {
         try {
             const cameraUrl = getCameraServerUrl()
-            const response = await fetch(`${cameraUrl}/recordings`)
+            const response = await fetch(`${cameraUrl}/recordings?limit=${RECORDINGS_PAGE_SIZE}`)
             if (response.ok) {
                 const data = await response.json()
-                setRecordings(data.recordings || [])
+                const firstPage: Recording[] = data.recordings || []
+                setRecordingsTotal(data.total || 0)
+                if (!data.has_more) {
+                    // 全件が先頭ページに収まる
+                    loadedMoreRecordingsRef.current = false
+                    recordingsCursorRef.current = null
+                    setRecordings(firstPage)
+                    setHasMoreRecordings(false)
+                    return
+                }
+                if (!loadedMoreRecordingsRef.current) {
+                    recordingsCursorRef.current = data.next_cursor
+                    setRecordings(firstPage)
+                    setHasMoreRecordings(Boolean(data.next_cursor))
+                    return
+                }
+                setRecordings(prev => mergeFirstPage(firstPage, prev))
+            }
+        } catch (err) {
+            console.error('録画一覧取得エラー:', err)
+        }
+    }
+
+    // 続きのページをカーソルで取得して末尾に追加
+    const loadMoreRecordings = async () => {
+        const cursor = recordingsCursorRef.current
+        if (!cursor) {
+            return
+        }
+        try {
+            const cameraUrl = getCameraServerUrl()
+            const response = await fetch(
+                `${cameraUrl}/recordings?limit=${RECORDINGS_PAGE_SIZE}&cursor=${encodeURIComponent(cursor)}`)
+            if (response.ok) {
+                const data = await response.json()
+                const page: Recording[] = data.recordings || []
+                loadedMoreRecordingsRef.current = true
+                recordingsCursorRef.current = data.next_cursor || null
+                setRecordings(prev => {
+                    const loaded = new Set(prev.map(recording => recording.filename))
+                    return [...prev, ...page.filter(recording => !loaded.has(recording.filename))]
+                })
+                setHasMoreRecordings(Boolean(data.next_cursor))
             }
         } catch (err) {
             console.error('録画一覧取得エラー:', err)
@@ -352,6 +393,8 @@ http://172.20.10.2:8001
                 method: 'DELETE'
             })
             if (response.ok) {
+                // 続きのページで読み込んだ録画は先頭ページの取得では消えないため一覧から外す
+                setRecordings(prev => prev.filter(recording => recording.filename !== filename))
                 await fetchRecordings()
                 if (selectedRecording?.filename === filename) {
                     setSelectedRecording(null)
@@ -438,27 +481,65 @@ http://172.20.10.2:8001
         checkCameraStatus()
     }, [])
 
-    // 定期的に映像を更新（カメラが起動中の場合）
+    // WebSocketで映像（バイナリJPEG）と動き検知状態（JSON差分）を受信
     useEffect(() => {
         if (!isConnected) return
 
-        const interval = setInterval(() => {
-            fetchVideoFrame()
-        }, 100) // 10FPS
+        const cameraUrl = getCameraServerUrl()
 
-        return () => clearInterval(interval)
+        // CloudFrontアクセス時は映像表示をスキップ
+        if (cameraUrl === '/api') {
+            setError('映像表示は同じWi-Fiネットワーク内からのみ利用可能です。\nカメラ制御機能は正常に動作します。')
+            return
+        }
+
+        setLiveSocketFailed(false)
+        const ws = new WebSocket(`${cameraUrl.replace(/^http/, 'ws')}/ws/live`)
+        ws.binaryType = 'blob'
+        let currentFrameUrl: string | null = null
+
+        ws.onmessage = (event) => {
+            if (typeof event.data === 'string') {
+                const message = JSON.parse(event.data)
+                if (message.type === 'status') {
+                    setMotionStatus(prev => ({ ...prev, ...message.data } as MotionStatus))
+                }
+                return
+            }
+
+            const frameUrl = URL.createObjectURL(event.data)
+            setImageUrl(frameUrl)
+            if (currentFrameUrl) {
+                URL.revokeObjectURL(currentFrameUrl)
+            }
+            currentFrameUrl = frameUrl
+        }
+
+        ws.onerror = () => {
+            // WebSocketが使えない場合はMJPEGストリームと状態ポーリングにフォールバック
+            console.error('WebSocket接続エラー: MJPEGストリームに切り替えます')
+            setLiveSocketFailed(true)
+            startVideoStream()
+        }
+
+        return () => {
+            ws.close()
+            if (currentFrameUrl) {
+                URL.revokeObjectURL(currentFrameUrl)
+            }
+        }
     }, [isConnected])
 
-    // 動き検知状態を定期的に更新（カメラが起動中の場合）
+    // 動き検知状態を定期的に更新（WebSocketが使えない場合のみ）
     useEffect(() => {
-        if (!isConnected) return
+        if (!isConnected || !liveSocketFailed) return
 
         const interval = setInterval(() => {
             fetchMotionStatus()
         }, 1000) // 1秒間隔
 
         return () => clearInterval(interval)
-    }, [isConnected])
+    }, [isConnected, liveSocketFailed])
 
     // 定期的に録画一覧を更新
     useEffect(() => {
@@ -869,6 +950,11 @@ http://172.20.10.2:8001
                                             <p>録画ファイルがありません</p>
                                         </div>
                                     )}
+                                    {hasMoreRecordings && (
+                                        <button onClick={loadMoreRecordings} className="load-more-button">
+                                            さらに読み込む（{recordings.length} / {recordingsTotal}件）
+                                        </button>
+                                    )}
                                 </div>
                             </div>
 